@@ -1,9 +1,13 @@
-from flask import Flask, request, jsonify, make_response, send_from_directory, render_template, session, redirect
+from flask import Flask, Response, request, jsonify, make_response, send_from_directory, render_template, session, redirect
 from flask_cors import CORS
-from script import ProductivityAnalyzer
+from script import ProductivityAnalyzer, QUESTION_CACHE_PRESEED
+from urls import parse_url
+from results import AnalysisResult, CachedResponse, ContextRelevance
+from json_provider import FastJSONProvider
 import logging
+import json
 from functools import lru_cache
-from urllib.parse import urlparse
+from urllib.parse import urlparse, unquote_plus
 import os
 import sys # Added for sys.exit
 import threading
@@ -31,6 +35,7 @@ app = Flask(__name__,
     template_folder='extension'
 )
 app.secret_key = 'secret_key_here' # CHANGE THIS IN PRODUCTION
+app.json = FastJSONProvider(app) # orjson when installed, for request bodies and responses
 
 # Enable detailed logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -125,6 +130,10 @@ CORS(app,
      }})
 
 analyzer = ProductivityAnalyzer()
+app.extensions['analyzer'] = analyzer  # gunicorn's post_worker_init prepares its model client (wsgi fallback)
+if QUESTION_CACHE_PRESEED:
+    # Seed first questions in the background so the dev server starts immediately
+    threading.Thread(target=analyzer.preseed_questions, daemon=True, name="question-preseed").start()
 
 # Cache structure and functions (Keep existing)
 url_cache = {
@@ -133,6 +142,18 @@ url_cache = {
     'session_ids': {}
 }
 CACHE_DURATION = 60
+
+def invalidate_cache(old_rules, new_rules):
+    """Drop the cached results a settings change may alter; the rest stay valid."""
+    keys = list(url_cache['data'])
+    stale = [key for key in keys if analyzer.settings_change_affects(old_rules, new_rules, *key)]
+    for key in stale:
+        url_cache['data'].pop(key, None)
+        url_cache['timestamps'].pop(key, None)
+        url_cache['session_ids'].pop(key, None)
+    logger.info(f"Settings {new_rules.version}: dropped {len(stale)} of {len(keys)} cached results")
+
+analyzer.add_settings_listener(invalidate_cache)
 def clear_expired_cache():
     # ... (keep existing implementation)
     current_time = time.time()
@@ -238,12 +259,47 @@ def get_question():
         context = data.get('context', {})
         if not domain:
             return jsonify({"error": "Domain is required"}), 400
-        response = analyzer.get_next_question(domain, context)
+        # Later rounds send only the session token and the new answer(s)
+        if data.get('batch'):
+            response = analyzer.get_question_batch(domain, context,
+                                                   session=data.get('session'), answers=data.get('answers'))
+        else:
+            response = analyzer.get_next_question(domain, context,
+                                                  session=data.get('session'), answer=data.get('answer'))
         return jsonify(response)
     except Exception as e:
         app.logger.error(f"Error in get_question: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/get_question/stream', methods=['POST'])
+def get_question_stream():
+    """Server-sent events variant of /get_question.
+
+    Sends 'token' events while the model writes the question, then one of
+    'question' (the usual /get_question body), 'done' or 'expired'.
+    """
+    data = request.get_json(silent=True) or {}
+    domain = data.get('domain')
+    if not domain:
+        return jsonify({"error": "Domain is required"}), 400
+    events = analyzer.stream_questions(domain, data.get('context', {}), session=data.get('session'),
+                                       answers=data.get('answers') or ([data['answer']] if data.get('answer') else []),
+                                       batch=bool(data.get('batch')))
+
+    def generate():
+        try:
+            for event, payload in events:
+                if event == 'token':
+                    yield f"event: token\ndata: {json.dumps({'text': payload})}\n\n"
+                else:
+                    name = 'expired' if payload.get('session_expired') else 'done' if payload.get('question') == 'DONE' else 'question'
+                    yield f"event: {name}\ndata: {json.dumps(payload)}\n\n"
+        finally:
+            events.close()  # Runs on client disconnect too, releasing the model stream and the worker
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/contextualize', methods=['POST'])
 def contextualize():
     # ... (keep existing implementation)
@@ -255,7 +311,9 @@ def contextualize():
             return jsonify({"error": "Domain is required"}), 400
         session['context'] = context
         session['domain'] = domain
-        return jsonify({"status": "success"})
+        # Compile the context once; /analyze then only needs the id
+        profile = analyzer.register_context(domain, context)
+        return jsonify({"status": "success", "context_id": profile.fingerprint})
     except Exception as e:
         app.logger.error(f"Error in contextualize: {e}")
         return jsonify({"error": str(e)}), 500
@@ -270,6 +328,7 @@ def analyze():
         url = data.get('url')
         domain = data.get('domain')
         context = data.get('context', [])
+        context_id = data.get('context_id')  # Registered context, sent instead of the full context
         session_id = data.get('session_id')  # Get session ID from request
         referrer = data.get('referrer')  # Get the referrer info for direct visits
         is_direct_visit = data.get('direct_visit', False)  # Flag indicating if this is a direct visit
@@ -279,30 +338,39 @@ def analyze():
 
         clear_expired_cache()
 
-        cache_key = f"{url}-{domain}"
+        cache_key = (url, domain)
         current_time = time.time()
 
         if (cache_key in url_cache['data'] and
             url_cache['session_ids'].get(cache_key) == session_id and # Use .get for safety
             current_time - url_cache['timestamps'].get(cache_key, 0) <= CACHE_DURATION): # Use .get for safety
             logger.debug(f"Cache hit for {url}")
-            return jsonify(url_cache['data'][cache_key])
-
-        # Convert context array to dictionary format
-        if isinstance(context, list):
-            context_dict = {}
-            for qa in context:
-                if isinstance(qa, dict):
-                    question = qa.get('question', '')
-                    answer = qa.get('answer', '')
-                    if question and answer:
-                        context_dict[question] = answer
-            logger.debug(f"Converted context to dictionary: {context_dict}")
-        else:
-            context_dict = context if isinstance(context, dict) else {}
-
-        analyzer.context_data = context_dict
-        logger.info(f"Set analyzer context to: {context_dict}")
+            # Sent as encoded when cached; re-encoded only once a pending explanation completes
+            return app.json.body_response(url_cache['data'][cache_key].current_body(analyzer, app.json.encode))
+        settings_version = analyzer.settings_version
+
+        # Reuse the compiled profile of a registered context; a full context is registered on the fly
+        profile = analyzer.resolve_context(domain, context_id, context)
+        if profile is None:
+            return jsonify({'error': 'Context expired', 'context_expired': True}), 409
+        analyzer.use_context(profile)
+        context_dict = profile.context_data
+        logger.info(f"Set analyzer context to profile {profile.fingerprint}")
+
+        # Over the analysis rate limit: answer 429 before any model call is started;
+        # this is not a verdict, so it is neither cached nor shown as a block
+        rate_limited = analyzer.admit_analysis(domain, session_id)
+        if rate_limited:
+            response = jsonify(rate_limited)
+            response.headers['Retry-After'] = str(max(1, round(rate_limited['retry_after'])))
+            return response, 429
+
+        # Parsed once; every stage below shares it
+        parsed_url = parse_url(url)
+
+        # Start the model call early for URLs predicted to reach the AI stage;
+        # the referrer, signal and relevance work below overlaps with it.
+        speculative = analyzer.speculate_ai(parsed_url, domain)
 
         try:
             additional_signals = {}
@@ -314,29 +382,25 @@ def analyze():
             is_search_engine_referrer = False
             if referrer:
                 logger.debug(f"Processing referrer information: {referrer}")
-                parsed_referrer = urlparse(referrer)
-                if any(search_domain in parsed_referrer.netloc.lower() for search_domain in
+                parsed_referrer = parse_url(referrer)
+                if any(search_domain in parsed_referrer.host for search_domain in
                        ['google.com', 'bing.com', 'duckduckgo.com', 'yahoo.com', 'brave.com', 'startpage.com']):
                     is_search_engine_referrer = True
                     additional_signals['from_search_engine'] = True
-                    additional_signals['search_engine'] = parsed_referrer.netloc
-                    query_params = parsed_referrer.query.split('&')
-                    for param in query_params:
-                        if '=' in param:
-                            key, value = param.split('=', 1)
-                            if key.lower() in ['q', 'query', 'p', 'text', 'search']:
-                                from urllib.parse import unquote_plus
-                                search_query = unquote_plus(value)
-                                additional_signals['search_query'] = search_query
-                                logger.debug(f"Extracted search query: {search_query}")
-                                break
-
-            url_signals = analyzer._analyze_url_components(url)
+                    additional_signals['search_engine'] = parsed_referrer.parts.netloc
+                    for key, value in parsed_referrer.query_params:
+                        if key.lower() in ['q', 'query', 'p', 'text', 'search']:
+                            search_query = unquote_plus(value)
+                            additional_signals['search_query'] = search_query
+                            logger.debug(f"Extracted search query: {search_query}")
+                            break
+
+            url_signals = analyzer._analyze_url_components(parsed_url)
             if additional_signals:
                 url_signals.update(additional_signals)
                 logger.debug(f"Enhanced URL signals with referrer/direct visit data: {url_signals}")
 
-            context_relevance = analyzer._check_context_relevance(url, url_signals)
+            context_relevance = analyzer._check_context_relevance(parsed_url, url_signals)
 
             if is_search_engine_referrer and search_query:
                 if len(search_query.strip()) < 3:
@@ -350,8 +414,8 @@ def analyze():
                         'context_relevance': context_relevance,
                         'search_query_blocked': True
                     })
-                if context_dict and context_relevance.get('score', 0) < 0.4:
-                    logger.info(f"Blocking URL due to low context relevance for search query: '{search_query}', score: {context_relevance.get('score', 0)}")
+                if context_dict and context_relevance.score < 0.4:
+                    logger.info(f"Blocking URL due to low context relevance for search query: '{search_query}', score: {context_relevance.score}")
                     # ... (return block response)
                     return jsonify({
                         'isProductive': False,
@@ -362,29 +426,35 @@ def analyze():
                         'search_query_blocked': True
                     })
 
-            analysis_result = analyzer.analyze_website(url, domain)
+            analysis_result = analyzer.analyze_website(parsed_url, domain, speculative=speculative, admitted=True)
             logger.info(f"Analysis result for {url}: {analysis_result}")
 
-            result = {
-                'isProductive': analysis_result['isProductive'],
-                'explanation': analysis_result['explanation'],
-                'confidence': get_confidence_score(url_signals, context_relevance),
-                'signals': url_signals,
-                'context_relevance': context_relevance,
-                'context_used': context_dict,
-                'referrer_data': additional_signals if additional_signals else None,
-                'direct_visit': is_direct_visit
-            }
-
-            url_cache['data'][cache_key] = result
-            url_cache['timestamps'][cache_key] = current_time
-            url_cache['session_ids'][cache_key] = session_id
-            logger.debug(f"Cached result for {url}")
+            result = AnalysisResult(
+                isProductive=analysis_result['isProductive'],
+                explanation=analysis_result['explanation'],
+                confidence=get_confidence_score(url_signals, context_relevance),
+                signals=url_signals,
+                context_relevance=context_relevance,
+                context_used=context_dict,
+                context_id=profile.fingerprint,
+                referrer_data=additional_signals if additional_signals else None,
+                direct_visit=is_direct_visit,
+                # Explanation is streaming or deferred; the block page fetches it from /explain
+                explanation_id=analysis_result.get('explanation_id') or None
+            )
+
+            body = app.json.encode(result)
+            # Not cached if settings were swapped mid-analysis (invalidation may have run already)
+            if analyzer.settings_version == settings_version:
+                url_cache['data'][cache_key] = CachedResponse(result, body)
+                url_cache['timestamps'][cache_key] = current_time
+                url_cache['session_ids'][cache_key] = session_id
+                logger.debug(f"Cached result for {url}")
 
             if is_direct_visit:
-                logger.info(f"Direct visit analysis result for {url}: isProductive={result['isProductive']}, explanation={result['explanation']}")
+                logger.info(f"Direct visit analysis result for {url}: isProductive={result.isProductive}, explanation={result.explanation}")
 
-            return jsonify(result)
+            return app.json.body_response(body)
 
         except Exception as e:
             logger.exception(f"Error analyzing URL internal block: {url}") # Log stack trace
@@ -393,6 +463,9 @@ def analyze():
                 'isProductive': False, # Default to non-productive on error
                 'explanation': f'Error analyzing URL: {str(e)}'
             }), 500
+        finally:
+            # No-op if analyze_website used it; cancels it on early search-query blocks
+            analyzer.discard_speculation(speculative)
 
     except Exception as e:
         logger.exception("Error in analyze endpoint top level") # Log stack trace
@@ -403,12 +476,22 @@ def analyze():
         }), 500
 
 
-def get_confidence_score(signals: dict, relevance: dict) -> float:
+@app.route('/explain', methods=['GET'])
+def explain():
+    """Return the AI explanation for a verdict, generating it on first request if it was deferred."""
+    explanation_id = request.args.get('id', '')
+    entry = analyzer.explain(explanation_id)
+    if entry is None:
+        return jsonify({'error': 'Explanation not found'}), 404
+    return jsonify(entry)
+
+
+def get_confidence_score(signals: dict, relevance: ContextRelevance) -> float:
     # ... (keep existing implementation)
     base_score = 0.5
     if signals.get('is_search'): base_score += 0.2
     if signals.get('is_educational'): base_score += 0.1
-    if relevance.get('score'): base_score += min(0.3, relevance.get('score', 0))
+    if relevance.score: base_score += min(0.3, relevance.score)
     return min(1.0, max(0.0, base_score)) # Ensure score is between 0.0 and 1.0
 
 @app.route('/block.html')
@@ -528,6 +611,7 @@ if __name__ == '__main__':
     # --- Start Flask App ---
     try:
         logger.info("Starting Flask application server...")
+        analyzer.watch_settings()  # Picks up edits to settings.json without a restart
         # Note: Flask's reloader (debug=True) might interfere slightly with PID file logic
         # as it restarts the process. The atexit cleanup should generally handle this,
         # but be aware if you see oddities during development.
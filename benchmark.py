@@ -0,0 +1,1736 @@
+#!/usr/bin/env python3
+"""
+Performance benchmark suite for Eclipse Shield.
+Runs the analysis pipeline in-process against a fake model so results are
+repeatable and do not consume API quota.
+"""
+
+import argparse
+import contextlib
+import dataclasses
+import json
+import logging
+import os
+import re
+import statistics
+import sys
+import time
+
+# The benchmarks install fake models; keep app startup from calling the real one
+os.environ.setdefault("QUESTION_CACHE_PRESEED", "false")
+# and keep the analysis rate limit out of the measurements
+os.environ.setdefault("ANALYSIS_RATE_LIMIT", "1000000/second")
+
+# Import time budget for the app modules (the startup benchmark fails the run beyond it)
+IMPORT_TIME_BUDGET_MS = float(os.environ.get("IMPORT_TIME_BUDGET_MS", "500"))
+
+# Recorded contextualization sessions: (domain, answers, number of answers after which the model said DONE)
+RECORDED_SESSIONS = [
+    ('school', ["Writing a history essay about the industrial revolution", "I need to submit a first draft by Friday"], 2),
+    ('work', ["Coding", "A Flask API for our inventory system", "Fixing a bug so orders sync correctly"], 3),
+    ('school', ["Homework", "Math problem set on derivatives", "Finish it before class tomorrow"], 3),
+    ('school', ["Studying for my biology exam so I can pass the midterm"], 1),
+    ('school', ["Research", "Looking at papers on battery chemistry", "I want to write a literature review"], 3),
+    ('work', ["Preparing slides for the quarterly review meeting", "Get them ready for the team by Thursday"], 2),
+    ('personal', ["Reading", "A novel for fun"], 2),
+    ('personal', ["Planning a trip to Japan", "Book flights and hotels"], 2),
+    ('work', ["Debugging the payment service", "Checkout fails for some cards and I need to fix it before the release"], 2),
+    ('personal', ["Editing a video for my channel", "Publish it this weekend"], 2),
+    ('work', ["Work stuff", "Emails mostly", "Clearing my inbox before vacation"], 3),
+    ('work', ["Writing code", "It's for a project", "Refactoring the parser so the tests pass"], 3),
+]
+
+class FakeResponse:
+    """Minimal stand-in for a google.generativeai response object."""
+
+    def __init__(self, text):
+        self.text = text
+
+class FakeModel:
+    """Stand-in for genai.GenerativeModel.
+
+    latency is the time to the first token; token_delay is added for every
+    further token, so a full (non-streamed) response costs both. input_delay
+    is added per prompt token (prefill). If variants is given, free-text
+    answers cycle through it instead of using text. connect_delay is paid
+    by the first call, and again by a call after more than idle_timeout
+    seconds without one, like a connection the server closes when idle.
+    """
+
+    def __init__(self, latency=0.05, text="ALLOW: Relevant to the current task.", token_delay=0.0, variants=None,
+                 input_delay=0.0, connect_delay=0.0, idle_timeout=None):
+        self.latency = latency
+        self.connect_delay = connect_delay
+        self.idle_timeout = idle_timeout
+        self.pid = os.getpid()  # Process that created the client
+        self.connects = 0
+        self._last_call = None
+        self.text = text
+        self.token_delay = token_delay
+        self.variants = variants
+        self.input_delay = input_delay
+        self.calls = 0
+        self.output_tokens = 0
+        self.input_tokens = 0
+        self.abandoned_streams = 0
+        self.summary = ("Summary: Writing a thesis chapter on the industrial revolution (steam engines, textile mills, "
+                        "railways) from primary sources before the deadline.\n"
+                        "Keywords: industrial revolution, steam engine, textile mill, railway, census, archives, thesis")
+
+    def _answer(self, prompt, generation_config):
+        """Follow the response mode the prompt asks for, as the real model would."""
+        verdict, _, reason = self.text.partition(':')
+        if prompt.startswith('Condense what this user'):
+            return self.summary
+        if (generation_config or {}).get('response_mime_type') == 'application/json':
+            short_reason = ' '.join(reason.split()[:8])
+            return json.dumps({'verdict': verdict.strip(), 'confidence': 0.9, 'reason': short_reason})
+        if 'Respond with exactly one word' in prompt:
+            return verdict.strip()
+        if 'Respond with the reason only' in prompt:
+            return reason.strip()
+        if self.variants:
+            return self.variants[(self.calls - 1) % len(self.variants)]
+        return self.text
+
+    def _connect(self):
+        now = time.monotonic()
+        if self._last_call is None or (self.idle_timeout is not None and now - self._last_call > self.idle_timeout):
+            self.connects += 1
+            time.sleep(self.connect_delay)
+        self._last_call = now
+
+    def count_tokens(self, contents=None, **kwargs):
+        self._connect()
+        return FakeResponse('')
+
+    def generate_content(self, contents=None, stream=False, generation_config=None, **kwargs):
+        self._connect()
+        self.calls += 1
+        answer = self._answer(str(contents), generation_config)
+        tokens = re.findall(r'\S+\s*', answer)
+        prompt_tokens = -(-len(str(contents)) // 4)  # ~4 characters per token
+        self.input_tokens += prompt_tokens
+        self.output_tokens += -(-len(answer) // 4)
+        time.sleep(self.latency + self.input_delay * prompt_tokens)
+        if not stream:
+            time.sleep(self.token_delay * max(0, len(tokens) - 1))
+            return FakeResponse(answer)
+        return self._stream(tokens)
+
+    def start_chat(self, history=None):
+        return FakeChat(self, history)
+
+    def _stream(self, tokens):
+        finished = False
+        try:
+            for i, token in enumerate(tokens):
+                if i:
+                    time.sleep(self.token_delay)
+                yield FakeResponse(token)
+            finished = True
+        finally:
+            if not finished:
+                self.abandoned_streams += 1
+
+class FakeChat:
+    """Stand-in for genai.ChatSession: like the SDK, it sends the kept history with every message."""
+
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, content, stream=False, **kwargs):
+        self.history.append({'role': 'user', 'parts': [content]})
+        prompt = '\n'.join(part for message in self.history for part in message['parts'])
+        response = self.model.generate_content(contents=prompt, stream=stream, **kwargs)
+        if stream:
+            return self._collect(response)
+        self.history.append({'role': 'model', 'parts': [response.text]})
+        return response
+
+    def _collect(self, chunks):
+        text = ''
+        try:
+            for chunk in chunks:
+                text += chunk.text
+                yield chunk
+        finally:
+            chunks.close()
+        self.history.append({'role': 'model', 'parts': [text]})
+
+    def rewind(self):
+        if self.history and self.history[-1]['role'] == 'user':
+            return self.history.pop(), None
+        return self.history.pop(-2), self.history.pop()
+
+def legacy_question_prompt(domain, context):
+    """The per-round follow-up prompt used before conversation sessions (for comparison)."""
+    history_str = "\n".join([f"Q: {item['question']}\nA: {item['answer']}" for item in context])
+    return f"""Based on this context about a {domain} task, determine if you have enough information or need to ask one more question.
+                Previous Q&A:
+                {history_str}
+
+                First, analyze if you have enough information to understand:
+                1. What specific task/activity the user is doing
+                2. What they are trying to achieve (goal/outcome)
+
+                If you have clear answers to BOTH of these, respond with exactly 'DONE'.
+                If you're missing either of these key pieces of information, ask ONE focused follow-up question about what you're missing.
+                Do not ask about time, duration, or scheduling.
+                Keep the question concise and direct.
+                Respond with either exactly 'DONE' or your single follow-up question (no other text)."""
+
+def legacy_parse_succeeds(decision):
+    """The pre-structured parser: split on the first ':' and require an exact verdict."""
+    if ':' not in decision:
+        return False
+    return decision.split(':', 1)[0].strip().upper() in ('ALLOW', 'BLOCK')
+
+def legacy_prompt(url, domain, settings, context_data, url_signals, context_relevance, instructions):
+    """The per-call f-string prompt used before the prompt compiler (for comparison)."""
+    context_summary = json.dumps(context_data, indent=2) if context_data else "No specific task context provided."
+    return f"""Analyze if visiting this URL is productive for the user in the '{domain}' domain, considering their current task context (if provided).
+
+                Domain Policy Context:
+                - Current Domain: {domain}
+                - Explicitly Allowed Platforms (already checked): LMS, Productivity Tools, AI Tools defined for '{domain}'
+                - Explicitly Blocked Keywords (already checked): {settings.get("blocked_keywords", [])}
+                - Explicitly Blocked Specific Sites (already checked): {settings.get("blocked_specific", [])}
+
+                User Task Context:
+                {context_summary}
+
+                URL Under Review:
+                - URL: {url}
+                - Detected Hostname: {url_signals.get('hostname', 'N/A')}
+                - Detected Category: {url_signals.get('domain_type', 'N/A')}
+                - Is Search?: {url_signals.get('is_search', 'N/A')}
+                - Search Query: {url_signals.get('search_query', 'N/A')}
+                - Context Relevance Score: {context_relevance.get('score', 'N/A')} (if applicable)
+                - Context Matched Terms: {context_relevance.get('matched_terms', 'N/A')} (if applicable)
+
+                Analysis Goal: Determine if accessing this URL is directly related to completing the user's stated task (if provided) OR is generally considered productive/necessary within the '{domain}' domain (e.g., documentation, core tools) and isn't explicitly blocked. Block common time-wasting sites (social media, games, excessive entertainment) unless context strongly justifies it.
+
+                {instructions}"""
+
+def legacy_relevance_score(context_data, url, search_query):
+    """The original _check_context_relevance: derive terms per call, substring-test each (for comparison)."""
+    from context_profiles import compile_terms
+    context_terms = list(compile_terms(context_data))
+    url_lower = url.lower()
+    score = 0.0
+    for term in context_terms:
+        if term in url_lower:
+            score += 0.3
+    if search_query:
+        query_lower = search_query.lower()
+        for term in context_terms:
+            if term in query_lower:
+                score += 0.5
+    return min(1.0, round(score, 2))
+
+class LegacyFailedAttempts:
+    """The original SecurityMiddleware bookkeeping: a timestamp list per IP (for comparison)."""
+
+    def __init__(self):
+        self.failed_attempts = {}
+        self.cleanup_time = time.time()
+
+    def cleanup_failed_attempts(self):
+        current_time = time.time()
+        if current_time - self.cleanup_time > 3600:
+            cutoff_time = current_time - 3600
+            self.failed_attempts = {ip: attempts for ip, attempts in self.failed_attempts.items()
+                                    if any(attempt_time > cutoff_time for attempt_time in attempts)}
+            self.cleanup_time = current_time
+
+    def is_rate_limited(self, client_ip, max_attempts=10, window=3600):
+        self.cleanup_failed_attempts()
+        current_time = time.time()
+        if client_ip not in self.failed_attempts:
+            return False
+        recent_attempts = [t for t in self.failed_attempts[client_ip] if current_time - t < window]
+        return len(recent_attempts) >= max_attempts
+
+    def record_failed_attempt(self, client_ip):
+        self.failed_attempts.setdefault(client_ip, []).append(time.time())
+
+class LegacyAnalysisLimiter:
+    """The original analyze_website limiter: a datetime list rebuilt on every call (for comparison)."""
+
+    def __init__(self):
+        self._last_analysis_times = []
+
+    def admit(self):
+        from datetime import datetime, timedelta
+        current_time = datetime.now()
+        self._last_analysis_times = [t for t in self._last_analysis_times
+                                     if current_time - t < timedelta(minutes=1)]
+        if len(self._last_analysis_times) > 50:
+            return False
+        self._last_analysis_times.append(current_time)
+        return True
+
+class PerformanceBenchmark:
+    def __init__(self, model_latency=0.05, iterations=40):
+        self.model_latency = model_latency
+        self.iterations = iterations
+        self.results = []
+        self.failures = []  # Budgets exceeded; main() exits non-zero if any
+
+    def log_result(self, name, value, unit=""):
+        """Log a benchmark measurement."""
+        line = f"[BENCH] {name}: {value}{(' ' + unit) if unit else ''}"
+        print(line)
+        self.results.append({'name': name, 'value': value, 'unit': unit})
+
+    def _load_dev_app(self):
+        """Import app.py with a fake model installed on its analyzer."""
+        import app as dev_app
+        dev_app.analyzer.model = FakeModel(self.model_latency)
+        return dev_app
+
+    def _load_secure_app(self, **model_options):
+        """Build the secure_app factory app with a lazily created fake model and Flask-Limiter disabled."""
+        import secure_app
+        from model_client import LazyModel
+        from model_pool import ModelCallPool
+        app = secure_app.create_app()
+        app.extensions['analyzer'].model = ModelCallPool(
+            LazyModel(lambda: FakeModel(self.model_latency, **model_options)))
+        for limiter in app.extensions.get('limiter', ()):
+            limiter.enabled = False
+        return app
+
+    def bench_speculative_dispatch(self):
+        """Median /analyze latency for AI-bound URLs with and without speculative dispatch."""
+        print("\n=== Speculative AI Dispatch ===")
+        import script
+        dev_app = self._load_dev_app()
+        client = dev_app.app.test_client()
+        context = [{'question': 'What are you working on?',
+                    'answer': 'Writing a history essay about the industrial revolution'}]
+
+        def run(enabled, tag):
+            script.SPECULATIVE_AI_ENABLED = enabled
+            latencies = []
+            for i in range(self.iterations):
+                payload = {
+                    'url': f'https://unknown-site-{tag}-{i}.example.org/articles/{i}',
+                    'domain': 'work',
+                    'context': context,
+                    'session_id': f'bench-{tag}',
+                    'referrer': f'https://www.google.com/search?q=industrial+revolution+{i}'
+                }
+                start = time.perf_counter()
+                client.post('/analyze', json=payload)
+                latencies.append(time.perf_counter() - start)
+            return statistics.median(latencies) * 1000
+
+        baseline = run(False, 'serial')
+        speculative = run(True, 'speculative')
+        self.log_result("AI-bound median latency (serial)", f"{baseline:.2f}", "ms")
+        self.log_result("AI-bound median latency (speculative)", f"{speculative:.2f}", "ms")
+        self.log_result("Median latency saved", f"{baseline - speculative:.2f}", "ms")
+
+        # Mixed traffic: short search queries are blocked in the route before analyze_website
+        dev_app.analyzer.speculation_stats = {'dispatched': 0, 'used': 0, 'wasted': 0, 'cancelled': 0}
+        for i in range(self.iterations):
+            referrer = 'https://www.google.com/search?q=ab' if i % 4 == 0 else None
+            client.post('/analyze', json={
+                'url': f'https://mixed-{i}.example.net/page',
+                'domain': 'work',
+                'context': context,
+                'session_id': 'bench-mixed',
+                'referrer': referrer
+            })
+        stats = dict(dev_app.analyzer.speculation_stats)
+        dispatched = stats.get('dispatched', 0) or 1
+        self.log_result("Speculation counters (mixed traffic)", stats)
+        self.log_result("Wasted-call rate", f"{stats.get('wasted', 0) / dispatched:.1%}")
+
+    def bench_streamed_verdict(self):
+        """Time-to-verdict for AI-decided URLs with streamed vs. complete responses."""
+        print("\n=== Streamed AI Verdicts ===")
+        import script
+        dev_app = self._load_dev_app()
+        analyzer = dev_app.analyzer
+        explanation = ("BLOCK: This video streaming site is not related to the essay on the industrial "
+                       "revolution and entertainment content is a common distraction during focused "
+                       "work sessions, so access is blocked until the session ends.")
+        analyzer.model = FakeModel(self.model_latency, text=explanation, token_delay=0.004)
+
+        script.AI_RESPONSE_MODE = 'text'
+
+        def run(enabled):
+            script.STREAM_AI_DECISIONS = enabled
+            latencies = []
+            explanation_id = None
+            for i in range(self.iterations):
+                start = time.perf_counter()
+                _, explanation_id = analyzer._generate_decision(f"benchmark prompt {enabled} {i}")
+                latencies.append(time.perf_counter() - start)
+            return statistics.median(latencies) * 1000, explanation_id
+
+        complete, _ = run(False)
+        streamed, explanation_id = run(True)
+        self.log_result("Time-to-verdict (complete response)", f"{complete:.2f}", "ms")
+        self.log_result("Time-to-verdict (streamed)", f"{streamed:.2f}", "ms")
+        self.log_result("Time-to-verdict saved", f"{complete - streamed:.2f}", "ms")
+        entry = analyzer.explanations.get(explanation_id, wait=5.0)
+        self.log_result("Explanation attached later", bool(entry and entry['complete']))
+
+    def bench_lazy_explanations(self):
+        """Output tokens and time-to-verdict with full explanations vs. verdict-only + /explain."""
+        print("\n=== Lazy Explanations ===")
+        import script
+        dev_app = self._load_dev_app()
+        analyzer = dev_app.analyzer
+        client = dev_app.app.test_client()
+        allow_text = ("ALLOW: The documentation page is directly relevant to the programming task "
+                      "described by the user and is commonly needed to complete it.")
+        block_text = ("BLOCK: This video streaming site is not related to the essay on the industrial "
+                      "revolution and entertainment content is a common distraction during focused work.")
+        analyzer.model = FakeModel(self.model_latency, token_delay=0.004)
+
+        def run(mode, tag):
+            script.AI_RESPONSE_MODE = mode
+            script.STREAM_AI_DECISIONS = False
+            analyzer.model.output_tokens = 0
+            latencies = []
+            for i in range(self.iterations):
+                analyzer.model.text = block_text if i % 3 == 0 else allow_text  # One in three blocked
+                start = time.perf_counter()
+                result = analyzer.analyze_website(f'https://site-{tag}-{i}.example.org/page', 'work')
+                latencies.append(time.perf_counter() - start)
+                if result.get('explanation_id'):
+                    client.get(f"/explain?id={result['explanation_id']}")  # What the block page does
+            return statistics.median(latencies) * 1000, analyzer.model.output_tokens / self.iterations
+
+        full_latency, full_tokens = run('text', 'full')
+        lazy_latency, lazy_tokens = run('verdict', 'lazy')
+        self.log_result("Mean output tokens per AI verdict (full explanation)", f"{full_tokens:.1f}")
+        self.log_result("Mean output tokens per AI verdict (verdict-only + /explain)", f"{lazy_tokens:.1f}")
+        self.log_result("Output token savings", f"{1 - lazy_tokens / full_tokens:.1%}")
+        self.log_result("Median time-to-verdict (full explanation)", f"{full_latency:.2f}", "ms")
+        self.log_result("Median time-to-verdict (verdict-only)", f"{lazy_latency:.2f}", "ms")
+
+    def bench_structured_verdicts(self):
+        """Parse failure rate and output tokens: free-text protocol vs. structured JSON."""
+        print("\n=== Structured Verdict Protocol ===")
+        import script
+        dev_app = self._load_dev_app()
+        analyzer = dev_app.analyzer
+        # Formats seen from free-text prompts: mostly conforming, some decorated or reworded
+        variants = [
+            "ALLOW: The documentation is directly relevant to the programming task described by the user.",
+            "BLOCK: Video streaming is unrelated to the essay and a common distraction during focused work.",
+            "**BLOCK**: Social media is not related to the current task and is blocked in this domain.",
+            "ALLOW - This reference site supports the research the user described for the assignment.",
+            "BLOCK\n\nReason: Online games are not related to the work task.",
+            "Verdict: ALLOW. The page is a learning resource for the user's course.",
+            "ALLOW: Search results for the user's topic help them find sources for the essay.",
+            "ALLOW: The cloud IDE is a core development tool for the coding task.",
+        ]
+        analyzer.model = FakeModel(self.model_latency, variants=variants)
+        analyzer.model.text = variants[1]
+
+        script.AI_RESPONSE_MODE = 'text'
+        script.STREAM_AI_DECISIONS = False
+        analyzer.model.output_tokens = 0
+        legacy_failures = new_failures = 0
+        for i in range(len(variants) * 5):
+            decision, _ = analyzer._generate_decision(f"free-text prompt {i}")
+            legacy_failures += not legacy_parse_succeeds(decision)
+            new_failures += script._parse_verdict(decision) is None
+        text_calls = len(variants) * 5
+        text_tokens = analyzer.model.output_tokens / text_calls
+
+        script.AI_RESPONSE_MODE = 'structured'
+        analyzer.model.output_tokens = 0
+        analyzer.ai_stats['parse_failures'] = 0
+        for i in range(text_calls):
+            decision, _ = analyzer._generate_decision(f"structured prompt {i}")
+            analyzer._parse_ai_decision(decision, 'https://example.org/', 'work')
+        structured_tokens = analyzer.model.output_tokens / text_calls
+
+        self.log_result("Parse failure rate (free text, legacy parser)", f"{legacy_failures / text_calls:.1%}")
+        self.log_result("Parse failure rate (free text, new parser)", f"{new_failures / text_calls:.1%}")
+        self.log_result("Parse failure rate (structured)", f"{analyzer.ai_stats['parse_failures'] / text_calls:.1%}")
+        self.log_result("Mean output tokens (free text)", f"{text_tokens:.1f}")
+        self.log_result("Mean output tokens (structured)", f"{structured_tokens:.1f}")
+
+        # Deterministic generation: a repeated prompt is served from the prompt-hash cache
+        calls_before = analyzer.model.calls
+        for _ in range(self.iterations):
+            analyzer._generate_decision("repeated structured prompt")
+        self.log_result("Model calls for repeated prompt", analyzer.model.calls - calls_before,
+                        f"of {self.iterations}")
+
+    def bench_prompt_tokens(self):
+        """Average prompt tokens per AI call on a replay: legacy f-string vs. prompt compiler."""
+        print("\n=== Prompt Size ===")
+        import script
+        from prompts import estimate_tokens
+        analyzer = self._load_dev_app().analyzer
+        instructions = script.RESPONSE_INSTRUCTIONS[script.AI_RESPONSE_MODE]
+        contexts = [
+            {},
+            {'What are you working on?': 'Writing a history essay about the industrial revolution'},
+            {'What are you working on?': 'Fixing a memory leak in our Flask API service',
+             'Which tools do you need?': 'Python docs, Stack Overflow, GitHub issues and the gunicorn documentation',
+             'How long will it take?': 'About two hours, then code review with the team'},
+            {'What are you working on?': 'Literature review for my thesis on urban heat islands. ' * 12,
+             'What sources do you use?': 'Journals, Google Scholar, city climate reports and satellite datasets. ' * 10},
+        ]
+        urls = [
+            'https://en.wikipedia.org/wiki/Industrial_Revolution',
+            'https://www.google.com/search?q=flask+memory+leak+gunicorn',
+            'https://news.ycombinator.com/item?id=123456',
+            'https://scholar.google.com/scholar?q=urban+heat+island+mitigation',
+            'https://www.example-shop.com/deals/today?utm_source=newsletter&utm_campaign=' + 'x' * 200,
+        ]
+        legacy_tokens, compiled_tokens, compile_times = [], [], []
+        for domain in ('work', 'school', 'personal'):
+            settings = analyzer.settings['domains'][domain]
+            for context in contexts:
+                analyzer.context_data = context
+                for url in urls:
+                    signals = analyzer._analyze_url_components(url)
+                    relevance = analyzer._check_context_relevance(url, signals) if context else None
+                    legacy_relevance = dataclasses.asdict(relevance) if relevance else {'score': 0.0}
+                    legacy_tokens.append(estimate_tokens(
+                        legacy_prompt(url, domain, settings, context, signals, legacy_relevance, instructions)))
+                    start = time.perf_counter()
+                    prompt = analyzer._build_analysis_prompt(url, domain, signals, relevance)
+                    compile_times.append((time.perf_counter() - start) * 1000)
+                    compiled_tokens.append(estimate_tokens(prompt))
+        analyzer.context_data = {}
+
+        self.log_result("Replayed prompts", len(compiled_tokens))
+        self.log_result("Mean prompt tokens (legacy)", f"{statistics.mean(legacy_tokens):.1f}")
+        self.log_result("Mean prompt tokens (compiled)", f"{statistics.mean(compiled_tokens):.1f}")
+        self.log_result("Max prompt tokens (legacy / compiled)", f"{max(legacy_tokens)} / {max(compiled_tokens)}",
+                        f"(budget {analyzer.prompt_compiler.token_budget})")
+        self.log_result("Prompt token savings", f"{1 - sum(compiled_tokens) / sum(legacy_tokens):.1%}")
+        self.log_result("Trimmed prompts", analyzer.prompt_compiler.stats['trimmed'])
+        self.log_result("Median compile time", f"{statistics.median(compile_times):.3f}", "ms")
+
+    def bench_conversation_rounds(self):
+        """Per-round /get_question latency and prompt tokens: resent history vs. conversation session."""
+        print("\n=== Contextualization Rounds ===")
+        import script
+        from shared_cache import SharedCache
+        dev_app = self._load_dev_app()
+        dev_app.analyzer.question_cache = SharedCache('questions', 0)  # Every round goes to the model
+        client = dev_app.app.test_client()
+        question = "What outcome do you need from this part of the task?"
+        # Prefill cost makes prompt size visible in latency (~0.2 ms per prompt token)
+        model = FakeModel(self.model_latency, text=question, input_delay=0.0002)
+        dev_app.analyzer.model = model
+        answers = ["Writing the methods section of my thesis on urban heat islands",
+                   "A complete draft my supervisor can review on Friday",
+                   "I need to describe the satellite data pipeline and the statistics",
+                   "Mostly Python notebooks, Google Scholar and the city climate reports",
+                   "The hardest part is explaining the regression model clearly",
+                   "After that I will format the references in Zotero",
+                   "The draft should be about 3000 words long",
+                   "I also want to add two figures comparing districts"]
+
+        def measure(send_round):
+            latencies, tokens = [], []
+            for round_index in range(len(answers) + 1):
+                before = model.input_tokens
+                start = time.perf_counter()
+                send_round(round_index)
+                latencies.append((time.perf_counter() - start) * 1000)
+                tokens.append(model.input_tokens - before)
+            return latencies, tokens
+
+        context = []
+        def legacy_round(round_index):
+            if round_index:
+                context.append({'question': question, 'answer': answers[round_index - 1]})
+            model.generate_content(contents=legacy_question_prompt('school', context))
+        legacy_latencies, legacy_tokens = measure(legacy_round)
+
+        state = {}
+        def session_round(round_index):
+            if not round_index:
+                body = {'domain': 'school', 'context': []}
+            else:
+                body = {'domain': 'school', 'session': state['session'], 'answer': answers[round_index - 1]}
+            state.update(client.post('/get_question', json=body).get_json())
+        script.LOCAL_DONE_DETECTION = False  # Measure model rounds only
+        try:
+            session_latencies, session_tokens = measure(session_round)
+        finally:
+            script.LOCAL_DONE_DETECTION = True
+
+        for label, latencies, tokens in (('resent history', legacy_latencies, legacy_tokens),
+                                         ('session', session_latencies, session_tokens)):
+            self.log_result(f"Round latency ({label})", ' '.join(f"{value:.0f}" for value in latencies), "ms")
+            self.log_result(f"Round prompt tokens ({label})", ' '.join(str(value) for value in tokens))
+        self.log_result("Last/first round latency (resent history)", f"{legacy_latencies[-1] / legacy_latencies[1]:.2f}x")
+        self.log_result("Last/first round latency (session)", f"{session_latencies[-1] / session_latencies[1]:.2f}x")
+        self.log_result("Live conversations", len(dev_app.analyzer.conversations))
+
+    def bench_local_done_detection(self):
+        """Share of contextualization model calls removed by the local DONE detector."""
+        print("\n=== Local DONE Detection ===")
+        import script
+        from shared_cache import SharedCache
+        dev_app = self._load_dev_app()
+        dev_app.analyzer.question_cache = SharedCache('questions', 0)  # Every round goes to the model
+        client = dev_app.app.test_client()
+        def replay(enabled):
+            script.LOCAL_DONE_DETECTION = enabled
+            calls = early = 0
+            for domain, answers, done_after in RECORDED_SESSIONS:
+                model = FakeModel(0.0, variants=[f"Follow-up question {i}?" for i in range(done_after)] + ["DONE"])
+                dev_app.analyzer.model = model
+                data = client.post('/get_question', json={'domain': domain, 'context': []}).get_json()
+                answered = 0
+                while data.get('question') != 'DONE' and answered < len(answers):
+                    answered += 1
+                    data = client.post('/get_question', json={'domain': domain, 'session': data['session'],
+                                                              'answer': answers[answered - 1]}).get_json()
+                calls += model.calls
+                early += answered < done_after
+            return calls, early
+
+        try:
+            model_calls, _ = replay(False)
+            local_calls, early = replay(True)
+        finally:
+            script.LOCAL_DONE_DETECTION = True
+        self.log_result("Recorded sessions", len(RECORDED_SESSIONS))
+        self.log_result("Model calls (model decides DONE)", model_calls)
+        self.log_result("Model calls (local DONE detection)", local_calls)
+        self.log_result("AI calls removed", f"{1 - local_calls / model_calls:.1%}")
+        self.log_result("Sessions finished before the model would have", early)
+
+    def bench_question_cache(self):
+        """Session-start latency and follow-up model calls with the question cache."""
+        print("\n=== Question Cache ===")
+        from shared_cache import SharedCache
+        dev_app = self._load_dev_app()
+        analyzer = dev_app.analyzer
+        client = dev_app.app.test_client()
+        analyzer.model = FakeModel(self.model_latency, text="What specific task are you working on?")
+
+        def session_start():
+            start = time.perf_counter()
+            data = client.post('/get_question', json={'domain': 'school', 'context': []}).get_json()
+            return (time.perf_counter() - start) * 1000, data
+
+        cold = []
+        for _ in range(self.iterations // 4):
+            analyzer.question_cache = SharedCache('questions', 1000)
+            cold.append(session_start()[0])
+        analyzer.question_cache = SharedCache('questions', 1000)
+        seeded = analyzer.preseed_questions()
+        warm = [session_start()[0] for _ in range(self.iterations)]
+        self.log_result("Domains pre-seeded", seeded)
+        self.log_result("Median session start (cold)", f"{statistics.median(cold):.2f}", "ms")
+        self.log_result("Median session start (pre-seeded)", f"{statistics.median(warm):.2f}", "ms")
+
+        # Many users giving the same short first answers
+        answers = ["homework", "Homework.", "coding", "writing an essay", "Writing an essay", "studying",
+                   "reading for class", "homework", "coding!", "studying"]
+        calls_before = analyzer.model.calls
+        for answer in answers * 3:
+            data = session_start()[1]
+            client.post('/get_question', json={'domain': 'school', 'session': data['session'], 'answer': answer})
+        follow_ups = len(answers) * 3
+        self.log_result("Follow-up model calls", analyzer.model.calls - calls_before, f"of {follow_ups}")
+        self.log_result("Cached questions", len(analyzer.question_cache))
+
+    def bench_question_batches(self):
+        """Model calls and client round-trips per session: one question per round vs. batches."""
+        print("\n=== Question Batches ===")
+        from shared_cache import SharedCache
+        dev_app = self._load_dev_app()
+        dev_app.analyzer.question_cache = SharedCache('questions', 0)  # Every round goes to the model
+        client = dev_app.app.test_client()
+
+        def replay(batch):
+            calls = round_trips = 0
+            elapsed = []
+            for domain, answers, done_after in RECORDED_SESSIONS:
+                if batch:
+                    # The model asks for everything it needs at once and is satisfied by the answers
+                    variants = ["What are you working on?\nWhat do you need it for?\nWhat does done look like?", "DONE"]
+                else:
+                    variants = [f"Follow-up question {i}?" for i in range(done_after)] + ["DONE"]
+                model = FakeModel(self.model_latency, variants=variants)
+                dev_app.analyzer.model = model
+                start = time.perf_counter()
+                data = client.post('/get_question', json={'domain': domain, 'context': [], 'batch': batch}).get_json()
+                round_trips += 1
+                answered = 0
+                while data.get('question') != 'DONE' and answered < len(answers):
+                    if batch:
+                        batch_answers = answers[answered:answered + len(data['questions'])]
+                        body = {'domain': domain, 'session': data['session'], 'batch': True, 'answers': batch_answers}
+                        answered += len(batch_answers)
+                    else:
+                        body = {'domain': domain, 'session': data['session'], 'answer': answers[answered]}
+                        answered += 1
+                    data = client.post('/get_question', json=body).get_json()
+                    round_trips += 1
+                elapsed.append((time.perf_counter() - start) * 1000)
+                calls += model.calls
+            return calls, round_trips, statistics.mean(elapsed)
+
+        for label, batch in (('one question per round', False), ('batched', True)):
+            calls, round_trips, elapsed = replay(batch)
+            sessions = len(RECORDED_SESSIONS)
+            self.log_result(f"Model calls per session ({label})", f"{calls / sessions:.2f}")
+            self.log_result(f"Round-trips per session ({label})", f"{round_trips / sessions:.2f}")
+            self.log_result(f"Mean server time per session ({label})", f"{elapsed:.1f}", "ms")
+
+    def bench_question_stream(self):
+        """Time to first character: JSON /get_question vs. the SSE stream, plus disconnect cleanup."""
+        print("\n=== Streamed Questions ===")
+        from shared_cache import SharedCache
+        dev_app = self._load_dev_app()
+        analyzer = dev_app.analyzer
+        client = dev_app.app.test_client()
+        question = "What specific assignment are you working on, and what do you need to hand in?"
+
+        def fresh_model():
+            analyzer.question_cache = SharedCache('questions', 0)  # Every request reaches the model
+            analyzer.model = FakeModel(self.model_latency, text=question, token_delay=0.015)
+            return analyzer.model
+
+        fresh_model()
+        json_times, first_token_times, stream_times = [], [], []
+        for _ in range(self.iterations // 4):
+            start = time.perf_counter()
+            client.post('/get_question', json={'domain': 'school', 'context': []})
+            json_times.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            response = client.post('/get_question/stream', json={'domain': 'school', 'context': []}, buffered=False)
+            first = None
+            for chunk in response.response:
+                if first is None and b'event: token' in chunk:
+                    first = (time.perf_counter() - start) * 1000
+            stream_times.append((time.perf_counter() - start) * 1000)
+            first_token_times.append(first)
+            response.close()
+
+        self.log_result("Median time to question (JSON)", f"{statistics.median(json_times):.1f}", "ms")
+        self.log_result("Median time to first character (SSE)", f"{statistics.median(first_token_times):.1f}", "ms")
+        self.log_result("Median time to full question (SSE)", f"{statistics.median(stream_times):.1f}", "ms")
+
+        # Client disconnects after the first token
+        model = fresh_model()
+        live_before = len(analyzer.conversations)
+        response = client.post('/get_question/stream', json={'domain': 'school', 'context': []}, buffered=False)
+        chunks = iter(response.response)
+        next(chunks)
+        start = time.perf_counter()
+        response.close()
+        released = (time.perf_counter() - start) * 1000
+        self.log_result("Model streams abandoned on disconnect", model.abandoned_streams, "of 1")
+        self.log_result("Conversations left by the disconnect", len(analyzer.conversations) - live_before)
+        self.log_result("Disconnect cleanup time", f"{released:.2f}", "ms")
+
+    def bench_context_registry(self):
+        """Per-request context cost of /analyze: resending the full context vs. a registered context id."""
+        print("\n=== Context Registry ===")
+        from context_profiles import compile_terms
+        from security import InputValidator
+        dev_app = self._load_dev_app()
+        analyzer = dev_app.analyzer
+        analyzer.model = FakeModel(0.0, text="ALLOW: Relevant to the current task.")
+        client = dev_app.app.test_client()
+        context = [{'question': f'Question {i} about your task?',
+                    'answer': f'Writing chapter {i} of my thesis on the industrial revolution, '
+                              f'covering steam engines, textile mills and railway expansion before the deadline'}
+                   for i in range(10)]
+
+        def legacy_context_terms():
+            # What every /analyze did before: sanitize the pairs, rebuild the dict, derive the terms
+            context_dict = {}
+            for qa in context[:10]:
+                question = InputValidator.sanitize_string(qa.get('question', ''), 500)
+                answer = InputValidator.sanitize_string(qa.get('answer', ''), 1000)
+                if question and answer:
+                    context_dict[question] = answer
+            return compile_terms(context_dict)
+
+        context_id = analyzer.register_context('personal', context).fingerprint
+        rounds = self.iterations * 25
+        start = time.perf_counter()
+        for _ in range(rounds):
+            legacy_context_terms()
+        legacy_us = (time.perf_counter() - start) / rounds * 1e6
+        start = time.perf_counter()
+        for _ in range(rounds):
+            analyzer.context_profiles.get(context_id, 'personal').terms
+        registry_us = (time.perf_counter() - start) / rounds * 1e6
+        self.log_result("Context handling per request (resend + reparse)", f"{legacy_us:.1f}", "us")
+        self.log_result("Context handling per request (registered id)", f"{registry_us:.2f}", "us")
+
+        def run(tag, body):
+            latencies, sizes = [], []
+            for i in range(self.iterations):
+                payload = dict(body, url=f'https://unknown-{tag}-{i}.example.org/steam-engines', domain='personal',
+                               session_id=f'bench-{tag}')
+                sizes.append(len(json.dumps(payload)))
+                start = time.perf_counter()
+                response = client.post('/analyze', json=payload)
+                latencies.append((time.perf_counter() - start) * 1000)
+                assert response.status_code == 200, response.get_json()
+            return statistics.median(latencies), statistics.mean(sizes)
+
+        legacy_ms, legacy_bytes = run('context', {'context': context})
+        registry_ms, registry_bytes = run('id', {'context_id': context_id})
+        self.log_result("Median /analyze latency (full context)", f"{legacy_ms:.2f}", "ms")
+        self.log_result("Median /analyze latency (context id)", f"{registry_ms:.2f}", "ms")
+        self.log_result("Request body (full context)", f"{legacy_bytes:.0f}", "bytes")
+        self.log_result("Request body (context id)", f"{registry_bytes:.0f}", "bytes")
+
+        expired = client.post('/analyze', json={'url': 'https://example.org/', 'domain': 'personal',
+                                                'context_id': '0' * 32})
+        self.log_result("Unknown context id without context", expired.status_code, "(client resends context)")
+        analyzer.use_context(None)
+
+    def bench_context_matching(self):
+        """Context relevance cost on long contexts and URLs: term scan vs. compat and token indexes."""
+        print("\n=== Context Matching ===")
+        import random
+        import context_profiles
+        from context_profiles import tokenize
+        analyzer = self._load_dev_app().analyzer
+        rng = random.Random(7)
+        vocabulary = ("thesis chapter industrial revolution steam engine textile mill railway expansion "
+                      "coal iron factory workers labour history essay sources primary archive britain "
+                      "manchester cotton spinning jenny canal transport economy urban growth census "
+                      "flask api gunicorn memory leak python docs stack overflow github issue review").split()
+
+        filler = ("page item view static assets img product ref utm source campaign medium session lang en "
+                  "category tag archive year month index id sort order filter page size results").split()
+
+        def answer(words, pool=vocabulary):
+            return ' '.join(rng.choice(pool) for _ in range(words))
+
+        contexts = [
+            {'What are you working on?': 'Writing a history essay about the industrial revolution'},
+            {'What are you working on?': 'Fixing a memory leak in our Flask API service',
+             'Which tools do you need?': 'Python docs, Stack Overflow, GitHub issues and the gunicorn documentation'},
+            {f'Question {i}?': answer(150)[:1000] for i in range(10)},  # 10 answers of ~1000 characters
+        ]
+        urls = [
+            ('https://en.wikipedia.org/wiki/Industrial_Revolution', ''),
+            ('https://www.google.com/search?q=flask+memory+leak+gunicorn', 'flask memory leak gunicorn'),
+            ('https://news.ycombinator.com/item?id=123456', ''),
+            ('https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'steam engine documentary'),
+            # ~1800 characters, mostly tracking and navigation noise with a few task words
+            ('https://archive.example.org/' + '/'.join(answer(3, filler).replace(' ', '-') for _ in range(60)) +
+             '/steam-engine-history?' + '&'.join(f'{w}={answer(2, filler).replace(" ", "+")}' for w in filler[:20]),
+             'cotton mill census manchester'),
+        ]
+        cases = [(context, url, query) for context in contexts for url, query in urls]
+        rounds = max(1, self.iterations // 4)
+        self.log_result("Longest context / URL", f"{max(len(' '.join(c.values())) for c in contexts)} / "
+                                                  f"{max(len(u) for u, _ in urls)}", "chars")
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            legacy_scores = [legacy_relevance_score(context, url, query) for context, url, query in cases]
+        legacy_us = (time.perf_counter() - start) / (rounds * len(cases)) * 1e6
+
+        def run(mode):
+            context_profiles.CONTEXT_MATCH_MODE = mode
+            analyzer.context_profile = None
+            scores, elapsed = [], 0.0
+            for context, url, query in cases:
+                analyzer.context_data = context
+                analyzer._check_context_relevance(url, query)  # Compile the profile outside the timing
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    relevance = analyzer._check_context_relevance(url, query)
+                elapsed += time.perf_counter() - start
+                scores.append(relevance.score)
+            return scores, elapsed / (rounds * len(cases)) * 1e6
+
+        default_mode = context_profiles.CONTEXT_MATCH_MODE
+        try:
+            compat_scores, compat_us = run('compat')
+            token_scores, token_us = run('tokens')
+        finally:
+            context_profiles.CONTEXT_MATCH_MODE = default_mode
+            analyzer.context_data = {}
+
+        # Matching only (terms already compiled), on the long context and URL
+        profile = context_profiles.ContextProfile('school', contexts[-1])
+        long_url = urls[-1][0]
+        start = time.perf_counter()
+        for _ in range(rounds):
+            url_lower = long_url.lower()
+            [term for term in profile.terms if term in url_lower]
+        scan_us = (time.perf_counter() - start) / rounds * 1e6
+        start = time.perf_counter()
+        for _ in range(rounds):
+            profile.match_tokens(tokenize(long_url))
+        index_us = (time.perf_counter() - start) / rounds * 1e6
+
+        self.log_result("Relevance check per URL (legacy term scan)", f"{legacy_us:.1f}", "us")
+        self.log_result("Relevance check per URL (compat index)", f"{compat_us:.1f}", "us")
+        self.log_result("Relevance check per URL (token index)", f"{token_us:.1f}", "us")
+        self.log_result("Long URL match, precompiled terms (scan / token index)",
+                        f"{scan_us:.1f} / {index_us:.1f}", f"us ({len(profile.terms)} terms)")
+        self.log_result("Compat scores equal to legacy",
+                        f"{sum(a == b for a, b in zip(compat_scores, legacy_scores))}/{len(cases)}")
+        self.log_result("Token scores equal to legacy",
+                        f"{sum(a == b for a, b in zip(token_scores, legacy_scores))}/{len(cases)}")
+
+    def bench_context_summary(self):
+        """AI stage prompt size and model time for a long context: full answers vs. the condensed summary."""
+        print("\n=== Context Summary ===")
+        import script
+        from prompts import estimate_tokens
+        dev_app = self._load_dev_app()
+        analyzer = dev_app.analyzer
+        client = dev_app.app.test_client()
+        model = FakeModel(self.model_latency, input_delay=0.0001)  # Prefill cost grows with prompt tokens
+        analyzer.model = model
+        context = [{'question': f'Question {i} about your task?',
+                    'answer': (f'Part {i}: writing my thesis chapter on the industrial revolution, covering steam engines, '
+                               f'textile mills, railway expansion and census records from the local archives. ' * 6)[:1000]}
+                   for i in range(10)]
+
+        def run(tag, context_id):
+            latencies, tokens = [], []
+            for i in range(self.iterations // 2):
+                before = model.input_tokens
+                start = time.perf_counter()
+                response = client.post('/analyze', json={'url': f'https://unknown-{tag}-{i}.example.org/page',
+                                                         'domain': 'work', 'context_id': context_id,
+                                                         'session_id': f'bench-{tag}'})
+                latencies.append((time.perf_counter() - start) * 1000)
+                tokens.append(model.input_tokens - before)
+                assert response.status_code == 200, response.get_json()
+            return statistics.median(latencies), statistics.mean(tokens)
+
+        enabled = script.CONTEXT_SUMMARY_ENABLED
+        try:
+            script.CONTEXT_SUMMARY_ENABLED = False
+            profile = analyzer.register_context('work', context)
+            full_ms, full_tokens = run('full', profile.fingerprint)
+
+            script.CONTEXT_SUMMARY_ENABLED = True
+            calls = model.calls
+            start = time.perf_counter()
+            analyzer.resolve_context('work', profile.fingerprint)  # Starts condensing in the background
+            while profile.summary is None and time.perf_counter() - start < 5:
+                time.sleep(0.001)
+            summary_ms = (time.perf_counter() - start) * 1000
+            summary_calls = model.calls - calls
+            condensed_ms, condensed_tokens = run('summary', profile.fingerprint)
+        finally:
+            script.CONTEXT_SUMMARY_ENABLED = enabled
+            analyzer.use_context(None)
+
+        self.log_result("Context size (encoded)", len(profile.prompt_fragment), "chars")
+        self.log_result("Summary model calls / time (once per session)", f"{summary_calls} / {summary_ms:.1f}", "ms")
+        self.log_result("Mean model input tokens per AI call (full context)", f"{full_tokens:.0f}")
+        self.log_result("Mean model input tokens per AI call (summary)", f"{condensed_tokens:.0f}")
+        self.log_result("Median AI-bound /analyze latency (full context)", f"{full_ms:.1f}", "ms")
+        self.log_result("Median AI-bound /analyze latency (summary)", f"{condensed_ms:.1f}", "ms")
+        self.log_result("Summary prompt fragment", f"{estimate_tokens(profile.summary[1])}", "tokens")
+
+    def bench_parse_once(self):
+        """urlparse calls and local pipeline time per /analyze (rule and context stages, no model)."""
+        print("\n=== Parse-once URLs ===")
+        import importlib.util
+        from urllib import parse
+        dev_app = self._load_dev_app()
+        analyzer = dev_app.analyzer
+        analyzer.model = FakeModel(0.0)
+        client = dev_app.app.test_client()
+        calls = [0]
+
+        def counting_urlparse(*args, **kwargs):
+            calls[0] += 1
+            return parse.urlparse(*args, **kwargs)
+
+        # Every module that imported urlparse by name
+        modules = [m for m in ('script', 'security', 'app', 'urls')
+                   if importlib.util.find_spec(m) and hasattr(importlib.import_module(m), 'urlparse')]
+        originals = {m: importlib.import_module(m).urlparse for m in modules}
+        context = [{'question': 'What are you working on?',
+                    'answer': 'Writing a history essay about the industrial revolution'}]
+        analyzer.use_context(analyzer.register_context('personal', context))
+        urls = ['https://en.wikipedia.org/wiki/Industrial_Revolution?search=steam+engine',
+                'https://www.reddit.com/r/history/comments/abc/industrial_revolution/',
+                'https://docs.google.com/document/d/1abc/edit']
+        try:
+            for m in modules:
+                importlib.import_module(m).urlparse = counting_urlparse
+            per_request, latencies = [], []
+            for i in range(self.iterations):
+                url = urls[i % len(urls)] + f'#{i}'
+                before = calls[0]
+                start = time.perf_counter()
+                client.post('/analyze', json={'url': url, 'domain': 'personal', 'context': context,
+                                              'session_id': 'bench-parse',
+                                              'referrer': 'https://www.google.com/search?q=industrial+revolution'})
+                latencies.append((time.perf_counter() - start) * 1000)
+                per_request.append(calls[0] - before)
+        finally:
+            for m, original in originals.items():
+                importlib.import_module(m).urlparse = original
+            analyzer.use_context(None)
+
+        self.log_result("urlparse calls per /analyze", f"{statistics.mean(per_request):.1f}")
+        self.log_result("Median /analyze latency (rule/context decided)", f"{statistics.median(latencies):.2f}", "ms")
+
+    def bench_validators(self):
+        """URL/domain validators: agreement with the reference regexes and cost on adversarial input."""
+        print("\n=== URL/Domain Validators ===")
+        import random
+        from security import InputValidator
+        rng = random.Random(11)
+
+        # Fuzz: short strings over an alphabet biased towards the grammar's edge cases
+        # (case-folding characters, non-ASCII digits, whitespace, a trailing newline)
+        alphabet = list('aZk9-.:/?') + ['\u0130', '\u0131', '\u017f', '\u212a', '\u0661', ' ', '\n', '\t',
+                                         'com', 'localhost', '127', '.1', 'a' * 62, 'a' * 63, '\u00e9']
+        schemes = ['http://', 'https://', 'HTTP://', 'http\u017f://', 'ftp://']
+        samples = 20000 * max(1, self.iterations // 4)
+        mismatches = accepted = 0
+        def near_valid():
+            """A well-formed URL or domain with up to two random edits."""
+            labels = [rng.choice(['a', 'ab-c', 'x1', 'a' * 63, '127', 'localhost']) for _ in range(rng.randint(1, 4))]
+            text = '.'.join(labels + [rng.choice(['com', 'io', 'museum', 'abcdefg', '1'])])
+            if rng.random() < 0.7:
+                text = (rng.choice(schemes) + text + rng.choice(['', '.', ':8080', ':']) +
+                        rng.choice(['', '/', '/path?q=a', '?x', '/a b']))
+            for _ in range(rng.randint(0, 2)):
+                position = rng.randint(0, len(text))
+                text = text[:position] + rng.choice(alphabet) + text[position + rng.randint(0, 1):]
+            return text
+
+        for _ in range(samples):
+            if rng.random() < 0.5:
+                text = near_valid()
+            else:
+                text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+                if rng.random() < 0.8:
+                    text = rng.choice(schemes) + text
+            url_ok = InputValidator.is_url_syntax(text)
+            domain_ok = InputValidator.is_domain_syntax(text)
+            accepted += url_ok + domain_ok
+            if (url_ok != bool(InputValidator.URL_PATTERN.match(text))
+                    or domain_ok != bool(InputValidator.DOMAIN_PATTERN.match(text))):
+                mismatches += 1
+        self.log_result("Fuzzed inputs (accepted URL/domain checks)", f"{samples} ({accepted})")
+        self.log_result("Disagreements with URL_PATTERN/DOMAIN_PATTERN", mismatches)
+
+        # Adversarial 2 KB inputs: long runs of labels, dots and digits that make the
+        # patterns retry their nested repetitions before failing
+        adversarial = {
+            'dotted digits': 'http://' + '1.1.1.' * 400,
+            'single-letter labels': 'http://' + 'a.' * 1020,
+            'labels + long tld': 'http://' + 'ab.' * 680 + 'abcdefg',
+            'max labels + space': 'http://' + ('a' * 62 + '.') * 30 + 'com/' + 'x' * 40 + ' ',
+            'hyphen labels': 'http://' + ('a' + '-' * 60 + 'a.') * 32 + 'x',
+            'domain labels': 'a.' * 126 + '-',
+        }
+        typical = ['https://en.wikipedia.org/wiki/Industrial_Revolution?search=steam+engine',
+                   'https://www.google.com/search?q=flask+memory+leak', 'http://localhost:5000/health']
+
+        def cost(check, text, rounds=50):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                check(text)
+            return (time.perf_counter() - start) / rounds * 1e6
+
+        for name, text in adversarial.items():
+            text = text[:2048]
+            regex, scanner = ((InputValidator.URL_PATTERN.match, InputValidator.is_url_syntax)
+                              if text.startswith('http') else
+                              (InputValidator.DOMAIN_PATTERN.match, InputValidator.is_domain_syntax))
+            self.log_result(f"{name} ({len(text)} chars) regex / scanner",
+                            f"{cost(regex, text):.1f} / {cost(scanner, text):.1f}", "us")
+        self.log_result("Typical URL regex / scanner",
+                        f"{statistics.mean(cost(InputValidator.URL_PATTERN.match, u, 2000) for u in typical):.2f} / "
+                        f"{statistics.mean(cost(InputValidator.is_url_syntax, u, 2000) for u in typical):.2f}", "us")
+
+    def bench_failed_attempts(self):
+        """Failed-attempt tracking under a scan from many IPs: memory and per-request check time."""
+        print("\n=== Failed-Attempt Tracking ===")
+        import tracemalloc
+        from security import SecurityMiddleware
+        scanners = 50000
+        heavy_failures = 20000
+
+        def scan(middleware):
+            tracemalloc.start()
+            for i in range(scanners):
+                ip = f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+                middleware.record_failed_attempt(ip)
+                middleware.record_failed_attempt(ip)
+            for _ in range(heavy_failures):
+                middleware.record_failed_attempt('203.0.113.9')
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            rounds = self.iterations * 25
+            start = time.perf_counter()
+            for i in range(rounds):
+                middleware.is_rate_limited('203.0.113.9')
+                middleware.is_rate_limited(f"10.0.{i >> 8 & 255}.{i & 255}")
+            check = (time.perf_counter() - start) / (2 * rounds) * 1e6
+            return memory, check
+
+        legacy_memory, legacy_check = scan(LegacyFailedAttempts())
+        middleware = SecurityMiddleware(None, storage_url='')
+        memory, check = scan(middleware)
+        self.log_result(f"Failure memory after {scanners} IPs + {heavy_failures} from one (old / new)",
+                        f"{legacy_memory / 1e6:.1f} / {memory / 1e6:.1f}", "MB")
+        self.log_result("Tracked IPs (new, capped)", len(middleware.failed_attempts))
+        self.log_result("is_rate_limited per request (old / new)", f"{legacy_check:.1f} / {check:.2f}", "us")
+
+        fresh = SecurityMiddleware(None, storage_url='')
+        verdicts = []
+        for _ in range(10):
+            verdicts.append(fresh.is_rate_limited('198.51.100.1'))
+            fresh.record_failed_attempt('198.51.100.1')
+        verdicts.append(fresh.is_rate_limited('198.51.100.1'))
+        self.log_result("Blocked after N failures (limit 10)", verdicts.index(True))
+
+    def bench_analysis_limiter(self):
+        """analyze_website rate limit: cost per admission and admissions under concurrent load."""
+        print("\n=== Analysis Rate Limiter ===")
+        import threading
+        from rate_limits import TokenBucketLimiter
+        rounds = self.iterations * 250
+
+        legacy = LegacyAnalysisLimiter()
+        start = time.perf_counter()
+        for _ in range(rounds):
+            legacy.admit()
+        legacy_cost = (time.perf_counter() - start) / rounds * 1e6
+        limiter = TokenBucketLimiter.from_rate('50/minute')
+        start = time.perf_counter()
+        for _ in range(rounds):
+            limiter.acquire('work:bench')
+        cost = (time.perf_counter() - start) / rounds * 1e6
+        self.log_result("Cost per admission at the limit (old / new)", f"{legacy_cost:.2f} / {cost:.2f}", "us")
+
+        # 8 threads race for one session's 50/minute; the old list drops updates between threads
+        def race(admit):
+            admitted = [0] * 8
+            barrier = threading.Barrier(8)
+
+            def worker(n):
+                barrier.wait()
+                for _ in range(200):
+                    if admit():
+                        admitted[n] += 1
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            return sum(admitted)
+
+        old_admitted = max(race(LegacyAnalysisLimiter().admit) for _ in range(5))
+        new_admitted = max(race(lambda limiter=TokenBucketLimiter.from_rate('50/minute'): limiter.acquire('s') == 0)
+                           for _ in range(5))
+        self.log_result("Admitted of 1600 concurrent requests, limit 50/minute (old worst / new worst)",
+                        f"{old_admitted} / {new_admitted}")
+
+    def bench_limiter_storage(self):
+        """Flask-Limiter storage: added latency per request and limits held across forked workers."""
+        print("\n=== Limiter Storage ===")
+        import tempfile
+        from flask import Flask
+        from flask_limiter import Limiter
+        from flask_limiter.util import get_remote_address
+        from limits import parse, storage, strategies
+        import limiter_storage  # noqa: F401 - registers shm://
+        table = os.path.join(tempfile.mkdtemp(), 'limits')
+        uris = {'memory://': 'memory://', 'shm://': f'shm://{table}'}
+
+        def request_latency(uri):
+            app = Flask(__name__)
+            limiter = Limiter(key_func=get_remote_address, storage_uri=uri, default_limits=[])
+            limiter.init_app(app)
+            app.add_url_rule('/limited', 'limited', limiter.limit("1000000/minute")(lambda: 'ok'))
+            app.add_url_rule('/open', 'open', lambda: 'ok')
+            client = app.test_client()
+            rounds = self.iterations * 25
+            timings = {}
+            for path in ('/open', '/limited'):
+                samples = []
+                for _ in range(rounds):
+                    start = time.perf_counter()
+                    client.get(path)
+                    samples.append(time.perf_counter() - start)
+                timings[path] = statistics.median(samples) * 1e6
+            return timings['/limited'] - timings['/open']
+
+        def admitted_across_workers(uri, workers=4, attempts=30):
+            item = parse('10/minute')
+            pids = []
+            for _ in range(workers):
+                pid = os.fork()
+                if pid == 0:
+                    limiter = strategies.FixedWindowRateLimiter(storage.storage_from_string(uri))
+                    os._exit(sum(limiter.hit(item, 'bench', '203.0.113.7') for _ in range(attempts)))
+                pids.append(pid)
+            return sum(os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) for pid in pids)
+
+        def hit_cost(uri):
+            limiter = strategies.FixedWindowRateLimiter(storage.storage_from_string(uri))
+            item = parse('1000000/minute')
+            rounds = self.iterations * 250
+            start = time.perf_counter()
+            for i in range(rounds):
+                limiter.hit(item, 'bench', f'198.51.100.{i % 200}')
+            return (time.perf_counter() - start) / rounds * 1e6
+
+        for name, uri in uris.items():
+            self.log_result(f"Limiter overhead per request ({name})", f"{request_latency(uri):.1f}", "us")
+            self.log_result(f"Storage hit ({name})", f"{hit_cost(uri):.2f}", "us")
+        for name, uri in uris.items():
+            self.log_result(f"Admitted by 4 workers, limit 10/minute ({name})", admitted_across_workers(uri))
+        os.remove(table)
+
+    def bench_request_hooks(self):
+        """Per-request cost of secure_app's own hooks and session handling (CORS, security checks and headers, CSRF)."""
+        print("\n=== Request Hooks ===")
+        from flask import request, session
+        app = self._load_secure_app()
+        # The hooks defined in create_app (not Flask-Limiter's, Talisman's or Flask-CORS's)
+        before = [f for f in app.before_request_funcs[None] if getattr(f, '__qualname__', '').startswith('create_app.')]
+        after = [f for f in app.after_request_funcs[None] if getattr(f, '__qualname__', '').startswith('create_app.')]
+        headers = {'Origin': 'chrome-extension://abcdefghijklmnop', 'User-Agent': 'Mozilla/5.0'}
+        rounds = self.iterations * 50
+
+        def hook_cost(method, path):
+            """Session open/save plus the hooks, timed inside a request context; no cookie, like the extension."""
+            total = 0.0
+            for _ in range(rounds):
+                with app.test_request_context(path, method=method, headers=headers):
+                    start = time.perf_counter()
+                    app.session_interface.open_session(app, request)  # What pushing a request context pays
+                    for f in before:
+                        f()
+                    response = app.response_class('{}', mimetype='application/json')
+                    for f in reversed(after):
+                        response = f(response)
+                    app.session_interface.save_session(app, session, response)
+                    total += time.perf_counter() - start
+            return total / rounds * 1e6, 'Set-Cookie' in response.headers, len(response.headers)
+
+        for method, path in (('GET', '/health'), ('POST', '/analyze'), ('POST', '/get_question'), ('GET', '/test-simple')):
+            cost, cookie, count = hook_cost(method, path)
+            self.log_result(f"Hooks + session for {method} {path}", f"{cost:.1f} us, {count} headers, "
+                                                                      f"Set-Cookie {'yes' if cookie else 'no'}")
+
+    def bench_json_results(self):
+        """/analyze results as slotted dataclasses with pre-encoded cache entries vs. nested dicts and jsonify."""
+        print("\n=== JSON Results ===")
+        import tracemalloc
+        from flask.json.provider import DefaultJSONProvider
+        from json_provider import FastJSONProvider
+        from results import AnalysisResult, CachedResponse
+        dev_app = self._load_dev_app()
+        app, analyzer = dev_app.app, dev_app.analyzer
+        legacy, fast = DefaultJSONProvider(app), FastJSONProvider(app)
+        rounds = self.iterations * 250
+
+        context = {'What are you working on?': 'Writing a report on urban heat island mitigation in Python',
+                   'Which tools do you need?': 'pandas documentation, matplotlib, google scholar and stackoverflow'}
+        profile = analyzer.resolve_context('personal', None, context)
+        analyzer.use_context(profile)
+        url = 'https://stackoverflow.com/questions/123/pandas-groupby-heat-island?q=pandas+heat+island'
+        signals = analyzer._analyze_url_components(url)
+        relevance = analyzer._check_context_relevance(url, signals)
+        result = AnalysisResult(isProductive=True, explanation='Relevant to the pandas report. ' * 4,
+                                confidence=dev_app.get_confidence_score(signals, relevance), signals=signals,
+                                context_relevance=relevance, context_used=profile.context_data,
+                                context_id=profile.fingerprint)
+        legacy_result = dataclasses.asdict(result)  # The nested dicts /analyze used to build
+        del legacy_result['explanation_id']
+
+        def timed(fn, n=rounds):
+            start = time.perf_counter()
+            for _ in range(n):
+                fn()
+            return (time.perf_counter() - start) / n * 1e6
+
+        with app.app_context():
+            same = json.loads(fast.encode(result)) == {**legacy_result, 'explanation_id': None}
+            self.log_result("Same response content", 'yes' if same else 'NO', '')
+            self.log_result("Encode + response (dict, Flask json)", f"{timed(lambda: legacy.response(legacy_result)):.1f}", 'us')
+            self.log_result(f"Encode + response (dataclass, {fast.backend})", f"{timed(lambda: fast.response(result)):.1f}", 'us')
+            entry = CachedResponse(result, fast.encode(result))
+            self.log_result("Cache hit (jsonify of the cached dict)",
+                            f"{timed(lambda: legacy.response(legacy_result)):.1f}", 'us')
+            self.log_result("Cache hit (cached bytes)",
+                            f"{timed(lambda: fast.body_response(entry.current_body(analyzer, fast.encode))):.1f}", 'us')
+
+        body = json.dumps({'url': url, 'domain': 'personal', 'session_id': 'abc123', 'context': context}).encode()
+        self.log_result("Parse /analyze body (json)", f"{timed(lambda: legacy.loads(body)):.2f}", 'us')
+        self.log_result(f"Parse /analyze body ({fast.backend})", f"{timed(lambda: fast.loads(body)):.2f}", 'us')
+
+        def cached_size(make):
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            entries = [make(i) for i in range(1000)]
+            size = tracemalloc.get_traced_memory()[0] - before
+            tracemalloc.stop()
+            del entries
+            return size / 1000
+
+        with app.app_context():
+            legacy_size = cached_size(lambda i: json.loads(json.dumps(legacy_result)))
+            cached = cached_size(lambda i: CachedResponse(result, fast.encode(result)))
+        self.log_result("Cache entry size (nested dicts)", f"{legacy_size:.0f}", 'bytes')
+        self.log_result("Cache entry size (encoded body)", f"{cached:.0f}", 'bytes')
+        analyzer.use_context(None)
+
+    LOAD_TEST_HEADERS = {'Content-Type': 'application/json', 'Origin': 'chrome-extension://abcdefghijklmnop',
+                         'User-Agent': 'Mozilla/5.0'}
+
+    def _timed_call(self, url, body=None):
+        """Seconds for one HTTP request to the load test server."""
+        import urllib.request
+        request = urllib.request.Request(url, data=body, headers=self.LOAD_TEST_HEADERS,
+                                         method='POST' if body else 'GET')
+        start = time.perf_counter()
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+        return time.perf_counter() - start
+
+    @contextlib.contextmanager
+    def _gunicorn(self, env, cwd=None):
+        """Run gunicorn with gunicorn.conf.py and load_test_app() (env adds settings); yields its base URL.
+
+        cwd is where the app finds settings.json (this directory by default).
+        """
+        import socket
+        import subprocess
+        import tempfile
+        repo = os.path.dirname(os.path.abspath(__file__))
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        with tempfile.TemporaryDirectory() as tmp:
+            server = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn', '-c', os.path.join(repo, 'gunicorn.conf.py'), '-b', f'127.0.0.1:{port}',
+                 '--pid', os.path.join(tmp, 'pid'), '--access-logfile', '/dev/null',
+                 '--error-logfile', os.path.join(tmp, 'error.log'), 'benchmark:load_test_app()'],
+                cwd=cwd or repo, env=dict(os.environ, PYTHONPATH=repo, **env),
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                base = f'http://127.0.0.1:{port}'
+                deadline = time.time() + 60
+                while True:
+                    try:
+                        self._timed_call(f'{base}/health')
+                        break
+                    except OSError:
+                        if time.time() > deadline or server.poll() is not None:
+                            raise RuntimeError(f"gunicorn did not start with {env}")
+                        time.sleep(0.2)
+                yield base
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+    @staticmethod
+    def _ai_bound_bodies(prefix, count):
+        """/analyze bodies for distinct unlisted URLs in the work domain, which the AI stage decides."""
+        return [json.dumps({'url': f'https://{prefix}{i}.example.com/page', 'domain': 'work',
+                            'session_id': f'{prefix}{i}', 'context': []}).encode() for i in range(count)]
+
+    def bench_worker_classes(self):
+        """Load test of gunicorn worker classes with gunicorn.conf.py and an AI-bound fake model."""
+        print("\n=== Worker Classes ===")
+        from concurrent.futures import ThreadPoolExecutor
+        latency, workers, clients, requests_per_class = 0.2, 2, 32, 160
+
+        # Requests from concurrent threads, each with its own context, must each be analyzed with their own
+        app = self._load_secure_app()
+        topics = {'pandas': 'pandas dataframe report', 'guitar': 'learning guitar chords'}
+
+        def analyze_own_context(i):
+            topic = ('pandas', 'guitar')[i % 2]
+            # Three matched terms decide ALLOW on context relevance, naming the terms
+            response = app.test_client().post('/analyze', headers=self.LOAD_TEST_HEADERS, json={
+                'url': f"https://example{i}.org/{topics[topic].replace(' ', '/')}", 'domain': 'personal',
+                'session_id': f'race{i}', 'context': [{'question': 'What are you working on?', 'answer': topics[topic]}]})
+            return topic in response.get_json().get('explanation', '')
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            own = sum(pool.map(analyze_own_context, range(400)))
+        self.log_result("Concurrent analyses that used their own context", f"{own}/400")
+
+        for worker_class in ('sync', 'gthread', 'gevent'):
+            env = {'GUNICORN_WORKER_CLASS': worker_class, 'GUNICORN_WORKERS': str(workers),
+                   'EXPECTED_AI_LATENCY': str(latency), 'TARGET_RPS': str(clients / latency),
+                   'LOAD_TEST_MODEL_LATENCY': str(latency)}
+            bodies = self._ai_bound_bodies(worker_class, requests_per_class)
+            with self._gunicorn(env) as base:
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=clients) as pool:
+                    latencies = sorted(pool.map(lambda body: self._timed_call(f'{base}/analyze', body), bodies))
+                elapsed = time.perf_counter() - start
+            self.log_result(f"{worker_class} ({workers} workers, {clients} clients)",
+                            f"{len(bodies) / elapsed:.1f} req/s, p50 {latencies[len(latencies) // 2] * 1000:.0f} ms, "
+                            f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.0f} ms")
+
+    def bench_model_client(self):
+        """Per-worker model clients: fork safety, first-request latency with warm-up, and keepalive."""
+        print("\n=== Model Client ===")
+        from model_client import LazyModel
+        from model_pool import ModelCallPool
+        latency, connect_delay = 0.05, 0.3
+
+        def client_after_fork(pool, client):
+            """Whose client a forked child uses once the parent has used the model (as question preseeding does)."""
+            pool.generate_content(contents='preseed')
+            read, write = os.pipe()
+            child = os.fork()
+            if child == 0:
+                try:
+                    pool.generate_content(contents='request')
+                    os.write(write, str(client().pid).encode())
+                finally:
+                    os._exit(0)
+            os.close(write)
+            os.waitpid(child, 0)
+            owner = int(os.read(read, 32) or 0)
+            os.close(read)
+            return 'its own' if owner == child else "the parent's"
+
+        eager = FakeModel(0.0)
+        lazy = LazyModel(lambda: FakeModel(0.0))
+        self.log_result("Client used after fork (model created at startup)", client_after_fork(ModelCallPool(eager), lambda: eager))
+        self.log_result("Client used after fork (LazyModel)", client_after_fork(ModelCallPool(lazy), lazy.get))
+
+        # First AI-bound request of a freshly started gunicorn worker, against steady state
+        for warmup in ('false', 'true'):
+            env = {'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_WORKERS': '1', 'MODEL_WARMUP': warmup,
+                   'LOAD_TEST_MODEL_LATENCY': str(latency), 'LOAD_TEST_CONNECT_DELAY': str(connect_delay)}
+            bodies = self._ai_bound_bodies(f'warmup{warmup}', 6)
+            with self._gunicorn(env) as base:
+                first = self._timed_call(f'{base}/analyze', bodies[0])
+                steady = statistics.median(self._timed_call(f'{base}/analyze', body) for body in bodies[1:])
+            self.log_result(f"First /analyze after worker start (warm-up {'on' if warmup == 'true' else 'off'})",
+                            f"{first * 1000:.0f} ms (steady state {steady * 1000:.0f} ms)")
+
+        # A call after the connection sat idle past the server's idle timeout
+        for keepalive in (0.0, 0.3):
+            model = LazyModel(lambda: FakeModel(latency, connect_delay=connect_delay, idle_timeout=1.0))
+            model.prepare(warmup=True, keepalive=keepalive)
+            time.sleep(1.5)
+            start = time.perf_counter()
+            model.generate_content(contents='after idle')
+            self.log_result(f"Call after 1.5 s idle (keepalive {'every 0.3 s' if keepalive else 'off'})",
+                            f"{(time.perf_counter() - start) * 1000:.0f}", 'ms')
+
+    @staticmethod
+    def _import_times(module):
+        """{module: cumulative us} of module and what it imported, from 'python -X importtime -c "import <module>"'."""
+        import subprocess
+        output = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True,
+                                text=True, check=True).stderr
+        times = {}
+        # Lines are printed as imports finish, nested ones indented: module's own imports are
+        # the indented lines right before its top-level line
+        for match in re.finditer(r'^import time:\s+\d+ \|\s+(\d+) \|( +)(\S+)$', output, re.MULTILINE):
+            if len(match.group(2)) == 1:
+                if match.group(3) == module:
+                    times[module] = int(match.group(1))
+                    return times
+                times = {}
+            else:
+                times[match.group(3)] = int(match.group(1))
+        return times
+
+    def bench_startup(self):
+        """Import time of the app modules against IMPORT_TIME_BUDGET_MS, and settings loading."""
+        print("\n=== Startup ===")
+        import shutil
+        import subprocess
+        import tempfile
+
+        for module in ('script', 'secure_app'):
+            # Best of three runs, after a first run has written the bytecode
+            self._import_times(module)
+            runs = [self._import_times(module) for _ in range(3)]
+            times = min(runs, key=lambda run: run[module])
+            cumulative = times[module] / 1000
+            heaviest = sorted(times.items(), key=lambda item: item[1], reverse=True)[1:4]
+            over = cumulative > IMPORT_TIME_BUDGET_MS
+            if over:
+                self.failures.append(f"import {module}: {cumulative:.0f} ms > {IMPORT_TIME_BUDGET_MS:.0f} ms")
+            self.log_result(f"import {module}",
+                            f"{cumulative:.0f} ms (budget {IMPORT_TIME_BUDGET_MS:.0f} ms{', OVER' if over else ''}; "
+                            f"heaviest: {', '.join(f'{name} {us / 1000:.0f} ms' for name, us in heaviest)})")
+
+        # The model SDK must not be imported until a model is created
+        probe = ("import sys, time; start = time.perf_counter(); import secure_app; app = secure_app.create_app(); "
+                 "print(round((time.perf_counter() - start) * 1000), 'google.generativeai' in sys.modules)")
+        output = subprocess.run([sys.executable, '-c', probe], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout.split()
+        if output[1] != 'False':
+            self.failures.append("google.generativeai imported by create_app()")
+        self.log_result("import secure_app + create_app()",
+                        f"{output[0]} ms (google.generativeai imported: {'yes' if output[1] == 'True' else 'no'})")
+
+        from prompts import settings_version
+        from settings_store import load_settings
+
+        def legacy_load(path):
+            # json.load, the settings content formatted into a debug message, then the settings version
+            with open(path) as f:
+                settings = json.load(f)
+            message = f"load_domain_settings - Settings content: {settings}"
+            return settings, settings_version(settings), message
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'settings.json')
+            shutil.copy('settings.json', path)
+            snapshot_path = os.path.join(tmp, 'settings.snapshot')
+            load_settings(path, snapshot_path)
+            assert load_settings(path, snapshot_path).settings == legacy_load(path)[0]
+            n = 2000
+            for name, load in (("json.load + content log + version", lambda: legacy_load(path)),
+                               ("parse (no snapshot)", lambda: load_settings(path, snapshot_path, use_snapshot=False)),
+                               ("snapshot, unchanged mtime", lambda: load_settings(path, snapshot_path))):
+                start = time.perf_counter()
+                for _ in range(n):
+                    load()
+                self.log_result(f"Settings load: {name}", f"{(time.perf_counter() - start) / n * 1e6:.1f}", "us")
+            os.utime(path)
+            self.log_result("Settings load after a touch", load_settings(path, snapshot_path).source)
+
+    def bench_worker_memory(self):
+        """Private memory (USS) of preforked workers with and without gc.freeze() in the master."""
+        print("\n=== Worker Memory ===")
+        import subprocess
+        workers = 3
+        for freeze in ('false', 'true'):
+            output = subprocess.run([sys.executable, '-c', f'import benchmark; benchmark.worker_memory_probe({workers})'],
+                                    cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+                                    check=True, env=dict(os.environ, GC_FREEZE=freeze)).stdout
+            probe = json.loads(output.strip().splitlines()[-1])
+            uss = statistics.median(probe['uss']) / 2**20
+            self.log_result(f"Worker USS after traffic and a full collection (gc.freeze {'on' if freeze == 'true' else 'off'})",
+                            f"{uss:.1f} MB median of {workers} (master RSS {probe['master_rss'] / 2**20:.0f} MB, "
+                            f"{probe['frozen']} objects frozen; 33 workers: {uss * 33 / 1024:.2f} GB private)")
+
+    def bench_settings_reload(self):
+        """Hot reload of an edited settings.json: swap time, targeted cache invalidation and propagation to workers."""
+        print("\n=== Settings Reload ===")
+        import shutil
+        import tempfile
+        from concurrent.futures import ThreadPoolExecutor
+        repo = os.path.dirname(os.path.abspath(__file__))
+
+        def edit_settings(path, keyword):
+            # Block one more keyword in the work domain
+            with open(path) as f:
+                settings = json.load(f)
+            settings['domains']['work']['blocked_keywords'].append(keyword)
+            with open(path, 'w') as f:
+                json.dump(settings, f, indent=2)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ('settings.json', 'api_key.txt'):
+                shutil.copy(os.path.join(repo, name), tmp)
+            cwd, latency = os.getcwd(), self.model_latency
+            os.chdir(tmp)
+            try:
+                self.model_latency = 0.0
+                app = self._load_secure_app()
+            finally:
+                os.chdir(cwd)
+                self.model_latency = latency
+            analyzer = app.extensions['analyzer']
+            client = app.test_client()
+
+            # Rule-decided and AI-decided URLs in every domain, some of which the new keyword will block
+            requests = []
+            for domain in ('school', 'work', 'personal'):
+                requests += [(f'https://site{i}.example.com/page', domain) for i in range(30)]
+                requests += [(f'https://forum{i}.example.org/thread', domain) for i in range(10)]
+                requests += [('https://classroom.google.com/c/1', domain), ('https://www.youtube.com/watch?v=1', domain)]
+
+            def verdicts(session_id):
+                return [(lambda r: (r['isProductive'], r['explanation']))(client.post(
+                    '/analyze', headers=self.LOAD_TEST_HEADERS,
+                    json={'url': url, 'domain': domain, 'session_id': session_id, 'context': []}).get_json())
+                    for url, domain in requests]
+
+            model = analyzer.model.model.get()
+            verdicts('reload')
+            restart_calls = model.calls  # What answering them all costs with empty caches, as after a restart
+            dropped = []
+            analyzer.add_settings_listener(lambda old, new: dropped.extend(
+                key for key in requests if analyzer.settings_change_affects(old, new, *key)))
+            edit_settings(os.path.join(tmp, 'settings.json'), 'forum')
+
+            # Requests keep running while the new version is compiled and swapped in
+            calls = model.calls
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                during = pool.submit(lambda: [verdicts('reload') for _ in range(3)])
+                cwd = os.getcwd()
+                os.chdir(tmp)
+                try:
+                    start = time.perf_counter()
+                    swapped = analyzer.reload_settings()
+                    elapsed = time.perf_counter() - start
+                finally:
+                    os.chdir(cwd)
+                during.result()
+            self.log_result("Reload (parse, compile rules and fragments, swap)",
+                            f"{elapsed * 1000:.2f} ms, swapped: {'yes' if swapped else 'no'}")
+            self.log_result("Cached verdicts dropped", f"{len(dropped)} of {len(requests)} (restart: all {len(requests)})")
+            after = verdicts('reload')
+            self.log_result("Model calls to answer every URL again after the reload",
+                            f"{model.calls - calls} (after a restart: {restart_calls})")
+            fresh = verdicts('fresh')  # Another session: never served from the cache
+            self.log_result("Verdicts after reload equal to fresh analysis",
+                            f"{sum(a == b for a, b in zip(after, fresh))}/{len(requests)}")
+
+            # Every gunicorn worker picks the edit up through its watcher
+            env = {'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_WORKERS': '3', 'SETTINGS_RELOAD_INTERVAL': '0.5',
+                   'LOAD_TEST_MODEL_LATENCY': '0'}
+            with self._gunicorn(env, cwd=tmp) as base:
+                import urllib.request
+
+                def health_version():
+                    with urllib.request.urlopen(f'{base}/health', timeout=10) as response:
+                        return json.loads(response.read())['settings_version']
+
+                old_version = health_version()
+                edit_settings(os.path.join(tmp, 'settings.json'), 'arcade')
+                start = time.perf_counter()
+                while time.perf_counter() - start < 10:
+                    # Connections are spread over the workers: 30 in a row on the new version covers all three
+                    if all(health_version() != old_version for _ in range(30)):
+                        break
+                    time.sleep(0.05)
+                self.log_result("All 3 workers on the new version after the edit",
+                                f"{time.perf_counter() - start:.2f} s (watch interval 0.5 s, no restart)")
+
+    def run_all(self, selected=None):
+        """Run all (or the selected) benchmarks."""
+        benchmarks = {
+            'speculative': self.bench_speculative_dispatch,
+            'streaming': self.bench_streamed_verdict,
+            'lazy_explanations': self.bench_lazy_explanations,
+            'structured': self.bench_structured_verdicts,
+            'prompt_tokens': self.bench_prompt_tokens,
+            'conversation': self.bench_conversation_rounds,
+            'done_detection': self.bench_local_done_detection,
+            'question_cache': self.bench_question_cache,
+            'question_batches': self.bench_question_batches,
+            'question_stream': self.bench_question_stream,
+            'context_registry': self.bench_context_registry,
+            'context_matching': self.bench_context_matching,
+            'context_summary': self.bench_context_summary,
+            'parse_once': self.bench_parse_once,
+            'validators': self.bench_validators,
+            'failed_attempts': self.bench_failed_attempts,
+            'analysis_limiter': self.bench_analysis_limiter,
+            'limiter_storage': self.bench_limiter_storage,
+            'request_hooks': self.bench_request_hooks,
+            'json_results': self.bench_json_results,
+            'worker_classes': self.bench_worker_classes,
+            'model_client': self.bench_model_client,
+            'startup': self.bench_startup,
+            'worker_memory': self.bench_worker_memory,
+            'settings_reload': self.bench_settings_reload,
+        }
+        for name, bench in benchmarks.items():
+            if selected and name not in selected:
+                continue
+            bench()
+        return self.results
+
+def load_test_app():
+    """secure_app with a fake model, for gunicorn in the worker class load test ('benchmark:load_test_app()')."""
+    logging.disable(logging.CRITICAL)
+    latency = float(os.environ.get('LOAD_TEST_MODEL_LATENCY', '0.2'))
+    connect_delay = float(os.environ.get('LOAD_TEST_CONNECT_DELAY', '0'))
+    return PerformanceBenchmark(model_latency=latency)._load_secure_app(connect_delay=connect_delay)
+
+def worker_memory_probe(workers=3, requests_per_worker=300):
+    """Preload the app as the gunicorn master does, fork workers, load them and print their USS as JSON.
+
+    Run in a fresh interpreter by bench_worker_memory; GC_FREEZE decides whether
+    the master freezes its objects before forking, as gunicorn.conf.py does.
+    """
+    import gc
+    import psutil
+    import signal
+    from script import import_model_sdk
+    os.environ.setdefault('LOAD_TEST_MODEL_LATENCY', '0')
+    app = load_test_app()
+    import_model_sdk()
+    if os.environ.get('GC_FREEZE', 'true').lower() == 'true':
+        gc.freeze()
+    bodies = PerformanceBenchmark._ai_bound_bodies('memory', requests_per_worker // 3)
+    read, write = os.pipe()
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                client = app.test_client()
+                for i, body in enumerate(bodies):
+                    client.post('/analyze', data=body, headers=PerformanceBenchmark.LOAD_TEST_HEADERS)
+                    for url in ('https://classroom.google.com/c/1', f'https://www.youtube.com/watch?v={i}'):
+                        client.post('/analyze', headers=PerformanceBenchmark.LOAD_TEST_HEADERS,
+                                    json={'url': url, 'domain': 'school', 'session_id': f'memory{i}', 'context': []})
+                # A long-running worker eventually runs full collections
+                gc.collect()
+                os.write(write, b'.')
+                signal.pause()
+            finally:
+                os._exit(0)
+        children.append(pid)
+    for _ in children:
+        os.read(read, 1)
+    uss = [psutil.Process(pid).memory_full_info().uss for pid in children]
+    for pid in children:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+    print(json.dumps({'uss': uss, 'master_rss': psutil.Process().memory_info().rss,
+                      'frozen': gc.get_freeze_count()}))
+
+def main():
+    parser = argparse.ArgumentParser(description="Eclipse Shield performance benchmarks")
+    parser.add_argument('--only', nargs='*', help="Run only the named benchmarks")
+    parser.add_argument('--latency', type=float, default=0.05, help="Fake model latency in seconds")
+    parser.add_argument('--with-logging', action='store_true', help="Keep application logging enabled (as in the dev server)")
+    parser.add_argument('--iterations', type=int, default=40, help="Requests per measurement")
+    args = parser.parse_args()
+
+    # Keep log I/O out of the measurements unless asked for
+    if not args.with_logging:
+        logging.disable(logging.CRITICAL)
+
+    benchmark = PerformanceBenchmark(model_latency=args.latency, iterations=args.iterations)
+    benchmark.run_all(args.only)
+    for failure in benchmark.failures:
+        print(f"[BENCH] FAILED: {failure}")
+    return 1 if benchmark.failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
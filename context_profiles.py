@@ -0,0 +1,198 @@
+"""
+Context profiles for Eclipse Shield.
+A profile is the compiled form of one contextualized session: the context
+terms used for relevance matching, a phrase index, the prompt fragment and a
+fingerprint. Profiles are registered once and looked up by id, so /analyze
+requests no longer resend and reparse the whole context.
+"""
+
+import os
+import json
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import logging
+
+from prompts import encode_context
+from urls import tokenize
+
+logger = logging.getLogger(__name__)
+
+# 'tokens': terms match whole URL/query tokens; 'compat': substring matching with
+# the same scores as before the token index existed
+CONTEXT_MATCH_MODE = os.getenv("CONTEXT_MATCH_MODE", "tokens").lower()
+
+def compile_terms(context_data: Dict) -> set:
+    """Context terms: words longer than 2 characters plus 2- and 3-word phrases of every answer."""
+    context_terms_set = set()
+    for question, answer in context_data.items():
+        if isinstance(answer, str) and answer.strip():
+            # Clean and split into words, remove punctuation, lowercase
+            words = [word.strip('.,?!();:"\'').lower() for word in answer.split()]
+            words = [word for word in words if len(word) > 2] # Keep words longer than 2 chars
+
+            # Add single words
+            context_terms_set.update(words)
+
+            # Add 2-word phrases (bi-grams)
+            context_terms_set.update([f"{words[i]} {words[i+1]}" for i in range(len(words)-1)])
+
+            # Add 3-word phrases (tri-grams) - Optional, can increase noise
+            context_terms_set.update([f"{words[i]} {words[i+1]} {words[i+2]}" for i in range(len(words)-2)])
+    return context_terms_set
+
+def context_fingerprint(domain: str, context_data: Dict) -> str:
+    """Stable id for a domain and context; the same answers always give the same id."""
+    encoded = json.dumps([domain, sorted(context_data.items())], separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:32]
+
+def _indexed_positions(tokens: list, index: Dict) -> list:
+    """Positions of tokens that are keys of index; the distinct tokens are intersected with it first."""
+    present = index.keys() & set(tokens)
+    if not present:
+        return []
+    return [position for position, token in enumerate(tokens) if token in present]
+
+class ContextProfile:
+    """Compiled, read-only view of one session's context.
+
+    Besides the term set it holds two indexes:
+    - phrase_index: multi-word terms by their first word. Every word of a
+      phrase is itself a term, so a phrase can only be a substring of a text
+      if its first word is; compat matching only tests those phrases.
+    - token_index: terms by their token sequence (see tokenize), for matching
+      against tokenized URLs and queries with one lookup per sequence length.
+    """
+
+    def __init__(self, domain: str, context_data: Dict):
+        self.domain = domain
+        self.context_data = context_data
+        self.terms = frozenset(compile_terms(self.context_data))
+        self.words = frozenset(term for term in self.terms if ' ' not in term)
+
+        phrase_index, token_index = {}, {}
+        for term in self.terms:
+            if ' ' in term:
+                phrase_index.setdefault(term.split(' ', 1)[0], []).append(term)
+            tokens = tuple(tokenize(term))
+            if tokens:
+                token_index.setdefault(tokens, []).append(term)
+        self.phrase_index: Dict[str, Tuple[str, ...]] = {word: tuple(terms) for word, terms in phrase_index.items()}
+        self.token_index: Dict[tuple, Tuple[str, ...]] = {tokens: tuple(terms) for tokens, terms in token_index.items()}
+        # Sequence lengths by first token, so positions that start no term are skipped
+        starts = {}
+        for tokens in self.token_index:
+            starts.setdefault(tokens[0], set()).add(len(tokens))
+        self.token_starts: Dict[str, Tuple[int, ...]] = {token: tuple(sorted(lengths)) for token, lengths in starts.items()}
+        self.prompt_fragment = encode_context(self.context_data)
+        self.fingerprint = context_fingerprint(domain, self.context_data)
+        # (context dict, prompt fragment) of the condensed task summary, set once it is available
+        self.summary: Optional[tuple] = None
+        self.summary_requested = False
+
+    def set_summary(self, summary: str, keywords: list) -> None:
+        """Attach a condensed task summary and keywords, used in prompts instead of the full context."""
+        summary_context = {'Task summary': summary}
+        if keywords:
+            summary_context['Keywords'] = ', '.join(keywords)
+        self.summary = (summary_context, encode_context(summary_context))
+
+    def match_tokens(self, tokens: list) -> list:
+        """Terms whose token sequence occurs consecutively in tokens, sorted."""
+        matched = set()
+        for position in _indexed_positions(tokens, self.token_starts):
+            for length in self.token_starts[tokens[position]]:
+                terms = self.token_index.get(tuple(tokens[position:position + length]))
+                if terms:
+                    matched.update(terms)
+        return sorted(matched)
+
+    def match_substrings(self, text: str) -> list:
+        """Terms that are substrings of a lowercased text, sorted; same result as testing every term."""
+        matched = {word for word in self.words if word in text}
+        for word in list(matched):
+            matched.update(term for term in self.phrase_index.get(word, ()) if term in text)
+        return sorted(matched)
+
+    def match(self, text_lower: str, tokens: Optional[tuple] = None, mode: Optional[str] = None) -> list:
+        """Terms found in a lowercased URL or query, using token matching or compat substring matching."""
+        if (mode or CONTEXT_MATCH_MODE) == 'compat':
+            return self.match_substrings(text_lower)
+        return self.match_tokens(tokens if tokens is not None else tokenize(text_lower))
+
+class ContextProfileRegistry:
+    """Bounded, thread-safe registry of context profiles with sliding expiry.
+
+    If a shared cache is given, the raw context is also stored there so a
+    worker that has not seen a profile can compile it on first use.
+    """
+
+    ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+    def __init__(self, max_entries: int = 1000, ttl: int = 43200, shared=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self._profiles = OrderedDict()  # id -> (profile, last used), least recently used first
+        self._lock = threading.Lock()
+
+    def register(self, domain: str, context_data: Dict) -> ContextProfile:
+        """Compile and store a profile (or refresh the existing one for the same context)."""
+        fingerprint = context_fingerprint(domain, context_data)
+        profile = self.get(fingerprint, domain)
+        if profile is not None:
+            return profile
+        profile = ContextProfile(domain, context_data)
+        self._store(profile)
+        if self.shared is not None:
+            self.shared.set(profile.fingerprint, json.dumps({'domain': domain, 'context': profile.context_data}))
+        return profile
+
+    def get(self, context_id: str, domain: str) -> Optional[ContextProfile]:
+        """Return the profile for an id and domain, or None if unknown or expired."""
+        if not isinstance(context_id, str) or not self.ID_PATTERN.match(context_id):
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._evict_locked(now)
+            entry = self._profiles.get(context_id)
+            if entry is not None:
+                self._profiles[context_id] = (entry[0], now)
+                self._profiles.move_to_end(context_id)
+                profile = entry[0]
+                return profile if profile.domain == domain else None
+
+        if self.shared is None:
+            return None
+        raw = self.shared.get(context_id)
+        if raw is None:
+            return None
+        stored = json.loads(raw)
+        if stored.get('domain') != domain:
+            return None
+        profile = ContextProfile(domain, stored.get('context', {}))
+        self._store(profile)
+        logger.debug(f"ContextProfileRegistry.get - Compiled shared profile {context_id}")
+        return profile
+
+    def __len__(self) -> int:
+        return len(self._profiles)
+
+    def _store(self, profile: ContextProfile) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._profiles[profile.fingerprint] = (profile, now)
+            self._profiles.move_to_end(profile.fingerprint)
+            self._evict_locked(now)
+
+    def _evict_locked(self, now: float) -> None:
+        """Drop idle profiles and the least recently used beyond max_entries (lock must be held)."""
+        cutoff = now - self.ttl
+        while self._profiles:
+            context_id, (_, last_used) = next(iter(self._profiles.items()))
+            if last_used >= cutoff and len(self._profiles) <= self.max_entries:
+                break
+            self._profiles.pop(context_id)
@@ -0,0 +1,142 @@
+"""
+Conversation store for Eclipse Shield.
+Keeps the model chat session of each contextualization conversation on the
+server, keyed by a session token, so the popup only sends the newest answer
+on every round instead of the whole Q&A history.
+"""
+
+import re
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, List, Dict
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Slot-filling heuristics for "do we know the task and the goal yet?". They only
+# ever short-cut to DONE; anything less clear is left to the model.
+_TASK_RE = re.compile(
+    r"\b(?:writ|cod|debug|fix|build|stud|research|prepar|review|design|implement|draft|edit|"
+    r"analy[sz]|revis|translat|solv|refactor|deploy|essay|report|thesis|dissertation|homework|"
+    r"assignment|project|paper|presentation|exam|bug|feature|slides|proposal|article|chapter|"
+    r"lecture|spreadsheet|notebook|script|api|website|worksheet|budget|invoice)\w*",
+    re.IGNORECASE)
+_GOAL_RE = re.compile(
+    r"\b(?:so (?:that|i can)|in order to|i (?:want|need|have) to|trying to|goal|aim|deadline|due|"
+    r"submit|finish|complete|pass|ready|deliver|ship|publish|hand in|turn in|get (?:it|this) done|"
+    r"by (?:monday|tuesday|wednesday|thursday|friday|saturday|sunday|tomorrow|tonight|the end))\b",
+    re.IGNORECASE)
+MIN_CONTEXT_WORDS = 6
+
+def has_enough_context(turns: List[Dict[str, str]]) -> bool:
+    """Return True when the answers clearly state both the task and the goal.
+
+    False means "not sure", not "no": the caller should ask the model.
+    """
+    answers = [turn.get('answer', '') for turn in turns]
+    words = sum(len(answer.split()) for answer in answers)
+    if words < MIN_CONTEXT_WORDS or max((len(answer.split()) for answer in answers), default=0) < 3:
+        return False
+    text = ' '.join(answers)
+    return bool(_TASK_RE.search(text)) and bool(_GOAL_RE.search(text))
+
+# Only short exchanges are common enough across users to be worth caching
+QUESTION_CACHE_MAX_TURNS = 2
+QUESTION_CACHE_MAX_ANSWER_CHARS = 40
+_NORMALIZE_RE = re.compile(r"[^a-z0-9]+")
+
+def question_cache_key(domain: str, turns: List[Dict[str, str]]) -> Optional[str]:
+    """Key for the next question after `turns`, or None if the exchange is too specific to cache.
+
+    Questions and answers are normalized (lowercase, punctuation and extra
+    whitespace removed) so "Homework." and "homework" share an entry.
+    """
+    if len(turns) > QUESTION_CACHE_MAX_TURNS:
+        return None
+    parts = []
+    for turn in turns:
+        answer = _NORMALIZE_RE.sub(' ', turn.get('answer', '').lower()).strip()
+        if not answer or len(answer) > QUESTION_CACHE_MAX_ANSWER_CHARS:
+            return None
+        parts.append(_NORMALIZE_RE.sub(' ', turn.get('question', '').lower()).strip())
+        parts.append(answer)
+    if not parts:
+        return f"{domain}:first"
+    return f"{domain}:{hashlib.sha256(chr(31).join(parts).encode('utf-8')).hexdigest()[:24]}"
+
+class Conversation:
+    """One contextualization conversation and its model chat session."""
+
+    def __init__(self, token: str, domain: str, chat):
+        self.token = token
+        self.domain = domain
+        self.chat = chat
+        self.turns: List[Dict[str, str]] = []  # Answered {'question', 'answer'} pairs
+        self.pending_questions: List[str] = []  # Questions sent to the user and not answered yet
+        self.batch = False  # Several questions per round instead of one
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()  # One round at a time per conversation
+
+    def trim_history(self, pinned: int, window: int) -> None:
+        """Bound the chat history to the first `pinned` messages plus the last `window` exchanges.
+
+        The opening message (instructions and first answers) stays; older
+        middle rounds are dropped so each round's input stays the same size.
+        """
+        history = self.chat.history
+        keep = 2 * window
+        if len(history) > pinned + keep:
+            self.chat.history = list(history[:pinned]) + list(history[-keep:])
+
+class ConversationStore:
+    """Bounded, thread-safe store of live conversations with idle expiry."""
+
+    TOKEN_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+    def __init__(self, max_sessions: int = 500, ttl: int = 1800):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()  # token -> Conversation, least recently used first
+        self._lock = threading.Lock()
+
+    def open(self, domain: str, chat) -> Conversation:
+        """Register a new conversation and return it."""
+        conversation = Conversation(secrets.token_urlsafe(16), domain, chat)
+        with self._lock:
+            self._sessions[conversation.token] = conversation
+            self._evict_locked()
+        return conversation
+
+    def get(self, token: str, domain: str) -> Optional[Conversation]:
+        """Return the live conversation for a token, or None if unknown, expired or for another domain."""
+        if not isinstance(token, str) or not self.TOKEN_PATTERN.match(token):
+            return None
+        with self._lock:
+            self._evict_locked()
+            conversation = self._sessions.get(token)
+            if conversation is None or conversation.domain != domain:
+                return None
+            conversation.last_used = time.monotonic()
+            self._sessions.move_to_end(token)
+        return conversation
+
+    def close(self, token: str) -> None:
+        """Forget a finished conversation."""
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _evict_locked(self) -> None:
+        """Drop idle conversations and the least recently used beyond max_sessions (lock must be held)."""
+        cutoff = time.monotonic() - self.ttl
+        while self._sessions:
+            token, oldest = next(iter(self._sessions.items()))
+            if oldest.last_used >= cutoff and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.pop(token)
+            logger.debug(f"ConversationStore._evict_locked - Dropped conversation for '{oldest.domain}'")
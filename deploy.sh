@@ -167,7 +167,7 @@ sudo cp supervisord.conf /etc/supervisor/conf.d/eclipse-shield.conf
 # Update supervisor configuration with correct paths and environment
 sudo tee /etc/supervisor/conf.d/eclipse-shield.conf << EOF
 [program:eclipse-shield]
-command=$APP_DIR/venv/bin/gunicorn --bind 127.0.0.1:5000 --workers 4 --worker-class gevent --worker-connections 1000 --max-requests 1000 --max-requests-jitter 100 --timeout 30 --keep-alive 2 --preload wsgi:application
+command=$APP_DIR/venv/bin/gunicorn --config gunicorn.conf.py --bind 127.0.0.1:5000 wsgi:application
 directory=$APP_DIR
 user=$USER
 autostart=true
@@ -176,7 +176,7 @@ redirect_stderr=true
 stdout_logfile=/var/log/eclipse-shield/application.log
 stdout_logfile_maxbytes=50MB
 stdout_logfile_backups=10
-environment=PATH="$APP_DIR/venv/bin",FLASK_ENV=production,SECRET_KEY="$SECRET_KEY",ECLIPSE_SHIELD_API_KEY="$API_KEY"
+environment=PATH="$APP_DIR/venv/bin",FLASK_ENV=production,SECRET_KEY="$SECRET_KEY",ECLIPSE_SHIELD_API_KEY="$API_KEY",GUNICORN_WORKER_CLASS="gevent",GUNICORN_WORKERS="4"
 EOF
 
 # Configure UFW firewall
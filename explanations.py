@@ -0,0 +1,103 @@
+"""
+Explanation store for Eclipse Shield.
+Holds AI explanations that finish after the verdict has already been returned,
+or that are only generated when the block page asks for them, so they can be
+picked up later by id.
+"""
+
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ExplanationStore:
+    """Bounded, thread-safe store of pending and completed explanations."""
+
+    ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+    def __init__(self, max_entries: int = 2000, ttl: int = 900):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # id -> entry dict, oldest first
+        self._keys = {}  # dedupe key -> id, so identical requests share one explanation
+        self._lock = threading.Lock()
+
+    def open(self, text: str = '', dedupe_key: Optional[str] = None, claimed: bool = True, **metadata) -> str:
+        """Create a pending entry and return its id.
+
+        Args:
+            text: Explanation text received so far
+            dedupe_key: Reuse the live entry opened with the same key instead of a new one
+            claimed: False for lazy entries, which are generated by the first
+                     caller of claim(); True when a producer is already running
+            **metadata: Whatever the producer needs later (e.g. the prompt)
+        """
+        with self._lock:
+            self._evict_locked()
+            if dedupe_key is not None and dedupe_key in self._keys:
+                return self._keys[dedupe_key]
+            explanation_id = secrets.token_urlsafe(12)
+            self._entries[explanation_id] = {
+                'text': text,
+                'done': threading.Event(),
+                'claimed': claimed,
+                'created': time.monotonic(),
+                'dedupe_key': dedupe_key,
+                'metadata': metadata
+            }
+            if dedupe_key is not None:
+                self._keys[dedupe_key] = explanation_id
+            self._evict_locked()
+        return explanation_id
+
+    def claim(self, explanation_id: str) -> Optional[Dict[str, Any]]:
+        """Claim a lazy entry for generation.
+
+        Returns:
+            The entry's metadata if the caller should generate the explanation,
+            None if it is unknown, already complete or being produced elsewhere.
+        """
+        with self._lock:
+            entry = self._entries.get(explanation_id)
+            if entry is None or entry['claimed']:
+                return None
+            entry['claimed'] = True
+            return entry['metadata']
+
+    def complete(self, explanation_id: str, text: str) -> None:
+        """Store the final explanation text and wake any waiting readers."""
+        with self._lock:
+            entry = self._entries.get(explanation_id)
+            if entry is None:
+                return  # Evicted while the stream was still running
+            entry['text'] = text
+        entry['done'].set()
+
+    def get(self, explanation_id: str, wait: float = 0) -> Optional[Dict[str, Any]]:
+        """Return {'explanation', 'complete'} for an id, optionally waiting for completion."""
+        if not isinstance(explanation_id, str) or not self.ID_PATTERN.match(explanation_id):
+            return None
+        with self._lock:
+            entry = self._entries.get(explanation_id)
+        if entry is None:
+            return None
+        if wait > 0:
+            entry['done'].wait(wait)
+        return {'explanation': entry['text'], 'complete': entry['done'].is_set()}
+
+    def _evict_locked(self) -> None:
+        """Drop expired entries and the oldest ones beyond max_entries (lock must be held)."""
+        cutoff = time.monotonic() - self.ttl
+        while self._entries:
+            oldest_id, oldest = next(iter(self._entries.items()))
+            if oldest['created'] >= cutoff and len(self._entries) <= self.max_entries:
+                break
+            self._entries.pop(oldest_id)
+            if oldest['dedupe_key'] is not None:
+                self._keys.pop(oldest['dedupe_key'], None)
+            oldest['done'].set()  # Never leave a reader blocked on an evicted entry
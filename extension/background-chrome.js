@@ -219,6 +219,38 @@ function normalizeUrl(url) {
     }
 }
 
+// Register the session context once; /analyze then gets only its id
+async function registerContext(domain, context) {
+    try {
+        const response = await fetch('http://localhost:5000/contextualize', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ domain: domain, context: context || [] })
+        });
+        if (!response.ok) return null;
+        const result = await response.json();
+        return result.context_id || null;
+    } catch (e) {
+        console.error('Error registering context:', e);
+        return null;
+    }
+}
+
+// POST /analyze with the registered context id; resend the full context once
+// if the server no longer knows the id (restart or expiry)
+async function postAnalyze(body, sessionData, context) {
+    const post = (payload) => fetch('http://localhost:5000/analyze', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(payload)
+    });
+    if (sessionData.contextId) {
+        const response = await post({ ...body, context_id: sessionData.contextId });
+        if (response.status !== 409) return response;
+    }
+    return post({ ...body, context: context || [] });
+}
+
 // Helper function to check if URL is a block page
 function isBlockPage(url) {
     return url && url.includes(chrome.runtime.getURL('block.html'));
@@ -526,17 +558,12 @@ chrome.webNavigation.onBeforeNavigate.addListener(async (details) => {
         const timestamp = Date.now();
 
         // Call backend for analysis
-        const response = await fetch('http://localhost:5000/analyze', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                url: url,
-                domain: sessionData.domain,
-                context: sessionData.context || [],
-                session_id: sessionId,
-                is_direct_visit: true // Indicate direct visit
-            })
-        });
+        const response = await postAnalyze({
+            url: url,
+            domain: sessionData.domain,
+            session_id: sessionId,
+            is_direct_visit: true // Indicate direct visit
+        }, sessionData, sessionData.context);
 
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
@@ -742,13 +769,16 @@ chrome.runtime.onMessage.addListener((message, sender, sendResponse) => {
             context: message.context
         };
         
-        chrome.storage.local.set({ 
-            sessionData,
-            domain: message.domain,
-            context: message.context
-        }, () => {
-            console.log('Session started:', sessionData);
-            sendResponse({ success: true });
+        registerContext(message.domain, message.context).then(contextId => {
+            sessionData.contextId = contextId;
+            chrome.storage.local.set({ 
+                sessionData,
+                domain: message.domain,
+                context: message.context
+            }, () => {
+                console.log('Session started:', sessionData);
+                sendResponse({ success: true });
+            });
         });
         return true;
     }
@@ -837,21 +867,13 @@ chrome.webNavigation.onCompleted.addListener(async (details) => {
         console.log(`Analyzing direct visit: ${url}`, { referrer });
         
         // Analyze this URL
-        const serverUrl = 'http://localhost:5000/analyze';
-        const response = await fetch(serverUrl, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                url: url,
-                domain: domain,
-                context: context,
-                session_id: sessionId,
-                referrer: referrer,
-                direct_visit: true // Flag to indicate this is a direct visit
-            })
-        });
+        const response = await postAnalyze({
+            url: url,
+            domain: domain,
+            session_id: sessionId,
+            referrer: referrer,
+            direct_visit: true // Flag to indicate this is a direct visit
+        }, data.sessionData, context);
         
         if (!response.ok) {
             console.error(`Server returned ${response.status} ${response.statusText}`);
@@ -186,17 +186,22 @@ async function handleAnalysis(url, originalUrl, domain, sessionData) {
             return;
         }
 
-        const { context } = await chrome.storage.local.get('context');
-        const response = await fetch('http://localhost:5000/analyze', {
+        const body = {
+            url: originalUrl,
+            domain: domain || sessionData.domain,
+            session_id: sessionData.startTime // Use session start time as ID
+        };
+        const post = (payload) => fetch('http://localhost:5000/analyze', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ 
-                url: originalUrl,
-                domain: domain || sessionData.domain,
-                context: context || sessionData.context || [],
-                session_id: sessionData.startTime // Use session start time as ID
-            })
+            body: JSON.stringify(payload)
         });
+        // Send only the registered context id; resend the full context if the server lost it
+        let response = sessionData.contextId ? await post({ ...body, context_id: sessionData.contextId }) : null;
+        if (!response || response.status === 409) {
+            const { context } = await chrome.storage.local.get('context');
+            response = await post({ ...body, context: context || sessionData.context || [] });
+        }
         
         if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
         
@@ -215,6 +220,7 @@ async function handleAnalysis(url, originalUrl, domain, sessionData) {
         } else {
             showSection('blocked');
             displayBlockedInfo(url, result.explanation);
+            loadFullExplanation(result.explanation_id);
             
             // Notify background script about blocked URL
             sendMessageSafely({
@@ -246,6 +252,7 @@ function handleAnalysisResult(result, url, originalUrl) {
         } else {
             showSection('blocked');
             displayBlockedInfo(url, result.explanation);
+            loadFullExplanation(result.explanation_id);
             
             // Store both original and normalized URLs
             sendMessageSafely({
@@ -345,6 +352,25 @@ function displayBlockedInfo(url, explanation, duration) {
     }
 }
 
+// The AI verdict can arrive before its explanation has finished streaming;
+// fetch the completed text from the server and swap it in.
+async function loadFullExplanation(explanationId) {
+    if (!explanationId) return;
+    try {
+        const response = await fetch(`http://localhost:5000/explain?id=${encodeURIComponent(explanationId)}`);
+        if (!response.ok) return;
+        const data = await response.json();
+        const explanationEl = document.getElementById('explanation');
+        if (explanationEl && data.explanation) {
+            explanationEl.textContent = data.explanation;
+            blockPageState.explanation = data.explanation;
+            blockPageState.save();
+        }
+    } catch (error) {
+        console.error('Failed to load explanation:', error);
+    }
+}
+
 // Timer functionality
 async function updateTimer() {
     try {
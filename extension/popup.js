@@ -546,6 +546,10 @@ document.addEventListener('DOMContentLoaded', () => {
     const analysisSection = document.getElementById('analysisSection');
     
     let currentContext = [];
+    // Server-side conversation token; later rounds send only the new answers
+    let conversationSession = null;
+    // Questions currently shown (the first in #question, the rest in #extraQuestions)
+    let pendingQuestions = [];
     
     document.getElementById('blockDuration').addEventListener('input', saveFormState);
     document.getElementById('durationUnit').addEventListener('change', saveFormState);
@@ -593,8 +597,16 @@ document.addEventListener('DOMContentLoaded', () => {
         const answer = document.getElementById('answer').value;
         if (!answer) return;
         
-        const question = document.getElementById('question').textContent;
-        currentContext.push({ question, answer });
+        // Questions come in small batches; collect every answer and submit them together
+        const extraAnswers = Array.from(document.querySelectorAll('#extraQuestions .extra-answer'))
+            .map(input => input.value.trim());
+        const answers = [answer, ...extraAnswers];
+        const questions = pendingQuestions.length ? pendingQuestions : [document.getElementById('question').textContent];
+        questions.forEach((question, i) => {
+            if (answers[i]) {
+                currentContext.push({ question, answer: answers[i] });
+            }
+        });
         
         storageState.context = currentContext;
         await chromeStorage.set({
@@ -603,44 +615,117 @@ document.addEventListener('DOMContentLoaded', () => {
         console.log('Stored updated context:', currentContext);
         
         const domain = document.getElementById('domain').value;
-        const response = await fetch('http://localhost:5000/get_question', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                domain: domain,
-                context: currentContext
-            })
-        });
-        
-        const data = await response.json();
+        const data = await requestQuestions(domain, answers);
         
         if (data.question === 'DONE') {
+            showQuestions([]);
             startAnalysis();
         } else {
-            document.getElementById('question').textContent = data.question;
-            storageState.currentQuestion = data.question;
-            document.getElementById('answer').value = '';
-            storageState.currentAnswer = '';
-            saveFormState();
+            showQuestions(data.questions || [data.question]);
         }
     });
     
     async function getNextQuestion(domain) {
-        const response = await fetch('http://localhost:5000/get_question', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                domain: domain,
-                context: currentContext
-            })
-        });
+        conversationSession = null;
+        const data = await requestQuestions(domain, null);
+        showQuestions(data.questions || [data.question]);
+    }
+    
+    function showQuestions(questions) {
+        // The first question uses the regular input (saved with the form state), the rest get extra inputs
+        pendingQuestions = questions;
+        const extra = document.getElementById('extraQuestions');
+        extra.innerHTML = '';
+        if (!questions.length) return;
         
-        const data = await response.json();
-        document.getElementById('question').textContent = data.question;
-        storageState.currentQuestion = data.question;
+        document.getElementById('question').textContent = questions[0];
+        storageState.currentQuestion = questions[0];
+        document.getElementById('answer').value = '';
+        storageState.currentAnswer = '';
+        questions.slice(1).forEach(text => {
+            const label = document.createElement('div');
+            label.style.margin = '10px 0';
+            label.textContent = text;
+            const input = document.createElement('input');
+            input.type = 'text';
+            input.className = 'extra-answer';
+            input.placeholder = 'Enter response...';
+            extra.appendChild(label);
+            extra.appendChild(input);
+        });
         saveFormState();
     }
     
+    async function requestQuestions(domain, answers) {
+        // Continue the server-side conversation if there is one, otherwise (re)start it from the full context
+        const post = async (body) => {
+            try {
+                const response = await fetch('http://localhost:5000/get_question/stream', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+                    body: JSON.stringify({ batch: true, ...body })
+                });
+                if (!response.ok || !response.body) throw new Error(`HTTP ${response.status}`);
+                return await readQuestionStream(response);
+            } catch (error) {
+                console.warn('Question stream unavailable, falling back to JSON:', error);
+                const response = await fetch('http://localhost:5000/get_question', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ batch: true, ...body })
+                });
+                return response.json();
+            }
+        };
+        
+        let data = null;
+        if (conversationSession && answers) {
+            data = await post({ domain: domain, session: conversationSession, answers: answers });
+        }
+        if (!data || data.session_expired) {
+            data = await post({ domain: domain, context: currentContext });
+        }
+        conversationSession = data.session || null;
+        return data;
+    }
+    
+    async function readQuestionStream(response) {
+        // Show the question as the model writes it; resolve with the final event's payload
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        const questionElement = document.getElementById('question');
+        let buffer = '';
+        let streamed = '';
+        let result = null;
+        
+        while (!result) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            let boundary;
+            while (!result && (boundary = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                const event = (block.match(/^event: (.*)$/m) || [])[1];
+                const data = JSON.parse((block.match(/^data: (.*)$/m) || [])[1] || '{}');
+                
+                if (event === 'token') {
+                    streamed += data.text;
+                    questionElement.textContent = streamed;
+                } else if (event === 'error') {
+                    throw new Error(data.error);
+                } else {
+                    result = data;  // 'question', 'done' or 'expired'
+                }
+            }
+        }
+        
+        reader.cancel().catch(() => {});
+        if (!result) throw new Error('Question stream ended early');
+        return result;
+    }
+    
     async function startAnalysis() {
         try {
             contextQuestions.classList.add('hidden');
@@ -4,6 +4,8 @@ Optimized for security and performance.
 """
 
 import os
+import gc
+import math
 import multiprocessing
 
 # Server socket
@@ -11,11 +13,32 @@ bind = "0.0.0.0:5000"
 backlog = 2048
 
 # Worker processes
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"  # Use sync worker instead of gevent
-worker_connections = 1000
-max_requests = 1000
-max_requests_jitter = 100
+# Requests spend most of their time waiting on the model, so a worker should
+# hold several in flight: 'gthread' (threads per worker, the default) or
+# 'gevent' (cooperative; model calls use the REST transport). 'sync' serves
+# one request per worker at a time.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+
+# Requests in flight per worker, from Little's law: target rate x time each
+# request spends waiting on the model, split across the workers
+expected_ai_latency = float(os.getenv("EXPECTED_AI_LATENCY", "1.5"))  # Seconds per model call
+target_rps = float(os.getenv("TARGET_RPS", "50"))  # /analyze requests per second for the host
+in_flight_per_worker = max(2, math.ceil(target_rps * expected_ai_latency / workers))
+
+if worker_class == "gthread":
+    threads = int(os.getenv("GUNICORN_THREADS", in_flight_per_worker))
+    concurrency = threads
+elif worker_class == "gevent":
+    worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 1000))
+    concurrency = in_flight_per_worker
+    os.environ.setdefault("GENAI_TRANSPORT", "rest")  # gRPC channels block the gevent hub
+else:
+    concurrency = 1
+
+# Model calls per worker: one per request plus one streamed explanation or
+# speculative call each (read by model_pool when the app is loaded)
+os.environ.setdefault("MODEL_CALL_CONCURRENCY", str(2 * concurrency))
 
 # Worker timeout and restarts
 timeout = 30
@@ -51,8 +74,15 @@ certfile = None
 max_requests = 1000
 max_requests_jitter = 50
 
-# Preload application for better performance
-preload_app = True
+# Preload application for better performance; gevent workers load it after
+# monkey-patching instead, so the app's locks and threads are cooperative
+preload_app = worker_class != "gevent"
+
+# Freeze the objects the preloaded master built (the app, compiled settings,
+# rule indexes and prompt fragments, the model SDK) before forking: garbage
+# collections in the workers then never write to them, and the pages stay
+# shared instead of being copied into every worker
+gc_freeze = preload_app and os.getenv("GC_FREEZE", "true").lower() == "true"
 
 # Enable stats
 statsd_host = None
@@ -60,6 +90,14 @@ statsd_prefix = "eclipse_shield"
 
 def when_ready(server):
     """Called when the server is ready to accept connections."""
+    if preload_app:
+        # The app defers the model SDK import (about a second) to first use; import it in the
+        # master so the workers forked from it share the modules instead of each importing them
+        from script import import_model_sdk
+        import_model_sdk()
+    if gc_freeze:
+        gc.freeze()
+        server.log.info(f"Froze {gc.get_freeze_count()} objects before forking workers")
     server.log.info("Eclipse Shield server ready to accept connections")
 
 def worker_int(worker):
@@ -67,13 +105,35 @@ def worker_int(worker):
     worker.log.info("Worker interrupted")
 
 def pre_fork(server, worker):
-    """Called before a worker is forked."""
+    """Called before a worker is forked.
+
+    With preload_app the master brings its settings up to date first (a stat and
+    a snapshot read when unchanged), so workers started after settings.json was
+    edited, on SIGHUP or when recycled, start from the current version.
+    """
+    if preload_app:
+        analyzer = getattr(server.app.wsgi(), 'extensions', {}).get('analyzer')
+        if analyzer is not None:
+            analyzer.reload_settings()
     server.log.info(f"Worker {worker.pid} forked")
 
 def post_fork(server, worker):
     """Called after a worker is forked."""
     server.log.info(f"Worker {worker.pid} ready")
 
+def post_worker_init(worker):
+    """Called in each worker once the app is loaded (after gevent's monkey-patching).
+
+    Creates the worker's own model client, warmed up unless MODEL_WARMUP=false,
+    so the first request does not pay for connection setup, and starts watching
+    settings.json (every SETTINGS_RELOAD_INTERVAL seconds) so edits reach every
+    worker without a restart.
+    """
+    analyzer = getattr(worker.wsgi, 'extensions', {}).get('analyzer')
+    if analyzer is not None:
+        analyzer.prepare_model()
+        analyzer.watch_settings()
+
 def worker_abort(worker):
     """Called when a worker is aborted."""
     worker.log.info(f"Worker {worker.pid} aborted")
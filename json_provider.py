@@ -0,0 +1,87 @@
+"""
+JSON provider for Eclipse Shield.
+Decodes request bodies and encodes responses with orjson when it is installed
+(JSON_BACKEND=orjson, the default) and with the json module otherwise,
+keeping Flask's output conventions: sorted dict keys, dates as HTTP dates,
+dataclasses as objects and indented output in debug mode. encode() returns a
+response body as bytes, so callers can keep it and answer later requests
+with body_response() without encoding again.
+"""
+
+import os
+import logging
+from dataclasses import fields, is_dataclass
+
+from flask.json.provider import DefaultJSONProvider
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 'orjson' (used when installed) or 'json' for the standard library encoder
+JSON_BACKEND = os.getenv("JSON_BACKEND", "orjson").lower()
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask's DefaultJSONProvider, backed by orjson when available.
+
+    Values orjson cannot encode itself (dates, decimals, objects with
+    __html__) go through the same default() as Flask's provider; values it
+    rejects outright, such as integers beyond 64 bits, fall back to the json
+    module, so both backends accept the same objects.
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.backend = 'orjson' if JSON_BACKEND == 'orjson' and orjson is not None else 'json'
+        if JSON_BACKEND == 'orjson' and orjson is None:
+            logger.info("FastJSONProvider - orjson not installed, using the json module")
+
+    @staticmethod
+    def default(o):
+        # One level at a time instead of dataclasses.asdict, which deep-copies every value
+        if is_dataclass(o) and not isinstance(o, type):
+            return {f.name: getattr(o, f.name) for f in fields(o)}
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs) -> str:
+        if self.backend == 'orjson' and not kwargs:
+            try:
+                return orjson.dumps(obj, default=self.default, option=self._options(False)).decode('utf-8')
+            except TypeError:
+                pass
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if self.backend == 'orjson' and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def encode(self, obj) -> bytes:
+        """The response body for obj, exactly as response() would send it."""
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        if self.backend == 'orjson':
+            try:
+                return orjson.dumps(obj, default=self.default, option=self._options(indent)) + b'\n'
+            except TypeError:
+                pass
+        dump_args = {'indent': 2} if indent else {'separators': (',', ':')}
+        return f"{super().dumps(obj, **dump_args)}\n".encode('utf-8')
+
+    def response(self, *args, **kwargs):
+        return self.body_response(self.encode(self._prepare_response_obj(args, kwargs)))
+
+    def body_response(self, body: bytes, status: int = None):
+        """JSON response for an already encoded body (see encode)."""
+        return self._app.response_class(body, status=status, mimetype=self.mimetype)
+
+    def _options(self, indent: bool) -> int:
+        # Dates are passed to default() so they are formatted as Flask formats them
+        options = orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
@@ -0,0 +1,174 @@
+"""
+Host-wide storage for Flask-Limiter.
+Registers the shm:// scheme: fixed-window counters live in a memory-mapped
+file (in /dev/shm when available), so every gunicorn worker on the host
+counts against the same limits without a network round-trip. Set
+RATE_LIMIT_STORAGE_URL to 'shm:///path/to/file' to choose the file, or to a
+redis:// URL to share limits across hosts instead.
+"""
+
+import os
+import fcntl
+import hashlib
+import mmap
+import struct
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+import logging
+
+from limits.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+                            'eclipse-shield-limits')
+DEFAULT_SLOTS = 65536
+
+_MAGIC = b'ESLIMIT1'
+_HEADER = struct.Struct('<8sQ')  # magic, number of slots
+_SLOT = struct.Struct('<Qqd')  # key hash (0 = never used), count, expiry (epoch seconds)
+_MAX_PROBES = 32
+
+def _key_hash(key: str) -> int:
+    """Stable 64-bit hash of a limit key (never 0, which marks an unused slot)."""
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') or 1
+
+class SharedMemoryStorage(Storage):
+    """Fixed-window counters in an open-addressed table in a shared memory-mapped file.
+
+    The table has a fixed number of slots, so memory does not grow with the
+    number of clients. Expired slots are reused, and if all probed slots are
+    live, the one that expires soonest is overwritten. Updates hold a POSIX
+    record lock on the file (between processes) and a thread lock (between
+    threads of one process).
+    """
+
+    STORAGE_SCHEME = ["shm"]
+
+    def __init__(self, uri: str = None, wrap_exceptions: bool = False, slots: int = DEFAULT_SLOTS, **options):
+        self.path = (urlparse(uri).path if uri else '') or DEFAULT_PATH
+        self._thread_lock = threading.Lock()
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(fd, fcntl.LOCK_EX)
+        try:
+            size = _HEADER.size + int(slots) * _SLOT.size
+            if os.fstat(fd).st_size < _HEADER.size:
+                os.ftruncate(fd, size)
+                os.pwrite(fd, _HEADER.pack(_MAGIC, int(slots)), 0)
+            magic, file_slots = _HEADER.unpack(os.pread(fd, _HEADER.size, 0))
+            if magic != _MAGIC:
+                raise ValueError(f"{self.path} is not a limiter table")
+            if file_slots != int(slots):
+                logger.warning(f"SharedMemoryStorage - {self.path} has {file_slots} slots, using it as is")
+            self.slots = file_slots
+            self._fd = fd
+            self._table = mmap.mmap(fd, _HEADER.size + file_slots * _SLOT.size)
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN)
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return (OSError, ValueError)
+
+    def incr(self, key: str, expiry: float, amount: int = 1) -> int:
+        """Add amount to key's counter, starting a new window of `expiry` seconds if it had expired."""
+        key_hash = _key_hash(key)
+        with self._locked():
+            now = time.time()
+            offset = self._find(key_hash, now, create=True)
+            _, count, expires = _SLOT.unpack_from(self._table, offset)
+            if expires <= now:
+                count = 0
+            count += amount
+            if count == amount:
+                expires = now + expiry
+            _SLOT.pack_into(self._table, offset, key_hash, count, expires)
+            return count
+
+    def get(self, key: str) -> int:
+        with self._locked():
+            now = time.time()
+            offset = self._find(_key_hash(key), now)
+            if offset is None:
+                return 0
+            _, count, expires = _SLOT.unpack_from(self._table, offset)
+            return count if expires > now else 0
+
+    def get_expiry(self, key: str) -> float:
+        with self._locked():
+            now = time.time()
+            offset = self._find(_key_hash(key), now)
+            if offset is None:
+                return now
+            _, _, expires = _SLOT.unpack_from(self._table, offset)
+            return expires if expires > now else now
+
+    def check(self) -> bool:
+        return not self._table.closed
+
+    def reset(self) -> int:
+        """Clear every counter; returns how many were live."""
+        with self._locked():
+            now = time.time()
+            live = sum(1 for _, count, expires in _SLOT.iter_unpack(self._table[_HEADER.size:])
+                       if count and expires > now)
+            self._table[_HEADER.size:] = bytes(self.slots * _SLOT.size)
+            return live
+
+    def clear(self, key: str) -> None:
+        key_hash = _key_hash(key)
+        with self._locked():
+            offset = self._find(key_hash, time.time())
+            if offset is not None:
+                # The hash stays so that probe chains through this slot are kept
+                _SLOT.pack_into(self._table, offset, key_hash, 0, 0.0)
+
+    def _find(self, key_hash: int, now: float, create: bool = False):
+        """Offset of key_hash's slot; with create, claims a free (or the soonest-expiring) slot if absent."""
+        free = None
+        soonest = None
+        for probe in range(_MAX_PROBES):
+            offset = _HEADER.size + ((key_hash + probe) % self.slots) * _SLOT.size
+            slot_hash, _, expires = _SLOT.unpack_from(self._table, offset)
+            if slot_hash == key_hash:
+                return offset
+            if free is None and (slot_hash == 0 or expires <= now):
+                free = offset
+            if slot_hash == 0:
+                break
+            if soonest is None or expires < soonest[0]:
+                soonest = (expires, offset)
+        if not create:
+            return None
+        offset = free if free is not None else soonest[1]
+        _SLOT.pack_into(self._table, offset, key_hash, 0, 0.0)
+        return offset
+
+    def _locked(self):
+        return _TableLock(self._thread_lock, self._fd)
+
+class _TableLock:
+    """Thread lock plus an exclusive record lock on the table file."""
+
+    __slots__ = ('thread_lock', 'fd')
+
+    def __init__(self, thread_lock: threading.Lock, fd: int):
+        self.thread_lock = thread_lock
+        self.fd = fd
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX)
+        except BaseException:
+            self.thread_lock.release()
+            raise
+
+    def __exit__(self, *exc_info):
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+        finally:
+            self.thread_lock.release()
@@ -0,0 +1,117 @@
+"""
+Per-process model client for Eclipse Shield.
+LazyModel creates the generative model, and with it the SDK's API client and
+gRPC channel, on first use in each process. A worker forked from a gunicorn
+master that already used the model (preload_app, question preseeding) builds
+its own client instead of sharing the master's connection. prepare(), called
+from gunicorn's post_worker_init hook, creates the client before the first
+request, optionally with a warm-up call; an optional keepalive pings the API
+while the worker is idle so the connection is not dropped.
+"""
+
+import os
+import threading
+import time
+import weakref
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Warm-up call when a worker prepares its client (count_tokens: no generation, no output tokens)
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() == "true"
+MODEL_WARMUP_TIMEOUT = float(os.getenv("MODEL_WARMUP_TIMEOUT", "5"))
+# Ping the API after this many idle seconds to keep the connection open; 0 disables
+MODEL_KEEPALIVE = float(os.getenv("MODEL_KEEPALIVE", "0"))
+
+WARMUP_CONTENTS = "ping"
+
+_instances = weakref.WeakSet()
+
+def _after_fork_in_child() -> None:
+    for model in list(_instances):
+        model._forget()
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+class LazyModel:
+    """A model created by factory on first use in each process.
+
+    Calls and attributes go to this process's model. In a forked child the
+    parent's model is kept referenced but never used, so its connection is
+    neither shared nor closed from the child.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.last_used = 0.0  # time.monotonic() of the last call
+        self._model = None
+        self._inherited = []
+        self._lock = threading.Lock()
+        self._keepalive = None
+        _instances.add(self)
+
+    def get(self):
+        """This process's model, created on first use."""
+        model = self._model
+        if model is None:
+            with self._lock:
+                if self._model is None:
+                    start = time.monotonic()
+                    self._model = self.factory()
+                    logger.info(f"LazyModel.get - Model client created in process {os.getpid()} "
+                                f"in {(time.monotonic() - start) * 1000:.0f} ms")
+                model = self._model
+        return model
+
+    def generate_content(self, *args, **kwargs):
+        self.last_used = time.monotonic()
+        return self.get().generate_content(*args, **kwargs)
+
+    def count_tokens(self, *args, **kwargs):
+        self.last_used = time.monotonic()
+        return self.get().count_tokens(*args, **kwargs)
+
+    def start_chat(self, *args, **kwargs):
+        return self.get().start_chat(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def prepare(self, warmup: bool = None, keepalive: float = None) -> None:
+        """Create the client now, warm its connection up and start the keepalive if configured."""
+        warmup = MODEL_WARMUP if warmup is None else warmup
+        keepalive = MODEL_KEEPALIVE if keepalive is None else keepalive
+        start = time.monotonic()
+        self.get()
+        if warmup:
+            self._ping('warm-up')
+        if keepalive > 0 and self._keepalive is None:
+            self._keepalive = threading.Thread(target=self._keep_alive, args=(keepalive,), daemon=True,
+                                               name="model-keepalive")
+            self._keepalive.start()
+        logger.info(f"LazyModel.prepare - Model ready in process {os.getpid()} "
+                    f"in {(time.monotonic() - start) * 1000:.0f} ms")
+
+    def _ping(self, reason: str) -> None:
+        try:
+            self.count_tokens(WARMUP_CONTENTS, request_options={'timeout': MODEL_WARMUP_TIMEOUT})
+        except Exception as e:
+            logger.warning(f"LazyModel._ping - {reason} call failed: {e}")
+
+    def _keep_alive(self, interval: float) -> None:
+        while True:
+            idle = time.monotonic() - self.last_used
+            if idle >= interval:
+                self._ping('keepalive')
+                idle = 0.0
+            time.sleep(interval - idle)
+
+    def _forget(self) -> None:
+        """Drop the parent's model and per-process state after a fork."""
+        if self._model is not None:
+            self._inherited.append(self._model)
+        self._model = None
+        self._lock = threading.Lock()
+        self._keepalive = None
@@ -0,0 +1,107 @@
+"""
+Bounded model calls for Eclipse Shield.
+ModelCallPool wraps the generative model and caps how many calls one worker
+process has in flight, across request threads (or greenlets), speculative
+calls and explanation streams. Calls beyond the cap wait for a free slot for
+a bounded time and then fail fast, instead of piling more blocked threads
+onto a slow or rate-limited API.
+"""
+
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Model calls in flight per worker process; gunicorn.conf.py derives it from the worker's concurrency
+MODEL_CALL_CONCURRENCY = int(os.getenv("MODEL_CALL_CONCURRENCY", "16"))
+# Seconds a call may wait for a free slot before it fails
+MODEL_CALL_WAIT = float(os.getenv("MODEL_CALL_WAIT", "10"))
+
+class ModelPoolExhausted(RuntimeError):
+    """No model call slot became free within the wait time."""
+
+class ModelCallPool:
+    """Model wrapper that allows at most max_calls concurrent generate_content calls.
+
+    A streamed call keeps its slot until the stream has been read, closed or
+    garbage collected, since it keeps its connection open until then. Chats
+    started through the pool send their messages through it as well. Any
+    other attribute is the wrapped model's.
+    """
+
+    def __init__(self, model, max_calls: int = None, wait: float = None):
+        self.model = model
+        self.max_calls = MODEL_CALL_CONCURRENCY if max_calls is None else max_calls
+        self.wait = MODEL_CALL_WAIT if wait is None else wait
+        self._slots = threading.BoundedSemaphore(self.max_calls)
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'waited': 0, 'rejected': 0, 'in_flight': 0, 'peak': 0}
+
+    def generate_content(self, *args, stream: bool = False, **kwargs):
+        self._acquire()
+        try:
+            response = self.model.generate_content(*args, stream=stream, **kwargs)
+        except BaseException:
+            self._release()
+            raise
+        if stream:
+            return _HeldStream(response, self._release)
+        self._release()
+        return response
+
+    def start_chat(self, *args, **kwargs):
+        chat = self.model.start_chat(*args, **kwargs)
+        chat.model = self  # The chat sends every message through model.generate_content
+        return chat
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def _acquire(self) -> None:
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.stats['waited'] += 1
+            start = time.monotonic()
+            if not self._slots.acquire(timeout=self.wait):
+                with self._lock:
+                    self.stats['rejected'] += 1
+                raise ModelPoolExhausted(f"No model call slot free after {self.wait:.1f}s "
+                                         f"({self.max_calls} calls in flight)")
+            logger.debug(f"ModelCallPool._acquire - Waited {time.monotonic() - start:.3f}s for a slot")
+        with self._lock:
+            self.stats['calls'] += 1
+            self.stats['in_flight'] += 1
+            self.stats['peak'] = max(self.stats['peak'], self.stats['in_flight'])
+
+    def _release(self) -> None:
+        with self._lock:
+            self.stats['in_flight'] -= 1
+        self._slots.release()
+
+class _HeldStream:
+    """A streamed response that gives its pool slot back once read, closed or collected."""
+
+    def __init__(self, response, release):
+        self._held_response = response
+        self._held_release = release
+
+    def __iter__(self):
+        try:
+            yield from self._held_response
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        release, self._held_release = self._held_release, None
+        if release is not None:
+            release()
+
+    def __del__(self):
+        self.close()
+
+    def __getattr__(self, name):
+        if name.startswith('_held_'):
+            raise AttributeError(name)
+        return getattr(self._held_response, name)
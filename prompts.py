@@ -0,0 +1,187 @@
+"""
+Prompt compiler for Eclipse Shield.
+Builds the AI stage prompt from pieces that are rendered once per settings
+version (the per-domain policy fragments), encodes the task context compactly
+and keeps every prompt under a hard token budget.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from typing import Dict, Optional
+import logging
+
+from results import ContextRelevance
+
+logger = logging.getLogger(__name__)
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "512"))
+
+# Longest URL / search query / matched-terms list kept in a prompt
+MAX_URL_CHARS = 300
+MAX_QUERY_CHARS = 200
+MAX_MATCHED_TERMS = 8
+# Shortest an answer is cut to before answers are dropped altogether
+MIN_ANSWER_CHARS = 40
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of a prompt (~4 characters per token)."""
+    return -(-len(text) // 4)
+
+def settings_version(settings: dict) -> str:
+    """Short, stable fingerprint of a settings dict."""
+    encoded = json.dumps(settings, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:12]
+
+def encode_context(context_data: Dict) -> str:
+    """Encode the task context as one 'question: answer' line per non-empty answer."""
+    lines = []
+    for question, answer in context_data.items():
+        if isinstance(answer, str) and answer.strip():
+            lines.append(f"- {' '.join(str(question).split())}: {' '.join(answer.split())}")
+    return '\n'.join(lines)
+
+def _truncate(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit - 3] + '...'
+
+class PromptCompiler:
+    """Compiles AI stage prompts, caching the per-domain policy fragments.
+
+    Each domain has a full fragment (with its blocked keyword and site lists)
+    and a compact one without them. Fragments are rendered on first use and
+    dropped whenever load() sees a new settings version.
+    """
+
+    def __init__(self, settings: dict, token_budget: int = PROMPT_TOKEN_BUDGET, version: str = None):
+        self.token_budget = token_budget
+        self._lock = threading.Lock()
+        # (settings, {domain: (full fragment, compact fragment)}), replaced as a whole by load()
+        self._state = ({}, {})
+        self.version = None
+        self.stats = {'compiled': 0, 'trimmed': 0, 'tokens': 0}
+        self.load(settings, version)
+
+    def load(self, settings: dict, version: str = None, precompile: bool = False) -> None:
+        """Switch to a new settings dict, discarding fragments of the previous version.
+
+        version is settings_version(settings) when the caller already has it (a settings snapshot).
+        With precompile every domain's fragments are rendered before the switch, so
+        requests never render them after a reload.
+        """
+        version = version or settings_version(settings)
+        if version == self.version:
+            return
+        fragments = {domain: self._render(settings, domain) for domain in settings.get('domains', {})} if precompile else {}
+        with self._lock:
+            if version == self.version:
+                return
+            self._state = (settings, fragments)
+            self.version = version
+        logger.debug(f"PromptCompiler.load - Settings version {version}")
+
+    def policy_fragments(self, domain: str) -> tuple:
+        """Return (full, compact) policy fragments for a domain, rendering them once."""
+        settings, rendered = self._state
+        fragments = rendered.get(domain)
+        if fragments is not None:
+            return fragments
+
+        fragments = self._render(settings, domain)
+        with self._lock:
+            rendered[domain] = fragments  # Kept with the version it was rendered from
+        return fragments
+
+    def precompile(self) -> None:
+        """Render every domain's fragments now (in the gunicorn master, so forked workers share them)."""
+        for domain in list(self._state[0].get('domains', {})):
+            self.policy_fragments(domain)
+
+    @staticmethod
+    def _render(settings: dict, domain: str) -> tuple:
+        settings = settings.get('domains', {}).get(domain, {})
+        compact = (f"Domain policy for '{domain}': allowed platforms (LMS, productivity and AI tools) "
+                   f"and blocked keywords/sites were already checked.")
+        full = compact
+        keywords = [k for k in settings.get('blocked_keywords', []) if isinstance(k, str)]
+        sites = [s for s in settings.get('blocked_specific', []) if isinstance(s, str)]
+        if keywords:
+            full += f"\nBlocked keywords: {', '.join(keywords)}"
+        if sites:
+            full += f"\nBlocked sites: {', '.join(sites)}"
+        return full, compact
+
+    def compile(self, url: str, domain: str, context_data: Dict, url_signals: dict,
+                context_relevance: Optional[ContextRelevance], instructions: str, encoded_context: Optional[str] = None) -> str:
+        """Build the prompt for one URL, trimming low-value parts to fit the token budget.
+
+        encoded_context is the already encoded context_data (a context
+        profile's prompt fragment); it is reused until answers get trimmed.
+        context_relevance is None when no context check was run.
+
+        Parts are given up in this order: matched context terms, the blocked
+        keyword/site lists, then the longest context answers. The URL line,
+        the analysis goal and the response instructions are always kept.
+        """
+        full_policy, compact_policy = self.policy_fragments(domain)
+
+        url_lines = [f"URL: {_truncate(url, MAX_URL_CHARS)}",
+                     f"Hostname: {url_signals.get('hostname') or 'N/A'}; category: {url_signals.get('domain_type') or 'N/A'}"]
+        if url_signals.get('is_search'):
+            url_lines.append(f"Search query: {_truncate(url_signals.get('search_query') or '', MAX_QUERY_CHARS)}")
+        if context_relevance is not None:
+            url_lines.append(f"Context relevance: {context_relevance.score}")
+        matched_terms = context_relevance.matched_terms if context_relevance is not None else []
+        terms_line = f"Matched terms: {', '.join(matched_terms[:MAX_MATCHED_TERMS])}" if matched_terms else ''
+
+        answers = all_answers = {q: a for q, a in context_data.items() if isinstance(a, str) and a.strip()}
+        goal = (f"Allow only if the URL directly serves the user's task, or is generally needed in the "
+                f"'{domain}' domain (documentation, core tools). Block time-wasters (social media, games, "
+                f"entertainment) unless the task clearly justifies them.")
+
+        def render(policy, terms, answers):
+            if not answers:
+                context = "None provided."
+            elif answers is all_answers and encoded_context is not None:
+                context = encoded_context
+            else:
+                context = encode_context(answers)
+            parts = [f"Decide whether visiting this URL is productive for the user in the '{domain}' domain.",
+                     policy,
+                     f"User task context:\n{context}",
+                     '\n'.join(url_lines + ([terms] if terms else [])),
+                     goal,
+                     instructions]
+            return '\n\n'.join(part.strip() for part in parts)
+
+        prompt = render(full_policy, terms_line, answers)
+        trimmed = False
+        if estimate_tokens(prompt) > self.token_budget:
+            trimmed = True
+            prompt = render(full_policy, '', answers)
+        if estimate_tokens(prompt) > self.token_budget:
+            prompt = render(compact_policy, '', answers)
+        while estimate_tokens(prompt) > self.token_budget and answers:
+            answers = self._shorten_longest(answers, (estimate_tokens(prompt) - self.token_budget) * 4)
+            prompt = render(compact_policy, '', answers)
+        if estimate_tokens(prompt) > self.token_budget:
+            logger.warning(f"PromptCompiler.compile - Prompt for '{domain}' is over budget "
+                           f"({estimate_tokens(prompt)} > {self.token_budget} tokens) after trimming")
+
+        with self._lock:
+            self.stats['compiled'] += 1
+            self.stats['trimmed'] += trimmed
+            self.stats['tokens'] += estimate_tokens(prompt)
+        return prompt
+
+    @staticmethod
+    def _shorten_longest(answers: Dict, excess_chars: int) -> Dict:
+        """Cut the longest answer by excess_chars, or drop it once it is already short."""
+        question = max(answers, key=lambda q: len(answers[q]))
+        answer = ' '.join(answers[question].split())
+        shortened = dict(answers)
+        if len(answer) <= MIN_ANSWER_CHARS:
+            del shortened[question]
+        else:
+            shortened[question] = _truncate(answer, max(MIN_ANSWER_CHARS, len(answer) - excess_chars - 3))
+        return shortened
@@ -0,0 +1,248 @@
+"""
+Rate-limiting primitives for Eclipse Shield.
+SlidingWindowCounter keeps approximate per-key event counts over a sliding
+window in fixed memory: a small ring of time buckets per key and a cap on the
+number of keys, evicting the least recently active keys first.
+TokenBucketLimiter admits requests per key at a steady rate with bursts up to
+a capacity. With a Redis URL both keep their state in Redis, so all workers
+on the host share one limit.
+"""
+
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+RATE_PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+# Refill and take one token atomically; Redis' clock is shared by every worker
+_TOKEN_BUCKET_SCRIPT = """
+local rate, capacity = tonumber(ARGV[1]), tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = clock[1] + clock[2] / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'stamp')
+local tokens = tonumber(state[1]) or capacity
+local stamp = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - stamp) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'stamp', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+def parse_rate(rate: str) -> Tuple[int, float]:
+    """Parse a limit like '50/minute' into (requests, period in seconds)."""
+    count, _, period = rate.strip().lower().partition('/')
+    period = period.strip().rstrip('s') or 'minute'
+    if period not in RATE_PERIODS or not count.strip().isdigit() or int(count) < 1:
+        raise ValueError(f"Invalid rate '{rate}', expected e.g. '50/minute'")
+    return int(count), RATE_PERIODS[period]
+
+class _Ring:
+    """Per-key buckets; slots[i] is the bucket number that counts[i] belongs to."""
+
+    __slots__ = ('slots', 'counts', 'last_slot')
+
+    def __init__(self, size: int):
+        self.slots = array('q', [-1]) * size  # Unboxed, so a ring's size does not depend on its values
+        self.counts = array('L', [0]) * size
+        self.last_slot = -1
+
+class SlidingWindowCounter:
+    """Approximate sliding-window counts per key with O(1) add and count.
+
+    The window is split into `buckets` buckets. A count adds the buckets inside
+    the window and the overlapping part of the oldest one, assuming its events
+    were spread evenly, so the error is at most one bucket's worth of events.
+    """
+
+    def __init__(self, window: int = 3600, buckets: int = 12, max_keys: int = 10000,
+                 namespace: str = 'events', url: Optional[str] = None):
+        self.window = window
+        self.buckets = buckets
+        self.width = window / buckets
+        self.max_keys = max_keys
+        self.namespace = namespace
+        self._rings = OrderedDict()  # key -> _Ring, least recently added to first
+        self._lock = threading.Lock()
+        self._redis = None
+        if url:
+            if redis is None:
+                logger.warning(f"SlidingWindowCounter - redis package not installed, '{namespace}' counts are per worker")
+            else:
+                self._redis = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+
+    def add(self, key: str, now: Optional[float] = None) -> None:
+        """Record one event for key."""
+        now = time.time() if now is None else now
+        slot = int(now // self.width)
+        with self._lock:
+            ring = self._rings.get(key)
+            if ring is None:
+                ring = self._rings[key] = _Ring(self.buckets + 1)
+            else:
+                self._rings.move_to_end(key)
+            index = slot % len(ring.slots)
+            if ring.slots[index] != slot:
+                ring.slots[index] = slot
+                ring.counts[index] = 0
+            ring.counts[index] += 1
+            ring.last_slot = slot
+            self._evict_locked(slot)
+
+        if self._redis is None:
+            return
+        try:
+            bucket_key = f"{self.namespace}:{key}:{slot}"
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.incr(bucket_key)
+            pipe.expire(bucket_key, int(self.window + 2 * self.width))
+            pipe.execute()
+        except Exception as e:
+            logger.debug(f"SlidingWindowCounter.add - Redis unavailable: {e}")
+
+    def count(self, key: str, window: Optional[float] = None, now: Optional[float] = None) -> float:
+        """Approximate number of events for key in the last `window` seconds (at most the configured window)."""
+        now = time.time() if now is None else now
+        window = self.window if window is None else min(window, self.window)
+        slot = int(now // self.width)
+
+        if self._redis is not None:
+            try:
+                shared = _Ring(self.buckets + 1)
+                slots = range(slot - self.buckets, slot + 1)
+                values = self._redis.mget([f"{self.namespace}:{key}:{s}" for s in slots])
+                for s, value in zip(slots, values):
+                    if value is not None:
+                        shared.slots[s % len(shared.slots)] = s
+                        shared.counts[s % len(shared.slots)] = int(value)
+                return self._estimate(shared, now, window)
+            except Exception as e:
+                logger.debug(f"SlidingWindowCounter.count - Redis unavailable, using local counts: {e}")
+
+        with self._lock:
+            ring = self._rings.get(key)
+            if ring is None or ring.last_slot < slot - self.buckets:
+                return 0
+            return self._estimate(ring, now, window)
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Drop keys without events in the last window; returns how many were dropped."""
+        now = time.time() if now is None else now
+        with self._lock:
+            before = len(self._rings)
+            self._evict_locked(int(now // self.width))
+            return before - len(self._rings)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rings
+
+    def __len__(self) -> int:
+        return len(self._rings)
+
+    def _estimate(self, ring: _Ring, now: float, window: float) -> float:
+        """Sum the current bucket and the buckets before it that overlap the window, weighting the oldest."""
+        slots, counts, size = ring.slots, ring.counts, len(ring.slots)
+        position = now / self.width
+        slot = int(position)
+        total = 0.0
+        weight = 1.0
+        remaining = window / self.width - (position - slot)  # Window left before the current bucket, in buckets
+        while True:
+            index = slot % size
+            if slots[index] == slot:
+                total += counts[index] * weight
+            if remaining <= 0:
+                return total
+            weight = min(1.0, remaining)
+            remaining -= 1
+            slot -= 1
+
+    def _evict_locked(self, slot: int) -> None:
+        """Drop idle keys and the least recently active beyond max_keys (lock must be held)."""
+        while self._rings:
+            key, ring = next(iter(self._rings.items()))
+            if ring.last_slot >= slot - self.buckets and len(self._rings) <= self.max_keys:
+                break
+            self._rings.popitem(last=False)
+
+class _Bucket:
+    __slots__ = ('tokens', 'stamp')
+
+    def __init__(self, tokens: float, stamp: float):
+        self.tokens = tokens
+        self.stamp = stamp
+
+class TokenBucketLimiter:
+    """Token buckets per key on the monotonic clock, with O(1) acquire.
+
+    A key may make `capacity` requests at once and then one per 1/rate
+    seconds. At most max_keys buckets are kept; the least recently used is
+    dropped first, which only forgets a key that had been idle the longest.
+    """
+
+    def __init__(self, rate: float, capacity: float, max_keys: int = 10000,
+                 namespace: str = 'tokens', url: Optional[str] = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self.namespace = namespace
+        self._buckets = OrderedDict()  # key -> _Bucket, least recently used first
+        self._lock = threading.Lock()
+        self._redis = None
+        self._script = None
+        if url:
+            if redis is None:
+                logger.warning(f"TokenBucketLimiter - redis package not installed, '{namespace}' limits are per worker")
+            else:
+                self._redis = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+                self._script = self._redis.register_script(_TOKEN_BUCKET_SCRIPT)
+
+    @classmethod
+    def from_rate(cls, rate: str, **kwargs) -> 'TokenBucketLimiter':
+        """Limiter for a limit like '50/minute': bursts of 50, refilled at 50 per minute."""
+        count, period = parse_rate(rate)
+        return cls(count / period, count, **kwargs)
+
+    def acquire(self, key: str, rate: Optional[float] = None, capacity: Optional[float] = None) -> float:
+        """Take a token for key; returns 0.0 if one was available, else the seconds until one will be.
+
+        rate and capacity override the limiter's defaults for this key.
+        """
+        rate = self.rate if rate is None else rate
+        capacity = self.capacity if capacity is None else capacity
+
+        if self._script is not None:
+            try:
+                return float(self._script(keys=[f"{self.namespace}:{key}"], args=[rate, capacity]))
+            except Exception as e:
+                logger.debug(f"TokenBucketLimiter.acquire - Redis unavailable, using the local bucket: {e}")
+
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = _Bucket(capacity, now)
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket.tokens = min(capacity, bucket.tokens + (now - bucket.stamp) * rate)
+                bucket.stamp = now
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                return 0.0
+            return (1 - bucket.tokens) / rate
+
+    def __len__(self) -> int:
+        return len(self._buckets)
@@ -0,0 +1,69 @@
+"""
+Analysis results for Eclipse Shield.
+The /analyze responses and the context relevance they carry are slotted
+dataclasses rather than nested dicts: smaller, cheaper to build, and encoded
+directly by the JSON provider. CachedResponse keeps a result's encoded
+body, so a cache hit sends stored bytes.
+"""
+
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+@dataclass(slots=True)
+class RelevanceMatch:
+    term: str
+    location: str  # 'url' or 'search_query'
+    weight: float
+
+@dataclass(slots=True)
+class ContextRelevance:
+    """Context terms found in a URL and its search query, and the score they add up to."""
+    score: float = 0.0
+    matched_terms: List[str] = field(default_factory=list)
+    matches: List[RelevanceMatch] = field(default_factory=list)
+    error: Optional[str] = None
+
+@dataclass(slots=True)
+class AnalysisResult:
+    """/analyze response of the development server (app.py)."""
+    isProductive: bool
+    explanation: str
+    confidence: float
+    signals: dict
+    context_relevance: ContextRelevance
+    context_used: dict
+    context_id: str
+    referrer_data: Optional[dict] = None
+    direct_visit: bool = False
+    explanation_id: Optional[str] = None  # Set while the explanation is streaming or deferred
+
+@dataclass(slots=True)
+class Verdict:
+    """/analyze response of the production app (secure_app.py)."""
+    isProductive: bool
+    explanation: str
+    confidence: float
+    timestamp: float
+    context_id: str
+    explanation_id: Optional[str] = None  # Set while the explanation is streaming or deferred
+
+class CachedResponse:
+    """An encoded response body, plus its result while the explanation is still pending.
+
+    Once the final explanation is in the body the result is dropped, so the
+    entry is just the bytes.
+    """
+
+    __slots__ = ('body', 'pending')
+
+    def __init__(self, result, body: bytes):
+        self.body = body
+        self.pending = result if result.explanation_id is not None else None
+
+    def current_body(self, analyzer, encode: Callable) -> bytes:
+        """The body to send; re-encoded once when the pending explanation has completed."""
+        result = self.pending
+        if result is not None and analyzer.attach_explanation(result):
+            self.body = encode(result)
+            self.pending = None
+        return self.body
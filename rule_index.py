@@ -0,0 +1,127 @@
+"""
+Compiled domain rules for Eclipse Shield.
+RuleIndex turns each domain's allowed platform and blocked lists into
+lowercased tuples once per settings version, instead of type-checking and
+lowercasing every entry on every request. Built when the analyzer is
+created, which with preload_app is in the gunicorn master, so the workers
+share one copy (frozen out of the garbage collector's reach by
+gunicorn.conf.py). When settings.json changes, a new index is built and
+swapped in whole; affects() tells which cached verdicts the change can alter.
+"""
+
+import logging
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_PLATFORM_TYPES = ('lms_platforms', 'productivity_tools', 'ai_tools')
+
+def _patterns(domain: str, settings: dict, key: str) -> tuple:
+    """The string entries of a settings list, as given; malformed lists are reported once here."""
+    entries = settings.get(key, [])
+    if not isinstance(entries, list):
+        logger.warning(f"RuleIndex - '{key}' for domain '{domain}' is not a list.")
+        return ()
+    patterns = tuple(entry for entry in entries if isinstance(entry, str))
+    if len(patterns) != len(entries):
+        logger.warning(f"RuleIndex - Ignoring non-string entries in '{key}' for domain '{domain}'.")
+    return patterns
+
+class DomainRules:
+    """One domain's rules as parallel tuples: lowercased patterns for matching, originals for messages."""
+
+    __slots__ = ('domain', 'platforms', 'platform_names', 'platform_types',
+                 'blocked_specific', 'blocked_specific_names', 'blocked_keywords', 'blocked_keyword_names',
+                 'contextualization_required', 'signature')
+
+    def __init__(self, domain: str, settings: dict):
+        self.domain = domain
+        names, types = [], []
+        for platform_type in ALLOWED_PLATFORM_TYPES:
+            if platform_type in settings:
+                platforms = _patterns(domain, settings, platform_type)
+                names.extend(platforms)
+                types.extend([platform_type] * len(platforms))
+        self.platform_names = tuple(names)
+        self.platforms = tuple(name.lower() for name in names)
+        self.platform_types = tuple(types)
+        self.blocked_specific_names = _patterns(domain, settings, 'blocked_specific')
+        self.blocked_specific = tuple(name.lower() for name in self.blocked_specific_names)
+        self.blocked_keyword_names = _patterns(domain, settings, 'blocked_keywords')
+        self.blocked_keywords = tuple(name.lower() for name in self.blocked_keyword_names)
+        self.contextualization_required = bool(settings.get('contextualization_required', domain == 'personal'))
+        # Everything a verdict for this domain can depend on; equal signatures decide alike
+        self.signature = (self.platform_names, self.platform_types, self.blocked_specific_names,
+                          self.blocked_keyword_names, self.contextualization_required)
+
+    def allowed_platform(self, host: str, url_lower: str) -> Optional[tuple]:
+        """(platform type, platform) of the first platform found in the host or URL, or None."""
+        for i, platform in enumerate(self.platforms):
+            # A substring of the hostname (subdomains) or of the full URL (paths)
+            if platform in host or platform in url_lower:
+                return self.platform_types[i], self.platform_names[i]
+        return None
+
+    def blocked_rule(self, host: str, url_lower: str) -> Optional[dict]:
+        """BLOCK result for the first matching blocked site or keyword, or None."""
+        # One endswith over the whole tuple rejects the common case before the ordered scan
+        if self.blocked_specific and (host.endswith(self.blocked_specific) or url_lower in self.blocked_specific):
+            for i, blocked in enumerate(self.blocked_specific):
+                if host.endswith(blocked) or url_lower == blocked:
+                    return {'isProductive': False,
+                            'explanation': f"Blocked specific rule: '{self.blocked_specific_names[i]}'."}
+        for i, keyword in enumerate(self.blocked_keywords):
+            if keyword in url_lower:
+                return {'isProductive': False,
+                        'explanation': f"Blocked keyword found: '{self.blocked_keyword_names[i]}'."}
+        return None
+
+    def decide(self, host: str, url_lower: str) -> Optional[str]:
+        """What the rule stages answer for a URL: 'allowed', a block explanation, or None (later stages decide)."""
+        if self.allowed_platform(host, url_lower):
+            return 'allowed'
+        blocked = self.blocked_rule(host, url_lower)
+        return blocked['explanation'] if blocked else None
+
+    def later_stages_changed(self, other: 'DomainRules') -> bool:
+        """Whether the context and AI stages see different settings (the AI prompt lists the blocked entries)."""
+        return (self.contextualization_required != other.contextualization_required or
+                self.blocked_specific_names != other.blocked_specific_names or
+                self.blocked_keyword_names != other.blocked_keyword_names)
+
+class RuleIndex:
+    """The settings of one version and the DomainRules compiled from them."""
+
+    def __init__(self, settings: dict, version: str = None):
+        self.settings = settings
+        self.version = version
+        domains = settings.get('domains', {}) if isinstance(settings, dict) else {}
+        self.domains: Dict[str, DomainRules] = {
+            name: DomainRules(name, domain_settings) for name, domain_settings in domains.items()
+            if isinstance(domain_settings, dict)
+        }
+
+    def get(self, domain: str) -> Optional[DomainRules]:
+        return self.domains.get(domain)
+
+    def changed_domains(self, old: 'RuleIndex') -> set:
+        """Domains whose rules differ between old and this index (including added and removed ones)."""
+        return {domain for domain in self.domains.keys() | old.domains.keys()
+                if domain not in self.domains or domain not in old.domains or
+                self.domains[domain].signature != old.domains[domain].signature}
+
+    def affects(self, old: 'RuleIndex', domain: str, host: str, url_lower: str) -> bool:
+        """Whether a verdict for this URL and domain made under old may differ under this index.
+
+        A URL the rule stages decided is affected only if their answer changes;
+        one they left to the context or AI stage also if those stages' settings changed.
+        """
+        before, after = old.get(domain), self.get(domain)
+        if before is None or after is None:
+            return before is not after
+        if before.signature == after.signature:
+            return False
+        decided = before.decide(host, url_lower)
+        if decided != after.decide(host, url_lower):
+            return True
+        return decided is None and before.later_stages_changed(after)
@@ -1,14 +1,27 @@
 import os
 import json
-import requests
-import google.generativeai as genai
-from typing import Dict, List, Optional # Added Optional
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse
+from typing import Dict, Iterator, List, Optional # Added Optional
 import logging
 import re
 import html
-from datetime import datetime, timedelta
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from explanations import ExplanationStore
+from prompts import PromptCompiler
+from conversations import ConversationStore, has_enough_context, question_cache_key
+from shared_cache import SharedCache
+from context_profiles import ContextProfile, ContextProfileRegistry
+from urls import ParsedURL, parse_url
+from rate_limits import TokenBucketLimiter, parse_rate
+from results import ContextRelevance, RelevanceMatch
+from model_pool import ModelCallPool
+from model_client import LazyModel
+from settings_store import SettingsSnapshot, SettingsWatcher, load_settings
+from rule_index import RuleIndex
 
 # Import security validators
 try:
@@ -20,7 +33,7 @@ except ImportError:
         def validate_url(url):
             # Basic URL validation
             try:
-                result = urlparse(url)
+                result = parse_url(url).parts
                 return all([result.scheme, result.netloc]) and result.scheme in ['http', 'https']
             except:
                 return False
@@ -48,6 +61,222 @@ if not logger.handlers:
     handler.setFormatter(formatter)
     logger.addHandler(handler)
 
+# Speculative AI dispatch: start the model call while the remaining local stages run
+SPECULATIVE_AI_ENABLED = os.getenv("SPECULATIVE_AI", "true").lower() == "true"
+SPECULATIVE_AI_WORKERS = int(os.getenv("SPECULATIVE_AI_WORKERS", "4"))
+
+# Streamed AI decisions: commit to the verdict on the leading token, collect the explanation later
+STREAM_AI_DECISIONS = os.getenv("STREAM_AI_DECISIONS", "true").lower() == "true"
+EXPLANATION_STREAM_WORKERS = int(os.getenv("EXPLANATION_STREAM_WORKERS", "8"))
+
+def _leading_verdict(text: str) -> Optional[str]:
+    """Recognise a '<ALLOW|BLOCK>:' prefix in partially streamed model output.
+
+    Returns:
+        'ALLOW' or 'BLOCK' once the verdict and its colon have arrived, None if
+        more text is needed to decide, '' if the text cannot be in that format.
+    """
+    head = text.lstrip()
+    for verdict in ('ALLOW', 'BLOCK'):
+        prefix = head[:len(verdict)].upper()
+        if prefix != verdict[:len(prefix)]:
+            continue
+        if len(prefix) < len(verdict):
+            return None  # Still a prefix of the verdict token
+        rest = head[len(verdict):].lstrip()
+        if not rest:
+            return None  # Waiting for the colon
+        return verdict if rest[0] == ':' else ''
+    return ''
+
+# AI response protocol for the analysis stage (AI_RESPONSE_MODE):
+#   'structured' - JSON verdict/confidence/short reason constrained by a response schema
+#   'verdict'    - a single ALLOW/BLOCK word
+#   'text'       - legacy '<ALLOW|BLOCK>: <reason>' free text, streamed if STREAM_AI_DECISIONS
+# In 'structured' and 'verdict' modes, BLOCK verdicts get a full explanation generated on
+# demand (GET /explain) when the block page asks for it.
+AI_RESPONSE_MODE = os.getenv("AI_RESPONSE_MODE", "structured").lower()
+
+STRUCTURED_VERDICT_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'verdict': {'type': 'string', 'format': 'enum', 'enum': ['ALLOW', 'BLOCK']},
+        'confidence': {'type': 'number'},
+        'reason': {'type': 'string'}
+    },
+    'required': ['verdict', 'confidence', 'reason']
+}
+
+# Temperature 0 keeps decisions deterministic, so identical prompts can share a cached verdict
+DECISION_GENERATION_CONFIGS = {
+    'structured': {'temperature': 0.0, 'max_output_tokens': 48,
+                   'response_mime_type': 'application/json',
+                   'response_schema': STRUCTURED_VERDICT_SCHEMA},
+    'verdict': {'temperature': 0.0, 'max_output_tokens': 5},
+    'text': {'temperature': 0.0, 'max_output_tokens': 256}
+}
+EXPLANATION_GENERATION_CONFIG = {'temperature': 0.0, 'max_output_tokens': 120}
+
+RESPONSE_INSTRUCTIONS = {
+    'structured': 'Respond with a JSON object: "verdict" (ALLOW or BLOCK), "confidence" (0 to 1) and "reason" (at most 8 words).',
+    'verdict': "Respond with exactly one word, ALLOW or BLOCK, and nothing else.",
+    'text': """Respond with exactly 'ALLOW' or 'BLOCK' followed by a concise reason.
+Format: <ALLOW|BLOCK>: <Reasoning based on URL, context, and domain policy.>
+Example: BLOCK: Social media site is not related to the work task and is generally blocked in the 'work' domain."""
+}
+EXPLANATION_INSTRUCTIONS = """The decision for this URL was {verdict}. In one or two sentences, tell the user why, based on the URL, their task context and the domain policy.
+Respond with the reason only."""
+
+# Contextualization conversations: the model chat session stays on the server and
+# every round sends only the newest answer
+CONVERSATION_MAX_SESSIONS = int(os.getenv("CONVERSATION_MAX_SESSIONS", "500"))
+CONVERSATION_TTL = int(os.getenv("CONVERSATION_TTL", "1800"))
+CONVERSATION_WINDOW = int(os.getenv("CONVERSATION_WINDOW", "2"))  # Recent exchanges kept besides the opening ones
+CONVERSATION_PINNED_MESSAGES = 4  # Opening prompt, first question, first answer, second question
+MAX_CONTEXT_ITEMS = 10
+# Decide DONE locally when the answers clearly cover task and goal, skipping that model call
+LOCAL_DONE_DETECTION = os.getenv("LOCAL_DONE_DETECTION", "true").lower() == "true"
+DEFAULT_QUESTION = "What are you trying to accomplish?"
+
+# Questions for the first and common short follow-up rounds, keyed by domain and
+# normalized context; shared across workers through Redis when QUESTION_CACHE_URL is set
+QUESTION_CACHE_SIZE = int(os.getenv("QUESTION_CACHE_SIZE", "1000"))
+QUESTION_CACHE_TTL = int(os.getenv("QUESTION_CACHE_TTL", "86400"))
+QUESTION_CACHE_URL = os.getenv("QUESTION_CACHE_URL", os.getenv("REDIS_URL", ""))
+QUESTION_CACHE_PRESEED = os.getenv("QUESTION_CACHE_PRESEED", "true").lower() == "true"
+QUESTION_PRESEED_TIMEOUT = float(os.getenv("QUESTION_PRESEED_TIMEOUT", "10"))
+
+# Compiled context profiles registered by contextualization and reused by /analyze;
+# the raw context is shared across workers through Redis when CONTEXT_PROFILE_URL is set
+CONTEXT_PROFILE_SIZE = int(os.getenv("CONTEXT_PROFILE_SIZE", "1000"))
+CONTEXT_PROFILE_TTL = int(os.getenv("CONTEXT_PROFILE_TTL", "43200"))
+CONTEXT_PROFILE_URL = os.getenv("CONTEXT_PROFILE_URL", os.getenv("REDIS_URL", ""))
+
+# Token-bucket limit on analyze_website, per session (or per domain / for the whole
+# process); a domain may override the rate with "analysis_rate_limit" in settings.json.
+# With ANALYSIS_RATE_URL (or REDIS_URL) the buckets are shared by every worker.
+ANALYSIS_RATE_LIMIT = os.getenv("ANALYSIS_RATE_LIMIT", "50/minute")
+ANALYSIS_RATE_SCOPE = os.getenv("ANALYSIS_RATE_SCOPE", "session").lower()  # session, domain or global
+ANALYSIS_RATE_URL = os.getenv("ANALYSIS_RATE_URL", os.getenv("REDIS_URL", ""))
+
+# Long contexts are condensed once per session into a task summary plus keywords,
+# which AI prompts use instead of the full answers once available
+CONTEXT_SUMMARY_ENABLED = os.getenv("CONTEXT_SUMMARY", "true").lower() == "true"
+CONTEXT_SUMMARY_MIN_CHARS = int(os.getenv("CONTEXT_SUMMARY_MIN_CHARS", "400"))
+CONTEXT_SUMMARY_TIMEOUT = float(os.getenv("CONTEXT_SUMMARY_TIMEOUT", "10"))
+CONTEXT_SUMMARY_MAX_WORDS = 40
+CONTEXT_SUMMARY_MAX_KEYWORDS = 10
+CONTEXT_SUMMARY_GENERATION_CONFIG = {'temperature': 0.0, 'max_output_tokens': 120}
+CONTEXT_SUMMARY_PROMPT = """Condense what this user is working on for a productivity filter that decides which websites they may visit.
+Reply with exactly two lines:
+Summary: <the task and its goal in at most {max_words} words>
+Keywords: <up to {max_keywords} comma-separated topics, tools or sites the task needs>
+
+User's answers:
+{context}"""
+
+CONVERSATION_OPENING = """You are a productivity assistant finding out what the user is working on in the {domain} domain, one question at a time.
+You need clear answers to both:
+1. What specific task/activity the user is doing
+2. What they are trying to achieve (goal/outcome)
+Each of my later messages is the user's answer to your last question. Once you have clear answers to BOTH, respond with exactly 'DONE'. Otherwise ask ONE concise, direct question about what is missing. Do not ask about time, duration, or scheduling.
+Respond with either exactly 'DONE' or your single question (no other text).
+{history}"""
+
+# Batch mode: one model call returns a short ordered set of questions the popup shows together
+QUESTION_BATCH_SIZE = 3
+BATCH_CONVERSATION_OPENING = """You are a productivity assistant finding out what the user is working on in the {domain} domain.
+You need clear answers to both:
+1. What specific task/activity the user is doing
+2. What they are trying to achieve (goal/outcome)
+Ask 2 or 3 short, targeted questions that together cover whatever is still missing, most important first. Each of my later messages holds the user's answers. Once you have clear answers to BOTH, respond with exactly 'DONE'; otherwise ask at most 3 more questions about what is missing. Do not ask about time, duration, or scheduling.
+Respond with either exactly 'DONE' or one question per line (no numbering or other text).
+{history}"""
+_QUESTION_PREFIX_RE = re.compile(r'^\s*(?:[-*\u2022]|\d+[.)]|Q\d*\s*:)\s*', re.IGNORECASE)
+
+# Model API transport ('grpc' or 'rest'; unset for the SDK default). Cooperative (gevent)
+# workers need 'rest', whose sockets gevent can patch.
+GENAI_TRANSPORT = os.getenv("GENAI_TRANSPORT") or None
+
+# google.generativeai takes about a second to import, so it is imported when the first model
+# is created (or by the gunicorn master before forking) rather than with this module
+genai = None
+
+def import_model_sdk():
+    """google.generativeai, imported on first call."""
+    global genai
+    if genai is None:
+        import google.generativeai
+        genai = google.generativeai
+    return genai
+
+# Cache of model decisions keyed by prompt hash (only for deterministic, non-streamed modes)
+DECISION_CACHE_SIZE = int(os.getenv("DECISION_CACHE_SIZE", "2048"))
+DECISION_CACHE_TTL = int(os.getenv("DECISION_CACHE_TTL", "600"))
+
+_JSON_VERDICT_RE = re.compile(r'"verdict"\s*:\s*"\s*(ALLOW|BLOCK)\s*"', re.IGNORECASE)
+_JSON_CONFIDENCE_RE = re.compile(r'"confidence"\s*:\s*"?([0-9]*\.?[0-9]+)')
+_JSON_REASON_RE = re.compile(r'"reason"\s*:\s*"((?:[^"\\]|\\.)*)')
+_TEXT_VERDICT_RE = re.compile(r'[\s*_`"]*(ALLOW|BLOCK)[*_`"]*\s*(?::|-|\.|\n|$)', re.IGNORECASE)
+
+def _parse_verdict(decision: str) -> Optional[tuple]:
+    """Parse a model decision in any of the supported response formats.
+
+    Accepts a JSON object (possibly truncated or wrapped in a code fence), the
+    '<ALLOW|BLOCK>: <reason>' text format (tolerating markdown emphasis) and a
+    bare verdict word. Only the head of the text is scanned for text formats.
+
+    Returns:
+        tuple: (verdict, confidence or None, reason) or None if no verdict was found.
+    """
+    text = decision.strip()
+    if text.startswith('```'):
+        text = text.strip('`').strip()
+        if text[:4].lower() == 'json':
+            text = text[4:].lstrip()
+
+    if text.startswith('{'):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None  # Truncated or malformed JSON, fall back to scanning it
+        if isinstance(data, dict):
+            verdict = str(data.get('verdict', '')).strip().upper()
+            if verdict not in ('ALLOW', 'BLOCK'):
+                return None
+            try:
+                confidence = max(0.0, min(1.0, float(data.get('confidence'))))
+            except (TypeError, ValueError):
+                confidence = None
+            return verdict, confidence, str(data.get('reason') or '').strip()
+
+        match = _JSON_VERDICT_RE.search(text)
+        if not match:
+            return None
+        confidence_match = _JSON_CONFIDENCE_RE.search(text)
+        reason_match = _JSON_REASON_RE.search(text)
+        confidence = max(0.0, min(1.0, float(confidence_match.group(1)))) if confidence_match else None
+        return match.group(1).upper(), confidence, reason_match.group(1).strip() if reason_match else ''
+
+    match = _TEXT_VERDICT_RE.match(text, 0, 64)
+    if not match:
+        return None
+    return match.group(1).upper(), None, text[match.end():].strip()
+
+class SpeculativeAICall:
+    """Handle for a model call dispatched before the rule stages have finished.
+
+    The call is only used if analyze_website reaches the AI stage with the same
+    prompt; otherwise it is cancelled (or its result ignored if already running).
+    """
+
+    def __init__(self, url: str, domain: str, prompt: str, future):
+        self.url = url
+        self.domain = domain
+        self.prompt = prompt
+        self.future = future
+        self.settled = False
+
 def load_api_key() -> str:
     """Load API key from file or environment variable."""
     logger.debug("load_api_key - START")
@@ -72,16 +301,12 @@ def load_api_key() -> str:
     logger.debug("load_api_key - END")
     return api_key
 
-def load_domain_settings() -> Dict:
-    """Load domain settings from settings.json."""
-    logger.debug("load_domain_settings - START")
+def load_domain_snapshot() -> SettingsSnapshot:
+    """Load domain settings from settings.json, reusing its precompiled snapshot when unchanged."""
     try:
-        with open("settings.json", "r") as f:
-            settings = json.load(f)
-            logger.debug("load_domain_settings - Settings loaded from settings.json")
-            logger.debug(f"load_domain_settings - Settings content: {settings}") # Log settings content
-            logger.debug("load_domain_settings - END - SUCCESS")
-            return settings
+        snapshot = load_settings("settings.json")
+        logger.debug(f"load_domain_settings - Settings version {snapshot.version} loaded from {snapshot.source}")
+        return snapshot
     except FileNotFoundError:
         error_msg = "settings.json file not found."
         logger.error(f"load_domain_settings - {error_msg}")
@@ -94,109 +319,433 @@ def load_domain_settings() -> Dict:
         logger.error(f"load_domain_settings - Error loading settings: {e}")
         raise
 
+def load_domain_settings() -> Dict:
+    """Load domain settings from settings.json."""
+    return load_domain_snapshot().settings
+
+class _RequestContext(threading.local):
+    """The current thread's analysis context: the answers and their compiled profile."""
+
+    def __init__(self):
+        self.data = {}
+        self.profile = None  # Compiled form of data
+
 class ProductivityAnalyzer:
     def __init__(self):
         logger.debug("ProductivityAnalyzer.__init__ - START")
         self.api_key = load_api_key()
-        self.settings = load_domain_settings()
+        settings = load_domain_snapshot()
+        # The settings and the allowed/blocked lists compiled from them, swapped as one by
+        # reload_settings(); built here, in the gunicorn master when preloading, so workers share them
+        self.rules = RuleIndex(settings.settings, settings.version)
+        self._settings_lock = threading.Lock()
+        self._settings_listeners = []
+        self._settings_watcher = None
 
         # --- FIX: Configure API Key and Create Model Instance ---
         try:
-            genai.configure(api_key=self.api_key)
+            # The SDK is imported and configured when the model is first created
             # Ensure 'gemini-2.0-flash' is a valid model name accessible by your API key.
             # If you encounter errors related to the model name later,
             # try a known valid one like 'gemini-1.5-flash'.
-            self.model = genai.GenerativeModel('gemini-2.0-flash')
-            logger.debug("ProductivityAnalyzer.__init__ - Google Generative AI configured and model created.")
+            # The model is created on first use in each process (a forked worker never
+            # uses the master's client), and every call goes through one bounded pool
+            self.model = ModelCallPool(LazyModel(self._create_model))
+            logger.debug("ProductivityAnalyzer.__init__ - Google Generative AI configured.")
         except Exception as e:
             logger.error(f"ProductivityAnalyzer.__init__ - Failed to configure Google Generative AI or create model: {e}")
             raise # Re-raise the exception to halt initialization if AI setup fails
 
-        self.context_data = {}
+        # The context being analyzed is per thread (per greenlet under gevent), so
+        # concurrent requests in one worker do not see each other's context
+        self._request_context = _RequestContext()
+        self.context_profiles = ContextProfileRegistry(
+            CONTEXT_PROFILE_SIZE, CONTEXT_PROFILE_TTL,
+            SharedCache('context', CONTEXT_PROFILE_SIZE, CONTEXT_PROFILE_TTL, CONTEXT_PROFILE_URL) if CONTEXT_PROFILE_URL else None)
+        # Per-domain policy fragments are rendered once per settings version
+        self.prompt_compiler = PromptCompiler(self.settings, version=settings.version)
+        self.prompt_compiler.precompile()
+        # Contextualization chat sessions keyed by session token
+        self.conversations = ConversationStore(CONVERSATION_MAX_SESSIONS, CONVERSATION_TTL)
+        self.question_cache = SharedCache('questions', QUESTION_CACHE_SIZE, QUESTION_CACHE_TTL, QUESTION_CACHE_URL)
+        # Condensed long contexts by profile fingerprint, as JSON [summary, keywords]
+        self.context_summaries = SharedCache('context-summary', CONTEXT_PROFILE_SIZE, CONTEXT_PROFILE_TTL, CONTEXT_PROFILE_URL)
+        self.analysis_limiter = TokenBucketLimiter.from_rate(ANALYSIS_RATE_LIMIT, namespace='analysis',
+                                                             url=ANALYSIS_RATE_URL)
         # Removed self.client = genai.Client(...)
         # --- End FIX ---
 
+        # Pool for speculative model calls and counters for measuring their hit rate
+        self._ai_executor = ThreadPoolExecutor(max_workers=SPECULATIVE_AI_WORKERS,
+                                               thread_name_prefix="speculative-ai")
+        self._stats_lock = threading.Lock()
+        self.speculation_stats = {'dispatched': 0, 'used': 0, 'wasted': 0, 'cancelled': 0}
+
+        # Decisions cached by prompt hash, plus AI stage counters (calls, cache hits, parse failures, tokens)
+        self._decision_cache = OrderedDict()
+        self.ai_stats = {'calls': 0, 'cache_hits': 0, 'parse_failures': 0, 'output_tokens': 0}
+
+        # Explanations that keep streaming after the verdict has been returned
+        self.explanations = ExplanationStore()
+        self._stream_executor = ThreadPoolExecutor(max_workers=EXPLANATION_STREAM_WORKERS,
+                                                   thread_name_prefix="explanation-stream")
+
         logger.debug("ProductivityAnalyzer.__init__ - Analyzer initialized, API key loaded, settings loaded, model configured.")
         logger.debug("ProductivityAnalyzer.__init__ - END")
 
-    def get_next_question(self, domain: str, context: List[Dict]) -> Dict: # context is a list of dicts
-        """Get the next contextual question based on previous answers using AI."""
-        logger.debug(f"ProductivityAnalyzer.get_next_question - START - Domain: {domain}, Context: {context}")
+    def _create_model(self):
+        """This process's model; configuring again gives a forked worker its own SDK clients."""
+        genai = import_model_sdk()
+        genai.configure(api_key=self.api_key, transport=GENAI_TRANSPORT)
+        return genai.GenerativeModel('gemini-2.0-flash')
+
+    def prepare_model(self) -> None:
+        """Create this process's model client (and warm it up) before the first request.
+
+        gunicorn calls this in every worker once the app is loaded.
+        """
+        prepare = getattr(self.model, 'prepare', None)
+        if prepare is not None:
+            prepare()
+
+    @property
+    def settings(self) -> Dict:
+        """The current settings.json content."""
+        return self.rules.settings
+
+    @property
+    def settings_version(self) -> str:
+        return self.rules.version
+
+    def add_settings_listener(self, callback) -> None:
+        """Call callback(old_rules, new_rules) after each settings swap (to drop affected cache entries)."""
+        self._settings_listeners.append(callback)
+
+    def reload_settings(self) -> bool:
+        """Load settings.json again and swap the new version in if its content changed.
+
+        The rules and prompt fragments of the new version are compiled before the
+        swap, so requests use the previous version until the new one is complete.
+        Decisions cached by prompt hash need no invalidation: a changed policy
+        fragment changes the prompt. Returns True if a new version was swapped in.
+        """
+        with self._settings_lock:
+            old = self.rules
+            snapshot = load_domain_snapshot()
+            if snapshot.version == old.version:
+                return False
+            rules = RuleIndex(snapshot.settings, snapshot.version)
+            self.prompt_compiler.load(snapshot.settings, snapshot.version, precompile=True)
+            self.rules = rules
+        changed = rules.changed_domains(old)
+        logger.info(f"ProductivityAnalyzer.reload_settings - Settings {old.version} -> {rules.version} "
+                    f"(changed domains: {', '.join(sorted(changed)) or 'none'})")
+        for listener in self._settings_listeners:
+            try:
+                listener(old, rules)
+            except Exception as e:
+                logger.error(f"ProductivityAnalyzer.reload_settings - Settings listener failed: {e}", exc_info=True)
+        return True
+
+    def watch_settings(self, interval: float = None) -> bool:
+        """Reload settings.json whenever it changes, checking every SETTINGS_RELOAD_INTERVAL seconds.
+
+        Started in each worker (threads do not survive the fork), so every worker
+        on the host picks an edited file up within one interval.
+        """
+        watcher = self._settings_watcher
+        if watcher is not None and watcher[0] == os.getpid():
+            return False
+        watcher = SettingsWatcher("settings.json", self.reload_settings, interval)
+        self._settings_watcher = (os.getpid(), watcher)
+        return watcher.start()
+
+    def settings_change_affects(self, old, new, url, domain: str) -> bool:
+        """Whether the verdict cached for url (string or ParsedURL) and domain may differ under the new rules."""
+        url = parse_url(url)
+        base_domain = self._get_domain_from_url(url)
+        if not base_domain:
+            return False  # 'Invalid URL format' does not depend on settings
+        return new.affects(old, domain, base_domain, url.lower)
+
+    def get_next_question(self, domain: str, context: List[Dict], session: Optional[str] = None,
+                          answer: Optional[str] = None) -> Dict: # context is a list of dicts
+        """Get the next contextual question based on previous answers using AI.
+
+        Without a session token a new conversation is opened (seeded with any
+        context already gathered) and its token is returned as 'session'.
+        With a token, only the new answer is sent to the model.
+
+        Returns:
+            dict: {'question': str, 'session': str}, or {'session_expired': True}
+            when the token is unknown and the caller must resend its context.
+        """
+        return self._converse(domain, context, session, [answer] if answer else [], batch=False)
+
+    def get_question_batch(self, domain: str, context: List[Dict], session: Optional[str] = None,
+                           answers: Optional[List[str]] = None) -> Dict:
+        """Get a short ordered set of questions for the user to answer together.
+
+        Each round (the opening one, then every submitted set of answers) is a
+        single model call; the model is asked again only while the answers
+        are still insufficient.
+
+        Returns:
+            dict: {'questions': [str], 'session': str}, {'question': 'DONE', 'questions': [], 'session': str},
+            or {'session_expired': True} when the token is unknown.
+        """
+        return self._converse(domain, context, session, answers if isinstance(answers, list) else [], batch=True)
+
+    def stream_questions(self, domain: str, context: List[Dict], session: Optional[str] = None,
+                         answers: Optional[List[str]] = None, batch: bool = False) -> Iterator[tuple]:
+        """Streaming variant of get_next_question / get_question_batch.
+
+        Yields ('token', text) as the model's reply arrives and finally
+        ('reply', dict) with the same dict the non-streaming call returns.
+        Closing the generator early (client disconnect) stops reading from
+        the model and drops the unfinished conversation.
+        """
+        return self._conversation_events(domain, context, session,
+                                         answers if isinstance(answers, list) else [], batch, stream=True)
+
+    def _converse(self, domain: str, context: List[Dict], session: Optional[str], answers: List[str], batch: bool) -> Dict:
+        """Open or continue a contextualization conversation and return the reply."""
+        reply = None
+        for event, payload in self._conversation_events(domain, context, session, answers, batch, stream=False):
+            reply = payload  # The last event is always the reply
+        return reply
+
+    def _conversation_events(self, domain: str, context: List[Dict], session: Optional[str], answers: List[str],
+                             batch: bool, stream: bool) -> Iterator[tuple]:
+        """Open or continue a conversation, yielding ('token', text) events (if streaming) and the ('reply', dict)."""
+        logger.debug(f"ProductivityAnalyzer._conversation_events - START - Domain: {domain}, Context: {context}, Session: {bool(session)}, Batch: {batch}")
         
         # Security validation
         domain = InputValidator.sanitize_string(domain, 100)
         if not InputValidator.validate_domain(domain):
             logger.warning(f"Invalid domain provided: {domain}")
-            return {"question": "What are you trying to accomplish?"}
+            yield 'reply', self._question_reply([DEFAULT_QUESTION], None, batch)
+            return
+
+        if session:
+            yield from self._continue_events(domain, session, answers, stream)
+            return
         
-        # Validate and sanitize context
+        # Validate and sanitize context ({question: answer} dicts are accepted too)
+        if isinstance(context, dict):
+            context = [{'question': q, 'answer': a} for q, a in context.items()]
         if isinstance(context, list):
             sanitized_context = []
-            for item in context[:10]:  # Limit to 10 items
+            for item in context[:MAX_CONTEXT_ITEMS]:  # Limit to 10 items
                 if isinstance(item, dict):
                     question = InputValidator.sanitize_string(item.get('question', ''), 500)
                     answer = InputValidator.sanitize_string(item.get('answer', ''), 1000)
                     if question and answer:
                         sanitized_context.append({'question': question, 'answer': answer})
             context = sanitized_context
-        
+        else:
+            context = []
+
+        if context and LOCAL_DONE_DETECTION and has_enough_context(context):
+            logger.debug("ProductivityAnalyzer._conversation_events - Context already covers task and goal, returning DONE")
+            yield 'reply', self._question_reply(['DONE'], None, batch)
+            return
+
+        opening = self._opening_prompt(domain, context, batch)
+        logger.debug("ProductivityAnalyzer._conversation_events - Opening prompt:\n" + opening) # Log prompt
+
         try:
-            if not context:
-                prompt = f"""As a productivity assistant, ask one direct question to understand what the user is working on in the {domain} domain.
-                Keep it simple and focused on their immediate task.
-                Example good questions:
-                - What specific task are you working on?
-                - What are you trying to accomplish?
-                Respond with only the question text, no additional formatting."""
-                logger.debug("ProductivityAnalyzer.get_next_question - First question - Prompt:\n" + prompt) # Log prompt
+            conversation = self.conversations.open(domain, self.model.start_chat(history=[]))
+            conversation.batch = batch
+            conversation.turns = list(context)
+        except Exception as e:
+            logger.error(f"ProductivityAnalyzer._conversation_events - Error starting conversation: {e}", exc_info=True)
+            yield 'reply', self._question_reply([DEFAULT_QUESTION], None, batch)
+            return
+
+        with conversation.lock:
+            yield from self._ask_events(conversation, opening, self._question_key(domain, context, batch), stream)
+
+    def _continue_events(self, domain: str, session: str, answers: List[str], stream: bool) -> Iterator[tuple]:
+        """Send the user's newest answers on an existing conversation."""
+        conversation = self.conversations.get(session, domain)
+        if conversation is None:
+            logger.info("ProductivityAnalyzer._continue_events - Unknown or expired session, asking for context")
+            yield 'reply', {"session_expired": True}
+            return
+
+        answers = [InputValidator.sanitize_string(answer, 1000) if isinstance(answer, str) else ''
+                   for answer in answers[:QUESTION_BATCH_SIZE]]
+        with conversation.lock:
+            pending = conversation.pending_questions or [DEFAULT_QUESTION]
+            new_turns = [{'question': question, 'answer': answer} for question, answer in zip(pending, answers) if answer]
+            if not new_turns:
+                yield 'reply', self._question_reply(pending, conversation.token, conversation.batch)
+                return
+
+            conversation.turns.extend(new_turns)
+            if len(conversation.turns) >= MAX_CONTEXT_ITEMS or \
+                    (LOCAL_DONE_DETECTION and has_enough_context(conversation.turns)):
+                logger.debug("ProductivityAnalyzer._continue_events - Context complete, returning DONE without the model")
+                self.conversations.close(conversation.token)
+                yield 'reply', self._question_reply(['DONE'], conversation.token, conversation.batch)
+                return
+
+            if conversation.batch:
+                message = "\n".join(f"Q: {turn['question']}\nA: {turn['answer']}" for turn in new_turns)
             else:
-                # Format conversation history for the prompt
-                history_str = "\n".join([f"Q: {item['question']}\nA: {item['answer']}" for item in context])
-                prompt = f"""Based on this context about a {domain} task, determine if you have enough information or need to ask one more question.
-                Previous Q&A:
-                {history_str}
-
-                First, analyze if you have enough information to understand:
-                1. What specific task/activity the user is doing
-                2. What they are trying to achieve (goal/outcome)
-
-                If you have clear answers to BOTH of these, respond with exactly 'DONE'.
-                If you're missing either of these key pieces of information, ask ONE focused follow-up question about what you're missing.
-                Do not ask about time, duration, or scheduling.
-                Keep the question concise and direct.
-                Respond with either exactly 'DONE' or your single follow-up question (no other text)."""
-                logger.debug("ProductivityAnalyzer.get_next_question - Subsequent question - Prompt:\n" + prompt) # Log prompt
-
-            # --- FIX: Use self.model to generate content ---
-            response = self.model.generate_content(
-                contents=prompt
-                # Removed model="gemini-2.0-flash" as it's inherent in self.model
-            )
-            # --- End FIX ---
+                message = f"A: {new_turns[0]['answer']}"
+            yield from self._ask_events(conversation, message,
+                                        self._question_key(domain, conversation.turns, conversation.batch), stream)
 
-            # Add safety check for response structure if needed, assuming .text exists
-            if not hasattr(response, 'text'):
-                 logger.error(f"ProductivityAnalyzer.get_next_question - AI response object does not have 'text' attribute. Response: {response}")
-                 raise ValueError("Invalid response format from AI.")
+    def _ask_events(self, conversation, message: str, cache_key: Optional[str], stream: bool) -> Iterator[tuple]:
+        """Send one message on a conversation; yields the reply text as it streams, then the next question(s) or DONE.
 
-            question = response.text.strip()
-            logger.debug(f"ProductivityAnalyzer.get_next_question - AI Response Text: {question}") # Log response text
+        A cached reply for cache_key is recorded in the chat history as if
+        the model had sent it, so the conversation continues normally.
+        The conversation lock must be held.
+        """
+        try:
+            cached = self.question_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                logger.debug(f"ProductivityAnalyzer._ask_events - Question cache hit: {cached}")
+                questions = cached.split('\n')
+                conversation.chat.history = list(conversation.chat.history) + [
+                    {'role': 'user', 'parts': [message]}, {'role': 'model', 'parts': [cached]}
+                ]
+                if stream and questions != ['DONE']:
+                    yield 'token', cached
+            else:
+                if stream:
+                    text = yield from self._stream_reply(conversation, message)
+                else:
+                    response = conversation.chat.send_message(message)
+
+                    # Add safety check for response structure if needed, assuming .text exists
+                    if not hasattr(response, 'text'):
+                         logger.error(f"ProductivityAnalyzer._ask_events - AI response object does not have 'text' attribute. Response: {response}")
+                         raise ValueError("Invalid response format from AI.")
+                    text = response.text
+
+                logger.debug(f"ProductivityAnalyzer._ask_events - AI Response Text: {text}") # Log response text
+                questions = self._parse_questions(text, conversation.batch)
+                if cache_key:
+                    self.question_cache.set(cache_key, '\n'.join(questions))
+            conversation.trim_history(CONVERSATION_PINNED_MESSAGES, CONVERSATION_WINDOW)
+
+            if questions == ['DONE']:
+                logger.debug("ProductivityAnalyzer._ask_events - AI returned 'DONE'")
+                self.conversations.close(conversation.token)
+            else:
+                conversation.pending_questions = questions
+                logger.debug(f"ProductivityAnalyzer._ask_events - Next question(s): {questions}")
+            yield 'reply', self._question_reply(questions, conversation.token, conversation.batch)
 
-            if question.upper() == 'DONE':
-                logger.debug("ProductivityAnalyzer.get_next_question - AI returned 'DONE'")
-                logger.debug("ProductivityAnalyzer.get_next_question - END - DONE")
-                return {"question": "DONE"}
+        except Exception as e:
+            logger.error(f"ProductivityAnalyzer._ask_events - Error generating question: {e}", exc_info=True) # Add traceback info
+            conversation.pending_questions = [DEFAULT_QUESTION]
+            logger.debug(f"ProductivityAnalyzer._ask_events - Returning default question: {DEFAULT_QUESTION}")
+            yield 'reply', self._question_reply([DEFAULT_QUESTION], conversation.token, conversation.batch)
 
-            logger.debug(f"ProductivityAnalyzer.get_next_question - Next question: {question}")
-            logger.debug("ProductivityAnalyzer.get_next_question - END - Question generated")
-            return {"question": question}
+    def _stream_reply(self, conversation, message: str) -> Iterator[tuple]:
+        """Stream the model's reply as ('token', text) events and return the full text.
 
-        except Exception as e:
-            logger.error(f"ProductivityAnalyzer.get_next_question - Error generating question: {e}", exc_info=True) # Add traceback info
-            default_question = "What are you trying to accomplish?"
-            logger.debug(f"ProductivityAnalyzer.get_next_question - Returning default question: {default_question}")
-            logger.debug("ProductivityAnalyzer.get_next_question - END - ERROR, returning default")
-            return {"question": default_question}
+        Text that could still turn out to be DONE is held back, so a finished
+        conversation never flashes "DONE" in the popup.
+        """
+        chunks = iter(conversation.chat.send_message(message, stream=True))
+        received = ''
+        sent = 0
+        try:
+            for chunk in chunks:
+                received += chunk.text
+                if sent == 0 and 'DONE'.startswith(received.strip().upper()):
+                    continue
+                yield 'token', received[sent:]
+                sent = len(received)
+        except GeneratorExit:
+            # Client went away mid-stream: stop reading from the model and forget the half-built conversation
+            logger.info("ProductivityAnalyzer._stream_reply - Stream abandoned, closing conversation")
+            close = getattr(chunks, 'close', None)
+            if close:
+                close()
+            self.conversations.close(conversation.token)
+            raise
+        except Exception:
+            conversation.chat.rewind()  # Keep the broken exchange out of the chat history
+            raise
+        return received
+
+    @staticmethod
+    def _opening_prompt(domain: str, context: List[Dict], batch: bool) -> str:
+        """First message of a conversation, including any context gathered before it started."""
+        template = BATCH_CONVERSATION_OPENING if batch else CONVERSATION_OPENING
+        if context:
+            history_str = "\n".join([f"Q: {item['question']}\nA: {item['answer']}" for item in context])
+            return template.format(domain=domain, history=f"Previous Q&A:\n{history_str}")
+        return template.format(domain=domain, history="Ask your first question" + ("s." if batch else "."))
+
+    @staticmethod
+    def _question_key(domain: str, turns: List[Dict], batch: bool) -> Optional[str]:
+        """Question cache key; batch and single-question replies are cached separately."""
+        cache_key = question_cache_key(domain, turns)
+        if cache_key and batch:
+            return f"batch:{cache_key}"
+        return cache_key
+
+    @staticmethod
+    def _parse_questions(text: str, batch: bool) -> List[str]:
+        """Split a model reply into questions, or ['DONE']."""
+        text = text.strip()
+        if text.strip('.!"\'` ').upper() == 'DONE':
+            return ['DONE']
+        if not batch:
+            return [text or DEFAULT_QUESTION]
+        questions = []
+        for line in text.splitlines():
+            line = _QUESTION_PREFIX_RE.sub('', line).strip()
+            if line and line.upper() != 'DONE':
+                questions.append(line)
+        return questions[:QUESTION_BATCH_SIZE] or [DEFAULT_QUESTION]
+
+    @staticmethod
+    def _question_reply(questions: List[str], session: Optional[str], batch: bool) -> Dict:
+        """Shape questions (or ['DONE']) as a /get_question response."""
+        if questions == ['DONE']:
+            reply = {"question": "DONE", "questions": []} if batch else {"question": "DONE"}
+        elif batch:
+            reply = {"questions": questions}
+        else:
+            reply = {"question": questions[0]}
+        if session:
+            reply["session"] = session
+        return reply
+
+    def preseed_questions(self) -> int:
+        """Generate the first question (and first question batch) of every configured domain ahead of time.
+
+        Call before workers fork (preload_app) so every worker inherits the
+        entries. Returns the number of entries generated.
+        """
+        seeded = 0
+        for domain in self.settings.get("domains", {}):
+            for batch in (False, True):
+                cache_key = self._question_key(domain, [], batch)
+                if cache_key in self.question_cache:
+                    continue
+                try:
+                    response = self.model.generate_content(
+                        contents=self._opening_prompt(domain, [], batch),
+                        request_options={'timeout': QUESTION_PRESEED_TIMEOUT}
+                    )
+                    questions = self._parse_questions(response.text, batch)
+                    if questions != ['DONE']:
+                        self.question_cache.set(cache_key, '\n'.join(questions))
+                        seeded += 1
+                except Exception as e:
+                    logger.warning(f"ProductivityAnalyzer.preseed_questions - Could not seed '{domain}': {e}")
+        logger.info(f"ProductivityAnalyzer.preseed_questions - Seeded {seeded} first questions")
+        return seeded
 
     def contextualize(self, domain: str) -> None:
         """Ask focused questions one at a time to contextualize the task."""
@@ -205,8 +754,8 @@ class ProductivityAnalyzer:
         self.context_data = {} # Reset context data for each call
         logger.debug("ProductivityAnalyzer.contextualize - Conversation history and context data initialized.")
 
+        question_data = self.get_next_question(domain, conversation_history)
         while True:
-            question_data = self.get_next_question(domain, conversation_history)
             question = question_data["question"]
             logger.debug(f"ProductivityAnalyzer.contextualize - Received question from get_next_question: {question}")
 
@@ -229,17 +778,145 @@ class ProductivityAnalyzer:
             # self.context_data[question] = answer # Optional: can remove if rebuilt from history
             logger.debug(f"ProductivityAnalyzer.contextualize - User answer recorded. Added to history.")
 
+            # Only the new answer goes to the model; fall back to the full history if the session expired
+            question_data = self.get_next_question(domain, conversation_history,
+                                                   session=question_data.get('session'), answer=answer)
+            if question_data.get('session_expired'):
+                question_data = self.get_next_question(domain, conversation_history)
+
         logger.debug("ProductivityAnalyzer.contextualize - END - Contextualization loop finished")
 
-    def _get_domain_from_url(self, url: str) -> Optional[str]: # Return type hint Optional
-        """Extract the base domain (network location) from a URL."""
+    def register_context(self, domain: str, context) -> ContextProfile:
+        """Sanitize a session's context once and register its compiled profile.
+
+        Args:
+            domain: The session's domain
+            context: List of {'question', 'answer'} dicts or a question -> answer dict
+
+        Returns:
+            ContextProfile: the profile; its fingerprint is the context id clients send to /analyze.
+        """
+        if isinstance(context, dict):
+            pairs = list(context.items())
+        elif isinstance(context, list):
+            pairs = [(qa.get('question', ''), qa.get('answer', '')) for qa in context if isinstance(qa, dict)]
+        else:
+            pairs = []
+
+        context_dict = {}
+        for question, answer in pairs[:MAX_CONTEXT_ITEMS]:
+            question = InputValidator.sanitize_string(question, 500) if isinstance(question, str) else ''
+            answer = InputValidator.sanitize_string(answer, 1000) if isinstance(answer, str) else ''
+            if question and answer:
+                context_dict[question] = answer
+        profile = self.context_profiles.register(domain, context_dict)
+        self._ensure_context_summary(profile)
+        return profile
+
+    def resolve_context(self, domain: str, context_id: Optional[str] = None, context=None) -> Optional[ContextProfile]:
+        """Find the profile for an /analyze request.
+
+        A known context_id is reused as is; otherwise the full context (if sent)
+        is registered. Returns None only when an unknown id came without the
+        context, in which case the client should resend it.
+        """
+        if context_id:
+            profile = self.context_profiles.get(context_id, domain)
+            if profile is not None:
+                self._ensure_context_summary(profile)
+                return profile
+            if not context:
+                logger.debug(f"ProductivityAnalyzer.resolve_context - Unknown context id {context_id}")
+                return None
+        return self.register_context(domain, context or [])
+
+    def _ensure_context_summary(self, profile: ContextProfile) -> None:
+        """Attach the cached summary of a long context, or start condensing it (once per profile)."""
+        if not CONTEXT_SUMMARY_ENABLED or profile.summary is not None or profile.summary_requested or \
+           len(profile.prompt_fragment) < CONTEXT_SUMMARY_MIN_CHARS:
+            return
+        profile.summary_requested = True
+        cached = self.context_summaries.get(profile.fingerprint)
+        if cached is not None:
+            profile.set_summary(*json.loads(cached))
+            return
+        self._ai_executor.submit(self._summarize_context, profile)
+
+    def _summarize_context(self, profile: ContextProfile) -> None:
+        """Condense a profile's context with the model; on failure prompts keep using the full context."""
+        try:
+            response = self.model.generate_content(
+                contents=CONTEXT_SUMMARY_PROMPT.format(max_words=CONTEXT_SUMMARY_MAX_WORDS,
+                                                       max_keywords=CONTEXT_SUMMARY_MAX_KEYWORDS,
+                                                       context=profile.prompt_fragment),
+                generation_config=CONTEXT_SUMMARY_GENERATION_CONFIG,
+                request_options={'timeout': CONTEXT_SUMMARY_TIMEOUT}
+            )
+            self._record_ai_usage(response)
+            parsed = self._parse_context_summary(response.text)
+        except Exception as e:
+            logger.warning(f"ProductivityAnalyzer._summarize_context - Keeping full context for {profile.fingerprint}: {e}")
+            return
+        if parsed is None:
+            logger.warning(f"ProductivityAnalyzer._summarize_context - Unusable summary for {profile.fingerprint}, keeping full context")
+            return
+        profile.set_summary(*parsed)
+        self.context_summaries.set(profile.fingerprint, json.dumps(list(parsed)))
+        logger.debug(f"ProductivityAnalyzer._summarize_context - Condensed context {profile.fingerprint}: {parsed[0]}")
+
+    @staticmethod
+    def _parse_context_summary(text: str) -> Optional[tuple]:
+        """Parse 'Summary: ...' / 'Keywords: ...' lines into (summary, keywords), or None without a summary."""
+        summary, keywords = '', []
+        for line in text.splitlines():
+            label, _, value = line.partition(':')
+            label = label.strip(' *-').lower()
+            if label == 'summary':
+                summary = ' '.join(value.split()[:CONTEXT_SUMMARY_MAX_WORDS])
+            elif label == 'keywords':
+                keywords = [k.strip(' .*')[:40] for k in value.split(',') if k.strip(' .*')][:CONTEXT_SUMMARY_MAX_KEYWORDS]
+        if not summary:
+            return None
+        return InputValidator.sanitize_string(summary, 300), [InputValidator.sanitize_string(k, 40) for k in keywords]
+
+    @property
+    def context_data(self) -> Dict:
+        return self._request_context.data
+
+    @context_data.setter
+    def context_data(self, context_data: Dict) -> None:
+        self._request_context.data = context_data
+
+    @property
+    def context_profile(self) -> Optional[ContextProfile]:
+        return self._request_context.profile
+
+    @context_profile.setter
+    def context_profile(self, profile: Optional[ContextProfile]) -> None:
+        self._request_context.profile = profile
+
+    def use_context(self, profile: Optional[ContextProfile]) -> None:
+        """Make a registered profile the context for the next analysis."""
+        self.context_profile = profile
+        self.context_data = profile.context_data if profile is not None else {}
+
+    def _active_context_profile(self) -> ContextProfile:
+        """Profile of the current context_data, compiled once if context_data was set directly."""
+        profile = self.context_profile
+        if profile is None or profile.context_data is not self.context_data:
+            profile = ContextProfile('', self.context_data)
+            self.context_profile = profile
+        return profile
+
+    def _get_domain_from_url(self, url) -> Optional[str]: # Return type hint Optional
+        """Extract the base domain (network location) from a URL string or ParsedURL."""
         logger.debug(f"ProductivityAnalyzer._get_domain_from_url - START - URL: {url}")
-        if not isinstance(url, str) or not url.startswith(('http://', 'https://')):
+        url = parse_url(url)
+        if not isinstance(url.url, str) or not url.url.startswith(('http://', 'https://')):
              logger.warning(f"ProductivityAnalyzer._get_domain_from_url - Invalid or non-HTTP(S) URL provided: '{url}'")
              return None
         try:
-            parsed = urlparse(url)
-            domain = parsed.netloc.lower()
+            domain = url.host
             if not domain:
                 logger.warning(f"ProductivityAnalyzer._get_domain_from_url - Could not parse network location from URL: '{url}'")
                 return None
@@ -251,59 +928,36 @@ class ProductivityAnalyzer:
             logger.debug("ProductivityAnalyzer._get_domain_from_url - END - ERROR, returning None")
             return None
 
-    def _is_allowed_platform(self, url: str, domain: str) -> bool:
-        """Check if URL belongs to allowed platforms for specific domain."""
+    def _is_allowed_platform(self, url, domain: str) -> bool:
+        """Check if URL (string or ParsedURL) belongs to allowed platforms for specific domain."""
+        url = parse_url(url)
         base_domain = self._get_domain_from_url(url)
         logger.debug(f"_is_allowed_platform - Checking domain: {base_domain} for URL: {url} in {domain} context")
 
         if not base_domain:
             return False
 
-        try:
-            # Ensure the domain exists in settings
-            if domain not in self.settings.get("domains", {}):
-                 logger.warning(f"_is_allowed_platform - Domain '{domain}' not found in settings.")
-                 return False
-            settings = self.settings["domains"][domain]
-
-            url_lower = url.lower()
-            hostname_lower = base_domain # Already lowercased by _get_domain_from_url
-
-            # Only check platform types that exist in this domain's settings
-            allowed_platform_types = ['lms_platforms', 'productivity_tools', 'ai_tools']
-
-            for platform_type in allowed_platform_types:
-                if platform_type not in settings:
-                    continue # Skip if this platform type isn't defined for the domain
-
-                # Ensure the setting is actually a list
-                if not isinstance(settings.get(platform_type), list):
-                    logger.warning(f"_is_allowed_platform - Setting '{platform_type}' for domain '{domain}' is not a list.")
-                    continue
+        rules = self.rules.get(domain)
+        if rules is None:
+            logger.warning(f"_is_allowed_platform - Domain '{domain}' not found in settings.")
+            return False
 
-                for platform in settings[platform_type]:
-                    if not isinstance(platform, str): # Ensure platform entry is a string
-                        logger.warning(f"_is_allowed_platform - Non-string entry found in '{platform_type}' for domain '{domain}': {platform}")
-                        continue
-                    platform_lower = platform.lower()
-                    # Check if the platform is a substring of the hostname OR the full URL
-                    # This allows matching subdomains (e.g., classroom.google.com) or specific paths if needed
-                    if platform_lower in hostname_lower or platform_lower in url_lower:
-                        logger.info(f"_is_allowed_platform - Platform match in {domain} domain - Type: {platform_type}, Platform: {platform} for URL {url}")
-                        return True
+        try:
+            # base_domain is already lowercased by _get_domain_from_url
+            match = rules.allowed_platform(base_domain, url.lower)
+            if match:
+                logger.info(f"_is_allowed_platform - Platform match in {domain} domain - Type: {match[0]}, Platform: {match[1]} for URL {url}")
+                return True
 
             logger.debug(f"_is_allowed_platform - No allowed platform match for {url} in {domain} domain")
             return False
-        except KeyError:
-             logger.error(f"_is_allowed_platform - Malformed settings for domain '{domain}'.")
-             return False
         except Exception as e:
             logger.error(f"_is_allowed_platform - Error during check: {e}", exc_info=True)
             return False
 
     # This function seems redundant if _is_allowed_platform checks 'ai_tools'
     # Kept for potential specific logic, but consider merging/removing.
-    def _is_ai_site(self, url: str) -> bool:
+    def _is_ai_site(self, url) -> bool:
         """Check if the URL belongs to a known AI tool site (can be domain specific via settings)."""
         logger.debug(f"ProductivityAnalyzer._is_ai_site - START - URL: {url}")
         base_domain = self._get_domain_from_url(url)
@@ -341,9 +995,10 @@ class ProductivityAnalyzer:
 
     # This function also seems less useful now that analyze_website handles logic directly.
     # Kept for potential direct use, but analyze_website is the main entry point.
-    def _is_productive_domain(self, url: str, domain: str) -> Optional[bool]:
+    def _is_productive_domain(self, url, domain: str) -> Optional[bool]:
         """Check if the domain is explicitly allowed or blocked based on settings."""
         logger.debug(f"ProductivityAnalyzer._is_productive_domain - START - URL: {url}, Domain: {domain}")
+        url = parse_url(url)
         base_domain = self._get_domain_from_url(url)
         logger.debug(f"ProductivityAnalyzer._is_productive_domain - Base domain from URL: {base_domain}")
 
@@ -363,31 +1018,11 @@ class ProductivityAnalyzer:
                  logger.debug("ProductivityAnalyzer._is_productive_domain - Is allowed platform, returning True")
                  return True
 
-             # Check if explicitly blocked specific domain/URL
-             # Ensure 'blocked_specific' exists and is a list
-             blocked_specific = settings.get("blocked_specific", [])
-             if isinstance(blocked_specific, list):
-                 for blocked in blocked_specific:
-                      if not isinstance(blocked, str): continue # Skip non-string entries
-                      # Simple endswith check for domains, or exact match for full URLs
-                      if base_domain.endswith(blocked.lower()) or url.lower() == blocked.lower():
-                          logger.debug(f"ProductivityAnalyzer._is_productive_domain - Blocked specific rule '{blocked}' match. Returning False")
-                          return False
-             else:
-                  logger.warning(f"_is_productive_domain - 'blocked_specific' for domain '{domain}' is not a list.")
-
-
-             # Check for blocked keywords in the URL
-             blocked_keywords = settings.get("blocked_keywords", [])
-             url_lower = url.lower()
-             if isinstance(blocked_keywords, list):
-                 for keyword in blocked_keywords:
-                     if not isinstance(keyword, str): continue
-                     if keyword.lower() in url_lower:
-                         logger.debug(f"ProductivityAnalyzer._is_productive_domain - Blocked keyword '{keyword}' found in URL. Returning False")
-                         return False
-             else:
-                 logger.warning(f"_is_productive_domain - 'blocked_keywords' for domain '{domain}' is not a list.")
+             # Check blocked specific domains/URLs and blocked keywords
+             blocked_result = self._match_blocked_rules(url, base_domain, domain)
+             if blocked_result:
+                 logger.debug(f"ProductivityAnalyzer._is_productive_domain - {blocked_result['explanation']} Returning False")
+                 return False
 
              logger.debug("ProductivityAnalyzer._is_productive_domain - No explicit productive/blocked rule matched based on settings. Returning None for further analysis.")
              return None # Needs further analysis (like context or AI)
@@ -400,8 +1035,8 @@ class ProductivityAnalyzer:
             return None
 
 
-    def _analyze_url_components(self, url: str) -> dict:
-        """Basic URL component analysis without context relevance."""
+    def _analyze_url_components(self, url) -> dict:
+        """Basic URL component analysis without context relevance (url is a string or ParsedURL)."""
         logger.debug(f"_analyze_url_components - START - URL: {url}")
         signals = {
             'is_search': False,
@@ -416,29 +1051,19 @@ class ProductivityAnalyzer:
             'error': None
         }
         try:
-            parsed = urlparse(url)
-            signals['hostname'] = parsed.netloc.lower()
+            parsed = parse_url(url)
+            signals['hostname'] = parsed.host
             if not signals['hostname']:
                  raise ValueError("Could not parse hostname")
 
-            path_parts = [part for part in parsed.path.lower().split('/') if part] # Filter empty parts
-            query_parts = parsed.query.lower().split('&')
-
-            # Extract search query if present
-            for param in query_parts:
-                if '=' in param:
-                    key, value = param.split('=', 1)
-                    if key in ['q', 'query', 'search', 's', 'k', 'keyword']:
-                         try:
-                              signals['search_query'] = requests.utils.unquote(value) # Decode URL encoding
-                         except Exception as decode_err:
-                              logger.warning(f"_analyze_url_components - Error decoding search query param '{value}': {decode_err}")
-                              signals['search_query'] = value # Use raw value if decoding fails
-                         break # Found one, stop looking
+            path_parts = list(parsed.path_tokens) # Non-empty path segments
+
+            # Extract search query if present (first search parameter, decoded)
+            signals['search_query'] = parsed.search_query
 
             # Basic URL analysis based on keywords
             netloc_lower = signals['hostname']
-            path_lower = parsed.path.lower()
+            path_lower = parsed.path_lower
 
             signals['is_search'] = any(term in netloc_lower for term in ['search.', 'google.', 'bing.', 'duckduckgo.', 'startpage.']) or \
                                    any(term in path_lower for term in ['/search', '/s/', '/find', '/sp/search']) or \
@@ -455,7 +1080,7 @@ class ProductivityAnalyzer:
 
             # Generic keyword/path checks (domain-specific checks happen in analyze_website)
             generic_blocked_keywords = ['game', 'unblocked', 'entertainment', 'proxy', 'bypass', 'hack', 'cheat']
-            url_lower = url.lower()
+            url_lower = parsed.lower
             signals['has_blocked_keywords_generic'] = any(keyword in url_lower for keyword in generic_blocked_keywords)
             signals['suspicious_paths'] = any(keyword in path_parts for keyword in generic_blocked_keywords)
 
@@ -467,21 +1092,22 @@ class ProductivityAnalyzer:
             signals['error'] = str(e)
             return signals
 
-    def _check_context_relevance(self, url: str, url_signals=None) -> dict:
+    def _check_context_relevance(self, url, url_signals=None) -> ContextRelevance:
         """Check relevance of URL and its signals against stored context data.
+
+        Score: 0.3 for every distinct context term found in the URL plus 0.5 for
+        every distinct term found in the search query, capped at 1.0. With
+        CONTEXT_MATCH_MODE=tokens (default) a term is found when its tokens occur
+        consecutively in the tokenized URL/query; with 'compat' when it is a
+        substring, which gives the same scores as the original term scan.
         
         Args:
-            url: The URL to check
+            url: The URL to check (string or ParsedURL)
             url_signals: Either a dictionary of URL signals or a string containing
                         the search query directly
         """
         # Initialize result structure
-        relevance = {
-            'score': 0.0,
-            'matched_terms': [],
-            'matches': [],
-            'error': None
-        }
+        relevance = ContextRelevance()
         logger.debug(f"_check_context_relevance - START - URL: {url}")
 
         if not self.context_data:
@@ -489,34 +1115,14 @@ class ProductivityAnalyzer:
             return relevance # Return default zero score if no context
 
         try:
-            # --- Prepare context terms ---
-            context_terms_set = set()
-            logger.debug(f"_check_context_relevance - Processing context data: {self.context_data}")
-            for question, answer in self.context_data.items():
-                if isinstance(answer, str) and answer.strip():
-                    # Clean and split into words, remove punctuation, lowercase
-                    words = [word.strip('.,?!();:"\'').lower() for word in answer.split()]
-                    words = [word for word in words if len(word) > 2] # Keep words longer than 2 chars
-
-                    # Add single words
-                    context_terms_set.update(words)
-
-                    # Add 2-word phrases (bi-grams)
-                    context_terms_set.update([f"{words[i]} {words[i+1]}" for i in range(len(words)-1)])
-
-                    # Add 3-word phrases (tri-grams) - Optional, can increase noise
-                    context_terms_set.update([f"{words[i]} {words[i+1]} {words[i+2]}" for i in range(len(words)-2)])
-
-            context_terms = list(context_terms_set)
-            if not context_terms:
+            # --- Context terms and indexes, compiled once per context profile ---
+            profile = self._active_context_profile()
+            if not profile.terms:
                  logger.warning("_check_context_relevance - No usable terms extracted from context data.")
                  return relevance
             
-            logger.debug(f"_check_context_relevance - Context terms generated ({len(context_terms)}): {context_terms[:20]}...") # Log first few terms
+            logger.debug(f"_check_context_relevance - Using {len(profile.terms)} context terms")
 
-            # --- Check against URL components ---
-            url_lower = url.lower()
-            
             # Handle different types of url_signals input
             search_query = ""
             if isinstance(url_signals, dict):
@@ -527,22 +1133,20 @@ class ProductivityAnalyzer:
                 search_query = url_signals
             
             # Check full URL (weight: 0.3)
-            for term in context_terms:
-                if term in url_lower:
-                    relevance['score'] += 0.3
-                    relevance['matched_terms'].append(term)
-                    relevance['matches'].append({'term': term, 'location': 'url', 'weight': 0.3})
+            url = parse_url(url)
+            for term in profile.match(url.lower, url.tokens):
+                relevance.score += 0.3
+                relevance.matched_terms.append(term)
+                relevance.matches.append(RelevanceMatch(term, 'url', 0.3))
 
             # Check search query (higher weight: 0.5)
             if search_query:
-                query_lower = search_query.lower()
-                logger.debug(f"_check_context_relevance - Checking search query: '{query_lower}'")
+                logger.debug(f"_check_context_relevance - Checking search query: '{search_query}'")
                 
-                for term in context_terms:
-                    if term in query_lower:
-                        relevance['score'] += 0.5
-                        relevance['matched_terms'].append(term)
-                        relevance['matches'].append({'term': term, 'location': 'search_query', 'weight': 0.5})
+                for term in profile.match(search_query.lower()):
+                    relevance.score += 0.5
+                    relevance.matched_terms.append(term)
+                    relevance.matches.append(RelevanceMatch(term, 'search_query', 0.5))
 
             # --- TODO: Future Enhancement: Check Website Content ---
             # Placeholder for fetching and analyzing title/meta description/body text
@@ -550,7 +1154,7 @@ class ProductivityAnalyzer:
             #     page_content = self._fetch_website_text(url) # Implement this helper
             #     if page_content:
             #         content_lower = page_content.lower()
-            #         for term in context_terms:
+            #         for term in profile.terms:
             #             if term in content_lower:
             #                 relevance['score'] += 0.2 # Lower weight for general content match
             #                 relevance['matched_terms'].append(term)
@@ -559,15 +1163,15 @@ class ProductivityAnalyzer:
             #     logger.warning(f"_check_context_relevance - Could not fetch or analyze content for {url}: {fetch_err}")
 
             # Normalize score (cap at 1.0) and deduplicate terms
-            relevance['score'] = min(1.0, round(relevance['score'], 2))
-            relevance['matched_terms'] = sorted(list(set(relevance['matched_terms']))) # Sort for consistency
+            relevance.score = min(1.0, round(relevance.score, 2))
+            relevance.matched_terms = sorted(list(set(relevance.matched_terms))) # Sort for consistency
 
             logger.debug(f"_check_context_relevance - END - Relevance result: {relevance}")
             return relevance
 
         except Exception as e:
             logger.error(f"_check_context_relevance - Error: {e}", exc_info=True)
-            relevance['error'] = str(e)
+            relevance.error = str(e)
             return relevance
 
 
@@ -602,13 +1206,390 @@ class ProductivityAnalyzer:
         # Default if no specific category matches
         return 'general'
 
-    def analyze_website(self, url: str, domain: str) -> dict: # Return dict now
+    def _match_blocked_rules(self, url: ParsedURL, base_domain: str, domain: str) -> Optional[dict]:
+        """Check the domain's blocked_specific and blocked_keywords lists (compiled in self.rules).
+
+        Returns:
+            dict: BLOCK result for the first matching rule, or None if no rule matched.
+        """
+        rules = self.rules.get(domain)
+        if rules is None:
+            return None
+        return rules.blocked_rule(base_domain, url.lower)
+
+    def _context_stage(self, url: ParsedURL, domain: str, settings: dict) -> tuple:
+        """Run the contextual relevance stage and decide whether the AI stage is needed.
+
+        Returns:
+            tuple: (result, ai_prompt) - result is a decided ALLOW dict when context
+            relevance is high, ai_prompt is the prompt to send when AI analysis is
+            needed. Both are None when the default rule applies.
+        """
+        contextualization_required = settings.get("contextualization_required", domain == "personal") # Default to True for personal
+        # Context check runs if required AND context data exists
+        run_context_check = contextualization_required and self.context_data
+
+        context_relevance = None # Only set when the context check runs
+        url_signals = self._analyze_url_components(url) # Analyze components once
+
+        if run_context_check:
+            context_relevance = self._check_context_relevance(url, url_signals)
+            logger.debug(f"_context_stage - Context relevance result: {context_relevance}")
+
+            # Decision based on high context relevance
+            if context_relevance.score > 0.7:
+                matched_terms_str = ', '.join(context_relevance.matched_terms)
+                explanation = f"High context relevance ({context_relevance.score}). Matched: {matched_terms_str}"
+                return {'isProductive': True, 'explanation': explanation}, None
+
+        # Condition to use AI:
+        # - Context exists AND relevance score is moderate (0.3 to 0.7)
+        # - OR Contextualization is required but context is empty (needs AI to decide based on URL alone vs. generic productivity)
+        # - OR Contextualization is *not* required (e.g., work/school) and URL didn't hit explicit allow/block rules.
+        use_ai = (run_context_check and 0.3 <= context_relevance.score <= 0.7) or \
+                 (contextualization_required and not self.context_data) or \
+                 (not contextualization_required) # Use AI if not explicitly allowed/blocked and context isn't needed/used
+
+        if not use_ai:
+            return None, None
+        return None, self._build_analysis_prompt(url, domain, url_signals, context_relevance)
+
+    def _build_analysis_prompt(self, url, domain: str, url_signals: dict,
+                               context_relevance: Optional[ContextRelevance]) -> str:
+        """Build the AI stage prompt for a URL (string or ParsedURL) that no rule decided."""
+        context_data, encoded_context = self.context_data or {}, None
+        if context_data:
+            profile = self._active_context_profile()
+            # The condensed summary once available, the full context until then
+            context_data, encoded_context = profile.summary or (context_data, profile.prompt_fragment)
+        return self.prompt_compiler.compile(
+            parse_url(url).url, domain, context_data, url_signals, context_relevance,
+            RESPONSE_INSTRUCTIONS.get(AI_RESPONSE_MODE, RESPONSE_INSTRUCTIONS['text']),
+            encoded_context=encoded_context
+        )
+
+    def _generate_decision(self, prompt: str) -> tuple:
+        """Send the analysis prompt to the model and return the decision text.
+
+        Structured and verdict-only decisions are deterministic and cached by
+        prompt hash. Text-mode decisions are streamed when STREAM_AI_DECISIONS
+        is set: this returns as soon as the leading verdict token has arrived
+        and the rest of the explanation is drained on a background thread into
+        self.explanations.
+
+        Returns:
+            tuple: (decision_text, explanation_id) - explanation_id is None when the
+            full response was read before returning.
+        """
+        mode = AI_RESPONSE_MODE
+        generation_config = DECISION_GENERATION_CONFIGS.get(mode, DECISION_GENERATION_CONFIGS['text'])
+        if mode == 'text' and STREAM_AI_DECISIONS:
+            return self._stream_decision(prompt, generation_config)
+
+        cache_key = hashlib.sha256(f"{mode}\n{prompt}".encode('utf-8')).hexdigest()
+        cached = self._get_cached_decision(cache_key)
+        if cached is not None:
+            self._record_ai_stat('cache_hits')
+            return cached, None
+
+        response = self.model.generate_content(
+            contents=prompt,
+            generation_config=generation_config
+        )
+
+        if not hasattr(response, 'text'):
+            logger.error(f"_generate_decision - AI response object does not have 'text' attribute. Response: {response}")
+            raise ValueError("Invalid response format from AI.")
+
+        decision = response.text.strip()
+        self._record_ai_usage(response)
+        if _parse_verdict(decision) is not None:
+            self._store_cached_decision(cache_key, decision)  # Never cache unparseable output
+        return decision, None
+
+    def _stream_decision(self, prompt: str, generation_config: dict) -> tuple:
+        """Stream a text-mode decision and return once the leading verdict has arrived."""
+        chunks = iter(self.model.generate_content(contents=prompt, stream=True,
+                                                  generation_config=generation_config))
+        received = ''
+        for chunk in chunks:
+            received += chunk.text
+            verdict = _leading_verdict(received)
+            if verdict is None:
+                continue  # Leading token not complete yet
+            if verdict == '':
+                break  # Not in the expected format, read the rest for the usual parse
+            explanation_id = self.explanations.open(received.strip())
+            self._stream_executor.submit(self._drain_explanation, chunks, received, explanation_id)
+            return received.strip(), explanation_id
+
+        # Stream ended before a verdict was recognised (or the format is wrong)
+        for chunk in chunks:
+            received += chunk.text
+        return received.strip(), None
+
+    def _get_cached_decision(self, cache_key: str) -> Optional[str]:
+        """Return a cached decision for a prompt hash if it has not expired."""
+        with self._stats_lock:
+            entry = self._decision_cache.get(cache_key)
+            if entry is None:
+                return None
+            decision, stored_at = entry
+            if time.monotonic() - stored_at > DECISION_CACHE_TTL:
+                del self._decision_cache[cache_key]
+                return None
+            self._decision_cache.move_to_end(cache_key)
+            return decision
+
+    def _store_cached_decision(self, cache_key: str, decision: str) -> None:
+        """Cache a decision by prompt hash, evicting the least recently used entries."""
+        with self._stats_lock:
+            self._decision_cache[cache_key] = (decision, time.monotonic())
+            self._decision_cache.move_to_end(cache_key)
+            while len(self._decision_cache) > DECISION_CACHE_SIZE:
+                self._decision_cache.popitem(last=False)
+
+    def _record_ai_stat(self, name: str, amount: int = 1) -> None:
+        """Increment an AI stage counter in self.ai_stats."""
+        with self._stats_lock:
+            self.ai_stats[name] = self.ai_stats.get(name, 0) + amount
+
+    def _record_ai_usage(self, response) -> None:
+        """Count a model call and its output tokens when the response reports usage."""
+        self._record_ai_stat('calls')
+        usage = getattr(response, 'usage_metadata', None)
+        output_tokens = getattr(usage, 'candidates_token_count', None)
+        if output_tokens:
+            self._record_ai_stat('output_tokens', output_tokens)
+
+    def _drain_explanation(self, chunks, received: str, explanation_id: str) -> None:
+        """Read the remainder of a streamed decision and attach it to its explanation entry."""
+        try:
+            for chunk in chunks:
+                received += chunk.text
+        except Exception as e:
+            logger.warning(f"_drain_explanation - Stream ended early for explanation {explanation_id}: {e}")
+        explanation = received.split(':', 1)[1].strip() if ':' in received else received.strip()
+        self.explanations.complete(explanation_id, explanation)
+        logger.info(f"_drain_explanation - Explanation {explanation_id} complete: {explanation}")
+
+    def _defer_explanation(self, result: dict, prompt: str) -> dict:
+        """Register a lazily generated explanation for a BLOCK result."""
+        verdict = 'ALLOW' if result['isProductive'] else 'BLOCK'
+        dedupe_key = hashlib.sha256(f"{verdict}\n{prompt}".encode('utf-8')).hexdigest()
+        result['explanation_id'] = self.explanations.open(
+            dedupe_key=dedupe_key, claimed=False, prompt=prompt, verdict=verdict,
+            instructions=RESPONSE_INSTRUCTIONS.get(AI_RESPONSE_MODE, RESPONSE_INSTRUCTIONS['text'])
+        )
+        return result
+
+    def explain(self, explanation_id: str, wait: float = 5.0) -> Optional[dict]:
+        """Return the explanation for an id, generating it now if it was deferred.
+
+        Returns:
+            dict: {'explanation': str, 'complete': bool} or None if the id is unknown.
+        """
+        entry = self.explanations.get(explanation_id)
+        if entry is None or entry['complete']:
+            return entry
+
+        metadata = self.explanations.claim(explanation_id)
+        if metadata is None:
+            # Still streaming, or another request is generating it
+            return self.explanations.get(explanation_id, wait=wait)
+
+        try:
+            explanation_prompt = metadata['prompt'].replace(
+                metadata['instructions'], EXPLANATION_INSTRUCTIONS.format(verdict=metadata['verdict'])
+            )
+            response = self.model.generate_content(
+                contents=explanation_prompt,
+                generation_config=EXPLANATION_GENERATION_CONFIG
+            )
+            self._record_ai_usage(response)
+            explanation = response.text.strip()
+            logger.info(f"explain - Generated explanation {explanation_id}: {explanation}")
+        except Exception as e:
+            logger.error(f"explain - Error generating explanation {explanation_id}: {e}", exc_info=True)
+            explanation = "No further explanation is available for this decision."
+        self.explanations.complete(explanation_id, explanation)
+        return self.explanations.get(explanation_id)
+
+    def attach_explanation(self, result) -> bool:
+        """Replace a result's partial explanation with the completed one if it has arrived since.
+
+        Returns True if the explanation was replaced.
+        """
+        if result.explanation_id:
+            entry = self.explanations.get(result.explanation_id)
+            if entry and entry['complete']:
+                result.explanation = entry['explanation']
+                return True
+        return False
+
+    def _parse_ai_decision(self, decision: str, url: str, domain: str,
+                           explanation_id: Optional[str] = None, prompt: Optional[str] = None) -> dict:
+        """Turn the model's decision (JSON, '<ALLOW|BLOCK>: <reason>' or a bare verdict) into a result dict.
+
+        When the explanation is still streaming, the result carries the text
+        received so far plus an 'explanation_id' to fetch the rest from /explain.
+        BLOCK verdicts outside text mode get a deferred explanation for the same.
+        """
+        parsed = _parse_verdict(decision)
+        if parsed is None:
+            self._record_ai_stat('parse_failures')
+            explanation = f"AI response format incorrect ('ALLOW:' or 'BLOCK:' expected). Response: '{decision}'."
+            logger.warning(f"analyze_website - {explanation} Defaulting to BLOCK.")
+            return {'isProductive': False, 'explanation': explanation} # Return dict
+
+        verdict, confidence, explanation = parsed
+        result = {'isProductive': verdict == 'ALLOW'}
+        if confidence is not None:
+            result['confidence'] = confidence
+
+        if explanation_id:
+            result['explanation'] = explanation or 'Explanation pending.'
+            result['explanation_id'] = explanation_id
+            logger.info(f"analyze_website - AI Verdict: {verdict} (explanation streaming as {explanation_id}): URL={url}, DOMAIN={domain}")
+            return result
+
+        result['explanation'] = explanation or ('Allowed by AI analysis.' if verdict == 'ALLOW' else 'Blocked by AI analysis.')
+        if verdict == 'ALLOW':
+            logger.info(f"analyze_website - AI Verdict: ALLOW. Reason: {explanation}")
+            # Log additional details for successful analysis that might be useful for debugging direct visits
+            logger.info(f"analyze_website - AI ALLOWED: URL={url}, DOMAIN={domain}, EXPLANATION={explanation}")
+        else:
+            logger.info(f"analyze_website - AI Verdict: BLOCK. Reason: {explanation}")
+            # Log additional details for unsuccessful analysis
+            logger.info(f"analyze_website - AI BLOCKED: URL={url}, DOMAIN={domain}, EXPLANATION={explanation}")
+            if prompt is not None and AI_RESPONSE_MODE != 'text':
+                # Only blocked URLs ever show an explanation, so only they get one registered
+                self._defer_explanation(result, prompt)
+        return result
+
+    def _record_speculation(self, outcome: str) -> None:
+        """Increment a speculation counter ('dispatched', 'used', 'wasted' or 'cancelled')."""
+        with self._stats_lock:
+            self.speculation_stats[outcome] = self.speculation_stats.get(outcome, 0) + 1
+
+    def speculate_ai(self, url, domain: str) -> Optional[SpeculativeAICall]:
+        """Start the AI stage early for URLs that are predicted to need it.
+
+        The prediction is the rule stages of analyze_website run ahead of time:
+        the host is not an allowed platform, no blocked rule matches and context
+        relevance is not high enough to decide. The model call runs on a worker
+        thread while the caller finishes its remaining local work; pass the
+        returned handle to analyze_website (or discard_speculation).
+
+        Returns:
+            SpeculativeAICall or None if speculation is disabled or not predicted to help.
+        """
+        if not SPECULATIVE_AI_ENABLED:
+            return None
+        try:
+            url = parse_url(url)
+            domain = InputValidator.sanitize_string(domain, 100)
+            if not InputValidator.validate_url(url):
+                return None
+            base_domain = self._get_domain_from_url(url)
+            settings = self.settings.get("domains", {}).get(domain)
+            if not base_domain or not isinstance(settings, dict):
+                return None
+
+            # Known hosts and list hits are decided by the rules, no model call needed
+            if self._is_allowed_platform(url, domain) or \
+               self._match_blocked_rules(url, base_domain, domain):
+                return None
+
+            decided, prompt = self._context_stage(url, domain, settings)
+            if prompt is None:
+                return None
+        except Exception as e:
+            logger.warning(f"speculate_ai - Prediction failed for {url}, skipping speculation: {e}")
+            return None
+
+        future = self._ai_executor.submit(self._generate_decision, prompt)
+        self._record_speculation('dispatched')
+        logger.debug(f"speculate_ai - Dispatched speculative AI call for {url}")
+        return SpeculativeAICall(url.url, domain, prompt, future)
+
+    def discard_speculation(self, speculative: Optional[SpeculativeAICall]) -> None:
+        """Cancel a speculative call that was not used; a call already in flight is ignored."""
+        if speculative is None or speculative.settled:
+            return
+        speculative.settled = True
+        if speculative.future.cancel():
+            self._record_speculation('cancelled')
+        else:
+            self._record_speculation('wasted')
+            logger.debug(f"discard_speculation - Speculative AI call for {speculative.url} was not used")
+
+    def _resolve_ai_decision(self, prompt: str, speculative: Optional[SpeculativeAICall]) -> tuple:
+        """Return (decision_text, explanation_id), reusing a matching speculative call if there is one."""
+        if speculative is not None and not speculative.settled and speculative.prompt == prompt:
+            speculative.settled = True
+            self._record_speculation('used')
+            logger.debug(f"_resolve_ai_decision - Using speculative AI call for {speculative.url}")
+            return speculative.future.result()
+        return self._generate_decision(prompt)
+
+    def admit_analysis(self, domain: str, session_id: Optional[str] = None) -> Optional[dict]:
+        """Take a token from the analysis rate limit.
+
+        Returns None if the analysis may run, otherwise a result with
+        'rate_limited': True and 'retry_after' (seconds). Such a result is not a
+        verdict on the URL: callers must not cache it or show it as a block.
+        """
+        domain_settings = self.settings.get("domains", {}).get(domain)
+        rate = domain_settings.get("analysis_rate_limit") if isinstance(domain_settings, dict) else None
+        if ANALYSIS_RATE_SCOPE == 'global':
+            key = '*'
+        elif ANALYSIS_RATE_SCOPE == 'session' and session_id:
+            key = f"{domain}:{session_id}"
+        else:
+            key = domain
+
+        try:
+            if rate:
+                count, period = parse_rate(rate)
+                wait = self.analysis_limiter.acquire(key, count / period, count)
+            else:
+                wait = self.analysis_limiter.acquire(key)
+        except ValueError as e:
+            logger.error(f"ProductivityAnalyzer.admit_analysis - {e}, using the default limit for '{domain}'")
+            wait = self.analysis_limiter.acquire(key)
+
+        if wait <= 0:
+            return None
+        logger.warning(f"Rate limit exceeded for analyze_website ({key})")
+        return {'isProductive': False, 'explanation': 'Rate limit exceeded. Please try again later.',
+                'rate_limited': True, 'retry_after': round(wait, 1)}
+
+    def analyze_website(self, url, domain: str, speculative: Optional[SpeculativeAICall] = None,
+                        session_id: Optional[str] = None, admitted: bool = False) -> dict: # Return dict now
         """Analyze if a website is productive based on domain settings, context, and AI.
 
+        Args:
+            url: The URL to analyze, as a string or a ParsedURL (parsed once and shared by every stage)
+            domain: The active domain (work/school/personal)
+            speculative: Optional handle from speculate_ai; used if the AI stage is
+                         reached with the same prompt, otherwise discarded.
+            session_id: Session the analysis is counted against for rate limiting
+            admitted: True if the caller already passed admit_analysis for this request
+
         Returns:
-            dict: {'isProductive': bool, 'explanation': str, 'confidence': float (optional)}
+            dict: {'isProductive': bool, 'explanation': str, 'confidence': float (optional)},
+                  or the admit_analysis result (with 'rate_limited') if over the rate limit
         """
+        try:
+            return self._analyze_website(url, domain, speculative, session_id, admitted)
+        finally:
+            self.discard_speculation(speculative)
+
+    def _analyze_website(self, url, domain: str, speculative: Optional[SpeculativeAICall],
+                         session_id: Optional[str] = None, admitted: bool = False) -> dict:
         logger.debug(f"analyze_website - START - URL: {url}, Domain: {domain}")
+        url = parse_url(url)
         
         # Security validation
         if not InputValidator.validate_url(url):
@@ -621,22 +1602,10 @@ class ProductivityAnalyzer:
             return {'isProductive': False, 'explanation': 'Invalid domain format.'}
         
         # Rate limiting check - prevent too many requests in short time
-        current_time = datetime.now()
-        if not hasattr(self, '_last_analysis_times'):
-            self._last_analysis_times = []
-        
-        # Remove old timestamps (older than 1 minute)
-        self._last_analysis_times = [
-            t for t in self._last_analysis_times 
-            if current_time - t < timedelta(minutes=1)
-        ]
-        
-        # Check if too many requests in the last minute
-        if len(self._last_analysis_times) > 50:  # Max 50 requests per minute
-            logger.warning(f"Rate limit exceeded for analyze_website")
-            return {'isProductive': False, 'explanation': 'Rate limit exceeded. Please try again later.'}
-        
-        self._last_analysis_times.append(current_time)
+        if not admitted:
+            rate_limited = self.admit_analysis(domain, session_id)
+            if rate_limited:
+                return rate_limited
 
         # --- Initial Checks ---
         base_domain = self._get_domain_from_url(url)
@@ -657,141 +1626,29 @@ class ProductivityAnalyzer:
             logger.info(f"analyze_website - ALLOWED: URL '{url}' matches an allowed platform for domain '{domain}'.")
             return {'isProductive': True, 'explanation': f"Allowed platform for '{domain}' domain."}
 
-        # --- 2. Check Explicitly Blocked Specific URLs/Domains ---
-        blocked_specific = settings.get("blocked_specific", [])
-        if isinstance(blocked_specific, list):
-            for blocked in blocked_specific:
-                if not isinstance(blocked, str): continue
-                # Check if the blocked rule matches the base domain or the full URL
-                if base_domain.endswith(blocked.lower()) or url.lower() == blocked.lower():
-                    logger.info(f"analyze_website - BLOCKED: URL '{url}' matches blocked specific rule '{blocked}' for domain '{domain}'.")
-                    return {'isProductive': False, 'explanation': f"Blocked specific rule: '{blocked}'."}
-        else:
-            logger.warning(f"analyze_website - 'blocked_specific' is not a list for domain '{domain}'.")
-
-        # --- 3. Check Blocked Keywords in URL ---
-        blocked_keywords = settings.get("blocked_keywords", [])
-        url_lower = url.lower()
-        if isinstance(blocked_keywords, list):
-            for keyword in blocked_keywords:
-                if not isinstance(keyword, str): continue
-                if keyword.lower() in url_lower:
-                    logger.info(f"analyze_website - BLOCKED: URL '{url}' contains blocked keyword '{keyword}' for domain '{domain}'.")
-                    return {'isProductive': False, 'explanation': f"Blocked keyword found: '{keyword}'."}
-        else:
-            logger.warning(f"analyze_website - 'blocked_keywords' is not a list for domain '{domain}'.")
-
+        # --- 2 & 3. Check Explicitly Blocked Specific URLs/Domains and Blocked Keywords ---
+        blocked_result = self._match_blocked_rules(url, base_domain, domain)
+        if blocked_result:
+            logger.info(f"analyze_website - BLOCKED: URL '{url}' for domain '{domain}'. {blocked_result['explanation']}")
+            return blocked_result
 
         # --- 4. Contextual Analysis (if applicable) ---
-        contextualization_required = settings.get("contextualization_required", domain == "personal") # Default to True for personal
-        # Context check runs if required AND context data exists
-        run_context_check = contextualization_required and self.context_data
-
-        context_relevance = {'score': 0.0} # Default score if no context check
-        url_signals = self._analyze_url_components(url) # Analyze components once
-
-        if run_context_check:
-            context_relevance = self._check_context_relevance(url, url_signals)
-            logger.debug(f"analyze_website - Context relevance result: {context_relevance}")
-
-            # Decision based on high context relevance
-            if context_relevance.get('score', 0.0) > 0.7: # Ensure default is 0.0 for comparison
-                matched_terms_str = ', '.join(context_relevance.get('matched_terms',[]))
-                explanation = f"High context relevance ({context_relevance['score']}). Matched: {matched_terms_str}"
-                logger.info(f"analyze_website - ALLOWED: {explanation} for URL '{url}'.")
-                return {'isProductive': True, 'explanation': explanation}
+        context_result, ai_prompt = self._context_stage(url, domain, settings)
+        if context_result:
+            logger.info(f"analyze_website - ALLOWED: {context_result['explanation']} for URL '{url}'.")
+            return context_result
 
         # --- 5. AI Analysis (Borderline Cases or when context is insufficient) ---
-        # Condition to use AI:
-        # - Context exists AND relevance score is moderate (0.3 to 0.7)
-        # - OR Contextualization is required but context is empty (needs AI to decide based on URL alone vs. generic productivity)
-        # - OR Contextualization is *not* required (e.g., work/school) and URL didn't hit explicit allow/block rules.
-        use_ai = (run_context_check and 0.3 <= context_relevance.get('score', 0.0) <= 0.7) or \
-                 (contextualization_required and not self.context_data) or \
-                 (not contextualization_required) # Use AI if not explicitly allowed/blocked and context isn't needed/used
-
-        if use_ai:
+        if ai_prompt is not None:
             logger.debug(f"analyze_website - Proceeding to AI analysis for URL: {url}")
             try:
-                context_summary = "No specific task context provided."
-                if self.context_data:
-                     # Ensure context_data is serializable (it should be dict)
-                     try:
-                         context_summary = json.dumps(self.context_data, indent=2)
-                     except TypeError as json_err:
-                         logger.error(f"analyze_website - Context data not JSON serializable: {json_err}")
-                         context_summary = "Error: Context data could not be formatted."
-
-
-                # Prepare detailed prompt for AI
-                analysis_prompt = f"""Analyze if visiting this URL is productive for the user in the '{domain}' domain, considering their current task context (if provided).
-
-                Domain Policy Context:
-                - Current Domain: {domain}
-                - Explicitly Allowed Platforms (already checked): LMS, Productivity Tools, AI Tools defined for '{domain}'
-                - Explicitly Blocked Keywords (already checked): {settings.get("blocked_keywords", [])}
-                - Explicitly Blocked Specific Sites (already checked): {settings.get("blocked_specific", [])}
-
-                User Task Context:
-                {context_summary}
-
-                URL Under Review:
-                - URL: {url}
-                - Detected Hostname: {url_signals.get('hostname', 'N/A')}
-                - Detected Category: {url_signals.get('domain_type', 'N/A')}
-                - Is Search?: {url_signals.get('is_search', 'N/A')}
-                - Search Query: {url_signals.get('search_query', 'N/A')}
-                - Context Relevance Score: {context_relevance.get('score', 'N/A')} (if applicable)
-                - Context Matched Terms: {context_relevance.get('matched_terms', 'N/A')} (if applicable)
-
-                Analysis Goal: Determine if accessing this URL is directly related to completing the user's stated task (if provided) OR is generally considered productive/necessary within the '{domain}' domain (e.g., documentation, core tools) and isn't explicitly blocked. Block common time-wasting sites (social media, games, excessive entertainment) unless context strongly justifies it.
-
-                Respond with exactly 'ALLOW' or 'BLOCK' followed by a concise reason.
-                Format: <ALLOW|BLOCK>: <Reasoning based on URL, context, and domain policy.>
-                Example ALLOW: ALLOW: Accessing Python documentation is relevant to the programming task.
-                Example BLOCK: BLOCK: Social media site is not related to the work task and is generally blocked in the 'work' domain.
-                """
-
-                logger.debug("analyze_website - AI Analysis Prompt:\n" + analysis_prompt)
-
-                # --- FIX: Use self.model for generation ---
-                response = self.model.generate_content(
-                    contents=analysis_prompt
-                    # Removed model="gemini-2.0-flash"
-                )
-                # --- End FIX ---
-
-                if not hasattr(response, 'text'):
-                    logger.error(f"analyze_website - AI response object does not have 'text' attribute. Response: {response}")
-                    raise ValueError("Invalid response format from AI.")
-
-                decision = response.text.strip()
+                logger.debug("analyze_website - AI Analysis Prompt:\n" + ai_prompt)
+
+                decision, explanation_id = self._resolve_ai_decision(ai_prompt, speculative)
                 logger.info(f"analyze_website - AI Analysis Result for {url}: {decision}")
 
                 # Parse AI decision
-                if ':' in decision:
-                    verdict, explanation = decision.split(':', 1)
-                    verdict = verdict.strip().upper()
-                    explanation = explanation.strip()
-
-                    if verdict == 'ALLOW':
-                        logger.info(f"analyze_website - AI Verdict: ALLOW. Reason: {explanation}")
-                        # Log additional details for successful analysis that might be useful for debugging direct visits
-                        logger.info(f"analyze_website - AI ALLOWED: URL={url}, DOMAIN={domain}, EXPLANATION={explanation}")
-                        return {'isProductive': True, 'explanation': explanation} # Return dict
-                    elif verdict == 'BLOCK':
-                        logger.info(f"analyze_website - AI Verdict: BLOCK. Reason: {explanation}")
-                        # Log additional details for unsuccessful analysis
-                        logger.info(f"analyze_website - AI BLOCKED: URL={url}, DOMAIN={domain}, EXPLANATION={explanation}")
-                        return {'isProductive': False, 'explanation': explanation} # Return dict
-                    else:
-                        explanation = f"AI returned unexpected verdict '{verdict}'."
-                        logger.warning(f"analyze_website - {explanation} Defaulting to BLOCK.")
-                        return {'isProductive': False, 'explanation': explanation} # Return dict
-                else:
-                    explanation = f"AI response format incorrect ('ALLOW:' or 'BLOCK:' expected). Response: '{decision}'."
-                    logger.warning(f"analyze_website - {explanation} Defaulting to BLOCK.")
-                    return {'isProductive': False, 'explanation': explanation} # Return dict
+                return self._parse_ai_decision(decision, url, domain, explanation_id, ai_prompt)
 
             except Exception as e:
                 explanation = f"AI analysis failed: {e}"
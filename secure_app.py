@@ -7,11 +7,12 @@ rate limiting, input validation, and security headers.
 import os
 import time
 import secrets
-from flask import Flask, request, jsonify, make_response, send_from_directory, render_template, session, redirect, g
+from flask import Flask, Response, request, jsonify, make_response, send_from_directory, render_template, session, redirect, g
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_talisman import Talisman
+from flask.sessions import SecureCookieSession, SecureCookieSessionInterface
 from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.exceptions import RequestEntityTooLarge, BadRequest
 import logging
@@ -19,11 +20,15 @@ from functools import wraps
 import threading
 import json
 
-from script import ProductivityAnalyzer
+from script import ProductivityAnalyzer, QUESTION_CACHE_PRESEED
+from urls import parse_url
+from results import CachedResponse, Verdict
+from json_provider import FastJSONProvider
+import limiter_storage  # noqa: F401 - registers the shm:// limiter storage
 from security import (
     SecurityConfig, InputValidator, SecurityMiddleware,
     generate_csrf_token, validate_csrf_token, require_api_key,
-    secure_filename
+    secure_filename, classify_origin, RESPONSE_HEADER_PLANS, PREFLIGHT_HEADER_PLANS
 )
 
 # Configure logging
@@ -33,6 +38,23 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class _StatelessSession(SecureCookieSession):
+    """Session of a stateless API request: never loaded from or saved to a cookie."""
+
+class StatelessAPISessionInterface(SecureCookieSessionInterface):
+    """Cookie sessions, except that SecurityConfig.STATELESS_API_PATHS skip
+    decoding, signing and Set-Cookie altogether."""
+
+    def open_session(self, app, request):
+        if request.path in SecurityConfig.STATELESS_API_PATHS:
+            return _StatelessSession()
+        return super().open_session(app, request)
+
+    def save_session(self, app, session, response):
+        if isinstance(session, _StatelessSession):
+            return
+        super().save_session(app, session, response)
+
 def create_app(config_name='production'):
     """Create and configure the Flask application with security measures."""
     
@@ -42,6 +64,8 @@ def create_app(config_name='production'):
     
     # Apply security configuration
     app.config.from_object(SecurityConfig)
+    app.session_interface = StatelessAPISessionInterface()
+    app.json = FastJSONProvider(app)  # orjson when installed, for request bodies and responses
     
     # Trust proxy headers if behind reverse proxy
     app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
@@ -80,36 +104,27 @@ def create_app(config_name='production'):
         }
     })
     
-    # Additional CORS handling for Chrome extensions
+    # CORS (including Chrome extensions) and security headers, precomputed for
+    # each route and origin class (see RESPONSE_HEADER_PLANS)
     @app.after_request
-    def handle_cors(response):
+    def response_headers(response):
+        """Apply CORS and security headers to all responses."""
         origin = request.headers.get('Origin')
+        origin_class = classify_origin(origin)
+        path = request.path
+        referer = request.headers.get('Referer', '')
         
-        # Handle Chrome extensions and localhost
-        if origin and (origin.startswith('chrome-extension://') or 
-                      origin.startswith('moz-extension://') or
-                      origin in ['http://localhost:5000', 'http://127.0.0.1:5000']):
-            response.headers['Access-Control-Allow-Origin'] = origin
-            response.headers['Access-Control-Allow-Credentials'] = 'true'
-            response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS, PUT, DELETE'
-            response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-API-Key, X-CSRF-Token, Origin, Accept'
-            response.headers['Access-Control-Expose-Headers'] = 'X-CSRF-Token, Content-Type'
-        
-        # Handle null origin (file:// protocol) - can't use credentials with wildcard
-        elif origin == 'null':
-            response.headers['Access-Control-Allow-Origin'] = 'null'
-            response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS, PUT, DELETE'
-            response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-API-Key, X-CSRF-Token'
-            response.headers['Access-Control-Expose-Headers'] = 'X-CSRF-Token'
-            # Don't set credentials=true for null origin
+        # Check if request is from Chrome extension or any Chrome browser accessing /ext-popup
+        is_extension = (origin_class == 'extension' or
+                        referer.startswith(('chrome-extension://', 'moz-extension://')) or
+                        '/ext-popup' in path or  # Any request to ext-popup endpoint
+                        '/matrix-animation' in path or  # Matrix animation iframe
+                        path.startswith('/extension/'))  # Any request to extension files
+        RESPONSE_HEADER_PLANS[is_extension, origin_class].apply(response.headers, origin)
         
-        # Handle no origin for localhost development
-        elif not origin:
-            response.headers['Access-Control-Allow-Origin'] = '*'
-            response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS, PUT, DELETE'
-            response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-API-Key, X-CSRF-Token'
-            response.headers['Access-Control-Expose-Headers'] = 'X-CSRF-Token'
-            # Don't set credentials=true for wildcard
+        # Add CSRF token to response (the stateless API has none)
+        if path not in SecurityConfig.STATELESS_API_PATHS and 'csrf_token' in session:
+            response.headers['X-CSRF-Token'] = session['csrf_token']
         
         return response
     
@@ -117,39 +132,19 @@ def create_app(config_name='production'):
     def handle_preflight():
         """Handle CORS preflight requests."""
         if request.method == 'OPTIONS':
-            response = make_response()
             origin = request.headers.get('Origin')
-            
-            # Allow Chrome extensions and localhost
-            if origin and (origin.startswith('chrome-extension://') or 
-                          origin.startswith('moz-extension://') or
-                          origin in ['http://localhost:5000', 'http://127.0.0.1:5000']):
-                response.headers['Access-Control-Allow-Origin'] = origin
-                response.headers['Access-Control-Allow-Credentials'] = 'true'
-                response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS, PUT, DELETE'
-                response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-API-Key, X-CSRF-Token, Origin, Accept'
-                response.headers['Access-Control-Max-Age'] = '3600'
-                return response
-            
-            # Handle null origin (file:// protocol) - can't use credentials with wildcard
-            elif origin == 'null':
-                response.headers['Access-Control-Allow-Origin'] = 'null'
-                response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS, PUT, DELETE'
-                response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-API-Key, X-CSRF-Token'
-                response.headers['Access-Control-Max-Age'] = '3600'
-                # Don't set credentials=true for null origin
-                return response
-            
-            # Handle no origin for local development
-            elif not origin:
-                response.headers['Access-Control-Allow-Origin'] = '*'
-                response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS, PUT, DELETE'
-                response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-API-Key, X-CSRF-Token'
-                response.headers['Access-Control-Max-Age'] = '3600'
+            plan = PREFLIGHT_HEADER_PLANS.get(classify_origin(origin))
+            if plan is not None:
+                response = make_response()
+                plan.apply(response.headers, origin)
                 return response
     
     # Initialize analyzer
     analyzer = ProductivityAnalyzer()
+    app.extensions['analyzer'] = analyzer  # gunicorn's post_worker_init prepares its model client
+    if QUESTION_CACHE_PRESEED:
+        # Runs in the gunicorn master (preload_app), so every worker inherits the questions
+        analyzer.preseed_questions()
     
     # Cache structure with thread safety
     cache_lock = threading.Lock()
@@ -159,6 +154,20 @@ def create_app(config_name='production'):
         'session_ids': {}
     }
     CACHE_DURATION = 300  # 5 minutes for security
+
+    def invalidate_cache(old_rules, new_rules):
+        """Drop the cached verdicts a settings change may alter; the rest stay valid."""
+        with cache_lock:
+            keys = list(url_cache['data'])
+        stale = [key for key in keys if analyzer.settings_change_affects(old_rules, new_rules, *key)]
+        with cache_lock:
+            for key in stale:
+                url_cache['data'].pop(key, None)
+                url_cache['timestamps'].pop(key, None)
+                url_cache['session_ids'].pop(key, None)
+        logger.info(f"Settings {new_rules.version}: dropped {len(stale)} of {len(keys)} cached verdicts")
+
+    analyzer.add_settings_listener(invalidate_cache)
     
     def clear_expired_cache():
         """Clear expired cache entries with thread safety."""
@@ -197,58 +206,10 @@ def create_app(config_name='production'):
         if len(user_agent) > 1000:  # Prevent header injection
             raise BadRequest('Invalid User-Agent header')
         
-        # Generate CSRF token for sessions
-        if 'csrf_token' not in session:
+        # Generate CSRF token for sessions (the stateless API has none)
+        if request.path not in SecurityConfig.STATELESS_API_PATHS and 'csrf_token' not in session:
             session['csrf_token'] = generate_csrf_token()
     
-    @app.after_request
-    def security_headers(response):
-        """Apply security headers to all responses."""
-        # Apply security headers but modify for Chrome extensions
-        origin = request.headers.get('Origin', '')
-        referer = request.headers.get('Referer', '')
-        user_agent = request.headers.get('User-Agent', '')
-        
-        # Check if request is from Chrome extension or any Chrome browser accessing /ext-popup
-        is_extension = (origin.startswith('chrome-extension://') or 
-                       origin.startswith('moz-extension://') or
-                       referer.startswith('chrome-extension://') or
-                       referer.startswith('moz-extension://') or
-                       '/ext-popup' in request.path or  # Any request to ext-popup endpoint
-                       '/matrix-animation' in request.path or  # Matrix animation iframe
-                       request.path.startswith('/extension/'))  # Any request to extension files
-        
-        for header, value in SecurityConfig.SECURITY_HEADERS.items():
-            if header == 'Content-Security-Policy':
-                if is_extension:
-                    # More permissive CSP for extensions - completely remove frame-ancestors
-                    response.headers[header] = (
-                        "default-src 'self' http://localhost:* http://127.0.0.1:* chrome-extension: moz-extension:; "
-                        "script-src 'self' 'unsafe-inline' 'unsafe-eval' http://localhost:* http://127.0.0.1:* chrome-extension: moz-extension:; "
-                        "style-src 'self' 'unsafe-inline' http://localhost:* http://127.0.0.1:* chrome-extension: moz-extension:; "
-                        "img-src 'self' data: blob: http://localhost:* http://127.0.0.1:* chrome-extension: moz-extension:; "
-                        "connect-src 'self' http://localhost:* http://127.0.0.1:* chrome-extension: moz-extension:; "
-                        "font-src 'self' data: http://localhost:* http://127.0.0.1:* chrome-extension: moz-extension:; "
-                        "base-uri 'self'; "
-                        "form-action 'self';"
-                    )
-                else:
-                    response.headers[header] = value
-            elif header == 'X-Frame-Options':
-                if is_extension:
-                    # Don't set X-Frame-Options for extensions
-                    pass
-                else:
-                    response.headers[header] = value
-            else:
-                response.headers[header] = value
-        
-        # Add CSRF token to response
-        if 'csrf_token' in session:
-            response.headers['X-CSRF-Token'] = session['csrf_token']
-        
-        return response
-    
     @app.errorhandler(413)
     def request_too_large(error):
         """Handle request entity too large errors."""
@@ -301,7 +262,8 @@ def create_app(config_name='production'):
         return jsonify({
             'status': 'healthy',
             'timestamp': time.time(),
-            'version': '2.0.0'
+            'version': '2.0.0',
+            'settings_version': analyzer.settings_version
         })
     
     @app.route('/test-simple')
@@ -395,10 +357,12 @@ def create_app(config_name='production'):
             url = data.get('url', '').strip()
             domain = data.get('domain', '').strip()
             context = data.get('context', [])
+            context_id = data.get('context_id')
             session_id = data.get('session_id', '')
             
-            # Validate inputs
-            if not InputValidator.validate_url(url):
+            # Validate inputs; the URL is parsed once and shared by every analysis stage
+            parsed_url = parse_url(url)
+            if not InputValidator.validate_url(parsed_url):
                 security_middleware.record_failed_attempt(get_remote_address())
                 return jsonify({'error': 'Invalid URL format'}), 400
             
@@ -413,7 +377,7 @@ def create_app(config_name='production'):
             clear_expired_cache()
             
             # Check cache
-            cache_key = f"{url}-{domain}"
+            cache_key = (url, domain)
             current_time = time.time()
             
             with cache_lock:
@@ -421,41 +385,52 @@ def create_app(config_name='production'):
                     url_cache['session_ids'].get(cache_key) == session_id and
                     current_time - url_cache['timestamps'].get(cache_key, 0) <= CACHE_DURATION):
                     logger.debug(f"Cache hit for {url}")
-                    return jsonify(url_cache['data'][cache_key])
+                    # Sent as encoded when cached; re-encoded only once a pending explanation completes
+                    return app.json.body_response(url_cache['data'][cache_key].current_body(analyzer, app.json.encode))
             
-            # Process context safely
-            context_dict = {}
-            if isinstance(context, list):
-                for qa in context[:10]:  # Limit context size
-                    if isinstance(qa, dict):
-                        question = InputValidator.sanitize_string(qa.get('question', ''), 500)
-                        answer = InputValidator.sanitize_string(qa.get('answer', ''), 1000)
-                        if question and answer:
-                            context_dict[question] = answer
+            # Reuse the compiled profile of a registered context; a full context
+            # is sanitized and registered once (the analyzer limits its size)
+            profile = analyzer.resolve_context(domain, context_id, context)
+            if profile is None:
+                return jsonify({'error': 'Context expired', 'context_expired': True}), 409
             
             # Set analyzer context
-            analyzer.context_data = context_dict
+            analyzer.use_context(profile)
             
             # Perform analysis
             try:
-                analysis_result = analyzer.analyze_website(url, domain)
+                settings_version = analyzer.settings_version
+                analysis_result = analyzer.analyze_website(parsed_url, domain, session_id=session_id)
+                if analysis_result.get('rate_limited'):
+                    # Not a verdict on the URL: never cached, and the client can retry
+                    response = jsonify({'error': 'Rate limit exceeded. Please try again later.',
+                                        'rate_limited': True,
+                                        'retry_after': analysis_result['retry_after']})
+                    response.headers['Retry-After'] = str(max(1, round(analysis_result['retry_after'])))
+                    return response, 429
                 
-                result = {
-                    'isProductive': bool(analysis_result.get('isProductive', False)),
-                    'explanation': InputValidator.sanitize_string(
+                result = Verdict(
+                    isProductive=bool(analysis_result.get('isProductive', False)),
+                    explanation=InputValidator.sanitize_string(
                         analysis_result.get('explanation', ''), 500
                     ),
-                    'confidence': max(0.0, min(1.0, float(analysis_result.get('confidence', 0.5)))),
-                    'timestamp': current_time
-                }
+                    confidence=max(0.0, min(1.0, float(analysis_result.get('confidence', 0.5)))),
+                    timestamp=current_time,
+                    context_id=profile.fingerprint,
+                    # Explanation is streaming or deferred; the block page fetches it from /explain
+                    explanation_id=analysis_result.get('explanation_id') or None
+                )
                 
-                # Cache result
+                # Cache the encoded response, so cache hits send it as is
+                body = app.json.encode(result)
                 with cache_lock:
-                    url_cache['data'][cache_key] = result
-                    url_cache['timestamps'][cache_key] = current_time
-                    url_cache['session_ids'][cache_key] = session_id
+                    # Not cached if settings were swapped mid-analysis (invalidation may have run already)
+                    if analyzer.settings_version == settings_version:
+                        url_cache['data'][cache_key] = CachedResponse(result, body)
+                        url_cache['timestamps'][cache_key] = current_time
+                        url_cache['session_ids'][cache_key] = session_id
                 
-                return jsonify(result)
+                return app.json.body_response(body)
                 
             except Exception as e:
                 logger.error(f"Analysis error for {url}: {e}")
@@ -469,44 +444,135 @@ def create_app(config_name='production'):
             logger.error(f"Request processing error: {e}")
             return jsonify({'error': 'Request processing failed'}), 500
     
+    def sanitize_question_request(data):
+        """Validate a /get_question body: (domain, context, session token, answers, batch) or None."""
+        domain = InputValidator.sanitize_string(data.get('domain', ''), 100)
+        context = data.get('context', {})
+        
+        if not InputValidator.validate_domain(domain):
+            return None
+        
+        # Sanitize context
+        if isinstance(context, dict):
+            sanitized_context = {}
+            for k, v in list(context.items())[:5]:  # Limit context size
+                if isinstance(k, str) and isinstance(v, str):
+                    key = InputValidator.sanitize_string(k, 200)
+                    value = InputValidator.sanitize_string(v, 500)
+                    if key and value:
+                        sanitized_context[key] = value
+            context = sanitized_context
+        
+        # Later rounds send only the session token and the new answer(s)
+        session_token = InputValidator.sanitize_string(data.get('session') or '', 64) or None
+        batch = bool(data.get('batch'))
+        if batch:
+            answers = data.get('answers') if isinstance(data.get('answers'), list) else []
+            answers = [InputValidator.sanitize_string(answer, 1000) for answer in answers[:3]]
+        else:
+            answers = [InputValidator.sanitize_string(data.get('answer') or '', 1000)]
+        return domain, context, session_token, answers, batch
+    
+    def sanitize_question_reply(response):
+        """Sanitize the question text(s) of a /get_question reply."""
+        if isinstance(response, dict):
+            if 'question' in response:
+                response['question'] = InputValidator.sanitize_string(
+                    response['question'], 500
+                )
+            if 'questions' in response:
+                response['questions'] = [
+                    InputValidator.sanitize_string(question, 500) for question in response['questions']
+                ]
+        return response
+    
     @app.route('/get_question', methods=['POST'])
     @limiter.limit(SecurityConfig.RATE_LIMIT_STRICT)
     @validate_request_data(['domain'])
     def get_question(data):
         """Get contextual question with validation."""
         try:
-            domain = InputValidator.sanitize_string(data.get('domain', ''), 100)
-            context = data.get('context', {})
-            
-            if not InputValidator.validate_domain(domain):
+            question_request = sanitize_question_request(data)
+            if question_request is None:
                 return jsonify({'error': 'Invalid domain'}), 400
+            domain, context, session_token, answers, batch = question_request
             
-            # Sanitize context
-            if isinstance(context, dict):
-                sanitized_context = {}
-                for k, v in list(context.items())[:5]:  # Limit context size
-                    if isinstance(k, str) and isinstance(v, str):
-                        key = InputValidator.sanitize_string(k, 200)
-                        value = InputValidator.sanitize_string(v, 500)
-                        if key and value:
-                            sanitized_context[key] = value
-                context = sanitized_context
-            
-            response = analyzer.get_next_question(domain, context)
-            
-            # Sanitize response
-            if isinstance(response, dict):
-                if 'question' in response:
-                    response['question'] = InputValidator.sanitize_string(
-                        response['question'], 500
-                    )
+            if batch:
+                response = analyzer.get_question_batch(domain, context, session=session_token, answers=answers)
+            else:
+                response = analyzer.get_next_question(domain, context, session=session_token, answer=answers[0])
             
-            return jsonify(response)
+            return jsonify(sanitize_question_reply(response))
             
         except Exception as e:
             logger.error(f"Question generation error: {e}")
             return jsonify({'error': 'Question generation failed'}), 500
     
+    @app.route('/get_question/stream', methods=['POST'])
+    @limiter.limit(SecurityConfig.RATE_LIMIT_STRICT)
+    @validate_request_data(['domain'])
+    def get_question_stream(data):
+        """Server-sent events variant of /get_question.
+        
+        Sends 'token' events while the model writes the question, then one of
+        'question' (the usual /get_question body), 'done' or 'expired'.
+        """
+        question_request = sanitize_question_request(data)
+        if question_request is None:
+            return jsonify({'error': 'Invalid domain'}), 400
+        domain, context, session_token, answers, batch = question_request
+        events = analyzer.stream_questions(domain, context, session=session_token, answers=answers, batch=batch)
+        
+        def generate():
+            try:
+                for event, payload in events:
+                    if event == 'token':
+                        text = payload.replace('\x00', '')[:1500]  # Keep token whitespace; JSON encoding escapes the rest
+                        yield f"event: token\ndata: {json.dumps({'text': text})}\n\n"
+                    else:
+                        payload = sanitize_question_reply(payload)
+                        name = 'expired' if payload.get('session_expired') else 'done' if payload.get('question') == 'DONE' else 'question'
+                        yield f"event: {name}\ndata: {json.dumps(payload)}\n\n"
+            except Exception as e:
+                logger.error(f"Question stream error: {e}")
+                yield f"event: error\ndata: {json.dumps({'error': 'Question generation failed'})}\n\n"
+            finally:
+                events.close()  # Runs on client disconnect too, releasing the model stream and the worker
+        
+        return Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    @app.route('/contextualize', methods=['POST'])
+    @limiter.limit(SecurityConfig.RATE_LIMIT_STRICT)
+    @validate_request_data(['domain'])
+    def contextualize(data):
+        """Register a finished contextualization and return its context id for /analyze."""
+        try:
+            domain = data.get('domain', '').strip()
+            if not InputValidator.validate_domain(domain):
+                security_middleware.record_failed_attempt(get_remote_address())
+                return jsonify({'error': 'Invalid domain format'}), 400
+
+            profile = analyzer.register_context(domain, data.get('context', []))
+            return jsonify({'status': 'success', 'context_id': profile.fingerprint})
+
+        except Exception as e:
+            logger.error(f"Contextualize error: {e}")
+            return jsonify({'error': 'Contextualization failed'}), 500
+
+    @app.route('/explain', methods=['GET'])
+    @limiter.limit("30/minute")
+    def explain():
+        """Return the AI explanation for a verdict, generating it on first request if it was deferred."""
+        explanation_id = InputValidator.sanitize_string(request.args.get('id', ''), 64)
+        entry = analyzer.explain(explanation_id)
+        if entry is None:
+            return jsonify({'error': 'Explanation not found'}), 404
+        return jsonify({
+            'explanation': InputValidator.sanitize_string(entry['explanation'], 500),
+            'complete': entry['complete']
+        })
+    
     @app.route('/block.html')
     @app.route('/block')
     def block_page():
@@ -1037,6 +1103,7 @@ def create_app(config_name='production'):
 
 if __name__ == '__main__':
     app = create_app('development')
+    app.extensions['analyzer'].watch_settings()  # gunicorn starts it in post_worker_init
     print("🛡️  Eclipse Shield - Secure Local Mode")
     print("=====================================")
     print("🌐 Starting server at: http://localhost:5000")
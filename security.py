@@ -8,15 +8,56 @@ import secrets
 import hashlib
 import hmac
 import time
-from functools import wraps
+from functools import wraps, lru_cache
 from typing import Optional, Dict, Any
 import ipaddress
 import re
 from urllib.parse import urlparse
 import logging
 
+from urls import ParsedURL
+from rate_limits import SlidingWindowCounter
+
 logger = logging.getLogger(__name__)
 
+# Single character-class patterns used by the URL/domain scanners; none of them
+# nests a repetition, so each runs in time linear in its input
+_SCHEME_RE = re.compile(r'https?://', re.IGNORECASE)
+_HOST_RUN_RE = re.compile(r'[\dA-Za-z.\-\u0130\u0131\u017f\u212a]*')
+_DIGIT_RUN_RE = re.compile(r'\d*')
+_WHITESPACE_RE = re.compile(r'\s')
+# Non-ASCII characters that [A-Z] matches under re.IGNORECASE (listed in _HOST_RUN_RE too),
+# mapped to the ASCII letter they stand for
+_CASE_FOLD = str.maketrans({'\u0130': 'i', '\u0131': 'i', '\u017f': 's', '\u212a': 'k'})
+
+def _is_labels(names: str) -> bool:
+    """Dot-separated DNS labels, each [a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?."""
+    if not (names.isascii() and names.replace('-', '0').replace('.', '0').isalnum()):
+        return False
+    edges = '.' + names + '.'
+    if '..' in edges or '.-' in edges or '-.' in edges:
+        return False
+    return len(names) <= 63 or max(map(len, names.split('.'))) <= 63
+
+def _is_url_host(host: str) -> bool:
+    """Host part of URL_PATTERN: dotted labels ending in a 2-6 letter TLD, localhost or a dotted quad."""
+    if host[-1:].isdecimal():  # Names end in a letter or a dot
+        parts = host.split('.')
+        return len(parts) == 4 and all(0 < len(part) <= 3 and part.isdecimal() for part in parts)
+    if not host.isascii():
+        host = host.translate(_CASE_FOLD)
+        if not host.isascii():
+            return False
+    host = host.lower()
+    if host == 'localhost':
+        return True
+    labels, _, tld = (host[:-1] if host.endswith('.') else host).rpartition('.')
+    return 2 <= len(tld) <= 6 and tld.isalpha() and _is_labels(labels)
+
+def _is_url_tail(tail: str) -> bool:
+    """(?:/?|[/?]\\S+) followed by the end of the string."""
+    return tail in ('', '/') or (len(tail) > 1 and tail[0] in '/?' and not _WHITESPACE_RE.search(tail, 1))
+
 class SecurityConfig:
     """Security configuration class with secure defaults."""
     
@@ -53,11 +94,35 @@ class SecurityConfig:
         'Referrer-Policy': 'strict-origin-when-cross-origin'
     }
     
+    # CSP for extension pages and requests: extension sources allowed, no frame-ancestors
+    EXTENSION_CONTENT_SECURITY_POLICY = (
+        "default-src 'self' http://localhost:* http://127.0.0.1:* chrome-extension: moz-extension:; "
+        "script-src 'self' 'unsafe-inline' 'unsafe-eval' http://localhost:* http://127.0.0.1:* chrome-extension: moz-extension:; "
+        "style-src 'self' 'unsafe-inline' http://localhost:* http://127.0.0.1:* chrome-extension: moz-extension:; "
+        "img-src 'self' data: blob: http://localhost:* http://127.0.0.1:* chrome-extension: moz-extension:; "
+        "connect-src 'self' http://localhost:* http://127.0.0.1:* chrome-extension: moz-extension:; "
+        "font-src 'self' data: http://localhost:* http://127.0.0.1:* chrome-extension: moz-extension:; "
+        "base-uri 'self'; "
+        "form-action 'self';"
+    )
+    
+    # JSON API routes served without a session: no session cookie is read or
+    # written and no CSRF token is issued (the API does not use either)
+    STATELESS_API_PATHS = frozenset({'/analyze', '/get_question', '/get_question/stream', '/contextualize', '/health'})
+    
     # Rate limiting configuration
-    RATE_LIMIT_STORAGE_URL = 'memory://'
+    # shm:// counts in shared memory for every worker on the host (see limiter_storage.py);
+    # use a redis:// URL to share limits across hosts, or memory:// for per-worker limits
+    RATE_LIMIT_STORAGE_URL = os.getenv('RATE_LIMIT_STORAGE_URL', 'shm://')
     RATE_LIMIT_DEFAULT = '100/hour'
     RATE_LIMIT_STRICT = '10/minute'
     
+    # Failed-attempt tracking (see SecurityMiddleware)
+    FAILED_ATTEMPT_WINDOW = 3600
+    FAILED_ATTEMPT_BUCKETS = 12  # 5-minute buckets
+    FAILED_ATTEMPT_MAX_CLIENTS = int(os.getenv('FAILED_ATTEMPT_MAX_CLIENTS', '10000'))
+    FAILED_ATTEMPT_STORAGE_URL = os.getenv('FAILED_ATTEMPT_STORAGE_URL', os.getenv('REDIS_URL', ''))
+    
     # API key validation
     API_KEY_MIN_LENGTH = 20
     
@@ -73,10 +138,95 @@ class SecurityConfig:
     ALLOWED_EXTENSIONS = {'txt', 'json'}
     MAX_CONTENT_LENGTH = 1024 * 1024  # 1MB
 
+# Response header plans, built once per (route class, origin class). The route
+# class is whether the request comes from (or serves) the extension; origins are
+# classified as 'extension', 'local', 'null', 'none' (no Origin header) or 'other'.
+_CORS_METHODS = 'GET, POST, OPTIONS, PUT, DELETE'
+_CORS_HEADERS = 'Content-Type, Authorization, X-API-Key, X-CSRF-Token'
+_ECHO_ORIGIN = None  # Plan value meaning "the request's Origin"
+_TRUSTED_CORS = (('Access-Control-Allow-Origin', _ECHO_ORIGIN),
+                 ('Access-Control-Allow-Credentials', 'true'),
+                 ('Access-Control-Allow-Methods', _CORS_METHODS),
+                 ('Access-Control-Allow-Headers', _CORS_HEADERS + ', Origin, Accept'))
+_NULL_CORS = (('Access-Control-Allow-Origin', 'null'),
+              ('Access-Control-Allow-Methods', _CORS_METHODS),
+              ('Access-Control-Allow-Headers', _CORS_HEADERS))
+# Credentials are never allowed with the null origin or the wildcard
+_ANY_CORS = (('Access-Control-Allow-Origin', '*'),
+             ('Access-Control-Allow-Methods', _CORS_METHODS),
+             ('Access-Control-Allow-Headers', _CORS_HEADERS))
+_CORS_BY_ORIGIN = {
+    'extension': _TRUSTED_CORS + (('Access-Control-Expose-Headers', 'X-CSRF-Token, Content-Type'),),
+    'local': _TRUSTED_CORS + (('Access-Control-Expose-Headers', 'X-CSRF-Token, Content-Type'),),
+    'null': _NULL_CORS + (('Access-Control-Expose-Headers', 'X-CSRF-Token'),),
+    'none': _ANY_CORS + (('Access-Control-Expose-Headers', 'X-CSRF-Token'),),
+    'other': (),
+}
+_PREFLIGHT_BY_ORIGIN = {
+    'extension': _TRUSTED_CORS + (('Access-Control-Max-Age', '3600'),),
+    'local': _TRUSTED_CORS + (('Access-Control-Max-Age', '3600'),),
+    'null': _NULL_CORS + (('Access-Control-Max-Age', '3600'),),
+    'none': _ANY_CORS + (('Access-Control-Max-Age', '3600'),),
+}
+
+class HeaderPlan:
+    """A precomputed list of response headers, applied with as little header-list scanning as possible."""
+
+    __slots__ = ('items', 'names', 'echoes_origin')
+
+    def __init__(self, items):
+        self.items = tuple(items)
+        self.names = frozenset(header.lower() for header, _ in self.items)
+        self.echoes_origin = any(value is _ECHO_ORIGIN for _, value in self.items)
+
+    def apply(self, headers, origin: Optional[str] = None) -> None:
+        """Set the plan's headers, replacing any already present."""
+        items = self.items
+        if self.echoes_origin:
+            items = [(header, origin if value is _ECHO_ORIGIN else value) for header, value in items]
+        if self.names.isdisjoint(key.lower() for key in headers.keys()):
+            headers.extend(items)
+        else:
+            for header, value in items:
+                headers[header] = value
+
+def _security_headers(is_extension: bool) -> tuple:
+    plan = []
+    for header, value in SecurityConfig.SECURITY_HEADERS.items():
+        if header == 'Content-Security-Policy' and is_extension:
+            value = SecurityConfig.EXTENSION_CONTENT_SECURITY_POLICY
+        elif header == 'X-Frame-Options' and is_extension:
+            continue  # Extensions frame these pages
+        plan.append((header, value))
+    return tuple(plan)
+
+# CORS and security headers of a response, by (is_extension, origin class)
+RESPONSE_HEADER_PLANS = {
+    (is_extension, origin_class): HeaderPlan(cors + _security_headers(is_extension))
+    for is_extension in (False, True) for origin_class, cors in _CORS_BY_ORIGIN.items()
+}
+# Preflight answers by origin class; other origins are not answered by the app
+PREFLIGHT_HEADER_PLANS = {origin_class: HeaderPlan(items) for origin_class, items in _PREFLIGHT_BY_ORIGIN.items()}
+
+@lru_cache(maxsize=1024)
+def classify_origin(origin: Optional[str]) -> str:
+    """Origin class of an Origin header value; memoized."""
+    if not origin:
+        return 'none'
+    if origin.startswith(('chrome-extension://', 'moz-extension://')):
+        return 'extension'
+    if origin in ('http://localhost:5000', 'http://127.0.0.1:5000'):
+        return 'local'
+    if origin == 'null':
+        return 'null'
+    return 'other'
+
 class InputValidator:
     """Input validation utilities."""
     
-    # Regex patterns for validation
+    # Regex patterns for validation. URL_PATTERN and DOMAIN_PATTERN are the
+    # reference grammar; validate_url/validate_domain check the same grammar with
+    # the linear-time scanners is_url_syntax/is_domain_syntax
     URL_PATTERN = re.compile(
         r'^https?://'  # http:// or https://
         r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+[A-Z]{2,6}\.?|'  # domain...
@@ -92,16 +242,47 @@ class InputValidator:
     )
     
     @staticmethod
-    def validate_url(url: str) -> bool:
-        """Validate URL format and security."""
-        if not url or len(url) > 2048:  # URL length limit
+    def is_url_syntax(url: str) -> bool:
+        """Same result as bool(URL_PATTERN.match(url)), in linear time.
+
+        The host is the longest run of host characters after the scheme: the
+        pattern cannot end it earlier, since a port, path, query or the end of
+        the string must follow it. Like '$', a single trailing newline is ignored.
+        """
+        scheme = _SCHEME_RE.match(url)
+        if not scheme:
+            return False
+        position = _HOST_RUN_RE.match(url, scheme.end()).end()
+        if not _is_url_host(url[scheme.end():position]):
+            return False
+        if url.startswith(':', position):
+            port_end = _DIGIT_RUN_RE.match(url, position + 1).end()
+            if port_end > position + 1:
+                position = port_end
+        tail = url[position:]
+        return _is_url_tail(tail) or (tail.endswith('\n') and _is_url_tail(tail[:-1]))
+
+    @staticmethod
+    def is_domain_syntax(domain: str) -> bool:
+        """Same result as bool(DOMAIN_PATTERN.match(domain)), in linear time."""
+        if domain.endswith('\n'):
+            domain = domain[:-1]
+        return _is_labels(domain)
+
+    @staticmethod
+    def validate_url(url) -> bool:
+        """Validate URL format and security (url is a string or a ParsedURL)."""
+        parsed_url = url if isinstance(url, ParsedURL) else None
+        if parsed_url is not None:
+            url = parsed_url.url
+        if not url or not isinstance(url, str) or len(url) > 2048:  # URL length limit
             return False
             
-        if not InputValidator.URL_PATTERN.match(url):
+        if not InputValidator.is_url_syntax(url):
             return False
             
         try:
-            parsed = urlparse(url)
+            parsed = parsed_url.parts if parsed_url is not None else urlparse(url)
             
             # Block dangerous schemes
             if parsed.scheme not in ['http', 'https']:
@@ -131,7 +312,7 @@ class InputValidator:
         """Validate domain format."""
         if not domain or len(domain) > 253:
             return False
-        return bool(InputValidator.DOMAIN_PATTERN.match(domain))
+        return InputValidator.is_domain_syntax(domain)
     
     @staticmethod
     def sanitize_string(text: str, max_length: int = 1000) -> str:
@@ -161,46 +342,36 @@ class InputValidator:
         return True, "Valid"
 
 class SecurityMiddleware:
-    """Security middleware for request processing."""
+    """Security middleware for request processing.
+
+    Failed attempts are counted per client IP in a SlidingWindowCounter:
+    fixed memory per IP, at most FAILED_ATTEMPT_MAX_CLIENTS IPs (idle ones
+    evicted first) and O(1) checks. Set FAILED_ATTEMPT_STORAGE_URL (or
+    REDIS_URL) to count failures across all workers.
+    """
     
-    def __init__(self, app):
+    def __init__(self, app, window: int = None, max_clients: int = None, storage_url: str = None):
         self.app = app
-        self.failed_attempts = {}  # Simple in-memory store
-        self.cleanup_time = time.time()
+        self.failed_attempts = SlidingWindowCounter(
+            window=window or SecurityConfig.FAILED_ATTEMPT_WINDOW,
+            buckets=SecurityConfig.FAILED_ATTEMPT_BUCKETS,
+            max_keys=max_clients or SecurityConfig.FAILED_ATTEMPT_MAX_CLIENTS,
+            namespace='failed-attempts',
+            url=SecurityConfig.FAILED_ATTEMPT_STORAGE_URL if storage_url is None else storage_url)
     
     def cleanup_failed_attempts(self):
-        """Clean up old failed attempts."""
-        current_time = time.time()
-        if current_time - self.cleanup_time > 3600:  # Clean every hour
-            cutoff_time = current_time - 3600  # Keep last hour
-            self.failed_attempts = {
-                ip: attempts for ip, attempts in self.failed_attempts.items()
-                if any(attempt_time > cutoff_time for attempt_time in attempts)
-            }
-            self.cleanup_time = current_time
+        """Drop clients without failures in the window."""
+        dropped = self.failed_attempts.expire()
+        if dropped:
+            logger.debug(f"SecurityMiddleware.cleanup_failed_attempts - Dropped {dropped} idle clients")
     
     def is_rate_limited(self, client_ip: str, max_attempts: int = 10, window: int = 3600) -> bool:
         """Check if client IP is rate limited."""
-        self.cleanup_failed_attempts()
-        
-        current_time = time.time()
-        if client_ip not in self.failed_attempts:
-            return False
-        
-        # Count attempts in the time window
-        recent_attempts = [
-            attempt_time for attempt_time in self.failed_attempts[client_ip]
-            if current_time - attempt_time < window
-        ]
-        
-        return len(recent_attempts) >= max_attempts
+        return self.failed_attempts.count(client_ip, window) >= max_attempts
     
     def record_failed_attempt(self, client_ip: str):
         """Record a failed attempt."""
-        current_time = time.time()
-        if client_ip not in self.failed_attempts:
-            self.failed_attempts[client_ip] = []
-        self.failed_attempts[client_ip].append(current_time)
+        self.failed_attempts.add(client_ip)
 
 def generate_csrf_token() -> str:
     """Generate a CSRF token."""
@@ -0,0 +1,85 @@
+"""
+Shared cache for Eclipse Shield.
+A small process-local LRU in front of an optional Redis store, so entries
+computed by one gunicorn worker are reused by the others. Without Redis (or
+if it is unreachable) the cache is process-local; entries added before the
+workers fork (preload_app) are still inherited by every worker.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+class SharedCache:
+    """String cache with LRU eviction, optional TTL and an optional Redis tier."""
+
+    def __init__(self, namespace: str, max_entries: int = 1000, ttl: Optional[int] = None,
+                 url: Optional[str] = None):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, expires or None), least recently used first
+        self._lock = threading.Lock()
+        self._redis = None
+        if url:
+            if redis is None:
+                logger.warning(f"SharedCache - redis package not installed, '{namespace}' cache is process-local")
+            else:
+                self._redis = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached value or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+
+        if self._redis is None:
+            return None
+        try:
+            value = self._redis.get(f"{self.namespace}:{key}")
+        except Exception as e:
+            logger.debug(f"SharedCache.get - Redis unavailable: {e}")
+            return None
+        if value is None:
+            return None
+        value = value.decode('utf-8')
+        self._store_local(key, value)
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        """Cache a value locally and, if configured, for the other workers."""
+        self._store_local(key, value)
+        if self._redis is None:
+            return
+        try:
+            self._redis.set(f"{self.namespace}:{key}", value, ex=self.ttl)
+        except Exception as e:
+            logger.debug(f"SharedCache.set - Redis unavailable: {e}")
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _store_local(self, key: str, value: str) -> None:
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
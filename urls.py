@@ -0,0 +1,112 @@
+"""
+Parsed URLs for Eclipse Shield.
+One normalized, immutable view of a URL shared by validation, URL signals,
+context relevance and the rule stages, so each request parses and lowercases
+its URL once instead of once per stage.
+"""
+
+import re
+from urllib.parse import urlparse, unquote, ParseResult
+from typing import Optional, Tuple, Union
+
+# Query parameters that carry a search query
+SEARCH_QUERY_KEYS = ('q', 'query', 'search', 's', 'k', 'keyword')
+
+_TOKEN_SPLIT_RE = re.compile(r"[/.\-_?=&+:#\s]+")
+_UNSET = object()
+
+def tokenize(text: str) -> list:
+    """Lowercase and split a URL, query or term on / . - _ ? = & + : # and whitespace."""
+    return [token for token in _TOKEN_SPLIT_RE.split(text.lower()) if token]
+
+class ParsedURL:
+    """Immutable parsed URL; every field is computed on first use and then kept."""
+
+    __slots__ = ('url', '_parts', '_lower', '_host', '_labels', '_path_lower', '_path_tokens',
+                 '_query_params', '_search_query', '_tokens')
+
+    def __init__(self, url: str):
+        object.__setattr__(self, 'url', url)
+        for name in self.__slots__[1:]:
+            object.__setattr__(self, name, _UNSET)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ParsedURL is immutable")
+
+    def __str__(self) -> str:
+        return str(self.url)
+
+    def __repr__(self) -> str:
+        return f"ParsedURL({self.url!r})"
+
+    def _keep(self, name: str, value):
+        object.__setattr__(self, name, value)
+        return value
+
+    @property
+    def parts(self) -> ParseResult:
+        """urlparse() result (raises ValueError for malformed URLs, like urlparse)."""
+        if self._parts is _UNSET:
+            return self._keep('_parts', urlparse(self.url))
+        return self._parts
+
+    @property
+    def lower(self) -> str:
+        if self._lower is _UNSET:
+            return self._keep('_lower', self.url.lower())
+        return self._lower
+
+    @property
+    def host(self) -> str:
+        """Lowercased network location (may include a port)."""
+        if self._host is _UNSET:
+            return self._keep('_host', self.parts.netloc.lower())
+        return self._host
+
+    @property
+    def labels(self) -> Tuple[str, ...]:
+        """Host labels, e.g. ('docs', 'python', 'org')."""
+        if self._labels is _UNSET:
+            return self._keep('_labels', tuple(label for label in self.host.split('.') if label))
+        return self._labels
+
+    @property
+    def path_lower(self) -> str:
+        if self._path_lower is _UNSET:
+            return self._keep('_path_lower', self.parts.path.lower())
+        return self._path_lower
+
+    @property
+    def path_tokens(self) -> Tuple[str, ...]:
+        """Non-empty, lowercased path segments."""
+        if self._path_tokens is _UNSET:
+            return self._keep('_path_tokens', tuple(part for part in self.path_lower.split('/') if part))
+        return self._path_tokens
+
+    @property
+    def query_params(self) -> Tuple[Tuple[str, str], ...]:
+        """(key, raw value) pairs of the query string in order, without parameters lacking '='."""
+        if self._query_params is _UNSET:
+            params = tuple(tuple(param.split('=', 1)) for param in self.parts.query.split('&') if '=' in param)
+            return self._keep('_query_params', params)
+        return self._query_params
+
+    @property
+    def search_query(self) -> Optional[str]:
+        """Decoded, lowercased value of the first search parameter (see SEARCH_QUERY_KEYS), or None."""
+        if self._search_query is _UNSET:
+            query = next((unquote(value.lower()) for key, value in self.query_params
+                          if key.lower() in SEARCH_QUERY_KEYS), None)
+            return self._keep('_search_query', query)
+        return self._search_query
+
+    @property
+    def tokens(self) -> Tuple[str, ...]:
+        """The whole URL tokenized as for context matching (see tokenize)."""
+        if self._tokens is _UNSET:
+            return self._keep('_tokens', tuple(token for token in _TOKEN_SPLIT_RE.split(self.lower) if token))
+        return self._tokens
+
+def parse_url(url: Union[str, ParsedURL]) -> ParsedURL:
+    """Wrap a URL string; an already parsed URL is returned as is."""
+    return url if isinstance(url, ParsedURL) else ParsedURL(url)